@@ -1,29 +1,254 @@
+"""
+Build a batch of raster catalogs from a job list in a JSON config file.  The jobs run in this process, or with -w on a
+pool of long-lived worker processes that import arcpy and the catalog builders once when they start, so the
+interpreter and arcpy start-up cost is paid once per worker instead of once per catalog.
 
+File geodatabases take schema locks, so the jobs that write to the same geodatabase (same outdir and gdb_name) always
+run one after the other in one worker, whatever the number of workers, only jobs with different geodatabases run at
+the same time.  The jobs of the shipped batch_raster_catalogs.json all write to the default gdb_name in one outdir and
+run one after the other, give them their own gdb_name to run them in parallel.
+
+Config file layout (see batch_raster_catalogs.json):
+    {
+        "workers": 1,
+        "defaults": {"outdir": "D:/.../Animations"},
+        "jobs": [
+            {"indir": "D:/.../ChangeMap", "rc_name": "ChangeMap"},
+            {"indir": "D:/.../AccumulatedChange/Change", "rc_name": "AccumChange", "script": "rasters_to_catalog",
+             "gdb_name": "Animations.gdb"}
+        ]
+    }
+
+Every job is passed to the main_work of its script (puget_raster_catalogs by default) after the defaults are applied.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+
+import argparse
+import collections
+import datetime as dt
+import json
+import multiprocessing
 import os
-import subprocess
+import sys
+import time
+import traceback
+
+SCRIPTS = ("puget_raster_catalogs", "rasters_to_catalog")
+
+
+def get_time():
+    """
+    Return the current time
+    :return:
+    """
+    return dt.datetime.now()
+
+
+def read_config(config):
+    """
+    Read the job list
+    :param config: <str> The full path to the JSON config file
+    :return: <tuple> (jobs, workers) where jobs is a list of dicts with the defaults applied
+    """
+    with open(config) as f:
+        doc = json.load(f)
+
+    defaults = doc.get("defaults", dict())
+
+    jobs = list()
+
+    for job in doc["jobs"]:
+        merged = dict(defaults)
+
+        merged.update(job)
+
+        merged.setdefault("script", SCRIPTS[0])
+
+        if merged["script"] not in SCRIPTS:
+            raise ValueError("Unknown script %s, must be one of %s" % (merged["script"], ", ".join(SCRIPTS)))
+
+        jobs.append(merged)
+
+    return jobs, doc.get("workers", 1)
+
+
+def target_gdb(job):
+    """
+    Return the geodatabase a job writes to, the catalogs of both scripts go to outdir (indir by default), one
+    geodatabase per block subdirectory for puget_raster_catalogs
+    :param job: <dict> A job with the defaults applied
+    :return: <str> A normalized path that identifies the geodatabase
+    """
+    gdb_name = job.get("gdb_name", "Animations.gdb")
+
+    if not gdb_name.endswith(".gdb"):
+        gdb_name += ".gdb"
+
+    return os.path.normcase(os.path.abspath(os.path.join(job.get("outdir") or job["indir"], gdb_name)))
+
+
+def group_jobs(jobs):
+    """
+    Group the jobs by the geodatabase they write to, see target_gdb
+    :param jobs: <list> Job dicts
+    :return: <list> Lists of (index, job dict) tuples, in the order of the first job of each group
+    """
+    groups = collections.OrderedDict()
+
+    for indexed_job in enumerate(jobs):
+        groups.setdefault(target_gdb(indexed_job[1]), list()).append(indexed_job)
+
+    return list(groups.values())
+
+
+def warm_worker():
+    """
+    Pool initializer, pays the arcpy import once per worker process
+    :return:
+    """
+    import arcpy
+
+    for script in SCRIPTS:
+        __import__(script)
+
+    return None
+
+
+def run_job(indexed_job):
+    """
+    Run one catalog job
+    :param indexed_job: <tuple> (index, job dict)
+    :return: <tuple> (index, rc_name, seconds, error message or None)
+    """
+    index, job = indexed_job
+
+    job = dict(job)
+
+    module = __import__(job.pop("script"))
+
+    t1 = time.time()
+
+    print("Started job %s: %s" % (index + 1, job["rc_name"]))
+
+    sys.stdout.flush()
+
+    try:
+        module.main_work(**job)
+
+    except Exception:
+        return index, job["rc_name"], time.time() - t1, traceback.format_exc()
+
+    return index, job["rc_name"], time.time() - t1, None
+
+
+def run_group(args):
+    """
+    Run the jobs that write to one geodatabase one after the other, reporting each job as it finishes
+    :param args: <tuple> (list of (index, job dict) tuples, see group_jobs, the number of jobs)
+    :return: <list> See run_job
+    """
+    group, total = args
+
+    results = list()
+
+    for indexed_job in group:
+        results.append(run_job(indexed_job))
+
+        report(results[-1], total)
+
+    return results
+
+
+def main_work(config, workers=None):
+    """
+    Run every job of the config file
+    :param config: <str> The full path to the JSON config file
+    :param workers: <int> The number of worker processes, overrides the config file, 0 or 1 runs in this process
+    :return: <list> (index, rc_name, seconds, error message or None) tuples
+    """
+    jobs, config_workers = read_config(config)
+
+    if workers is None:
+        workers = config_workers
+
+    results = list()
+
+    groups = group_jobs(jobs)
+
+    if workers > 1 and len(groups) > 1:
+        pool = multiprocessing.Pool(min(workers, len(groups)), warm_worker)
+
+        try:
+            for group_results in pool.imap_unordered(run_group, [(group, len(jobs)) for group in groups], 1):
+                results.extend(group_results)
+
+        finally:
+            pool.close()
+
+            pool.join()
+
+    else:
+        warm_worker()
+
+        for indexed_job in enumerate(jobs):
+            results.append(run_job(indexed_job))
+
+            report(results[-1], len(jobs))
+
+    failed = [r for r in results if r[3] is not None]
+
+    print("%s of %s jobs finished, %s failed, %.1f s of job time" % (len(results) - len(failed), len(jobs),
+                                                                     len(failed), sum(r[2] for r in results)))
+
+    return results
+
+
+def report(result, total):
+    """
+    Print the status of a finished job
+    :param result: <tuple> See run_job
+    :param total: <int> The number of jobs
+    :return:
+    """
+    index, name, seconds, error = result
+
+    if error is None:
+        print("Finished job %s of %s: %s in %.1f s" % (index + 1, total, name, seconds))
+
+    else:
+        print("FAILED job %s of %s: %s after %.1f s\n%s" % (index + 1, total, name, seconds, error))
+
+    sys.stdout.flush()
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("-c", dest="config", type=str, required=True,
+                        help="The full path to the JSON config file with the job list")
+
+    parser.add_argument("-w", "--workers", dest="workers", type=int, required=False,
+                        help="Optional, the number of worker processes, overrides the config file.  Jobs that "
+                             "write to the same geodatabase always run one after the other")
+
+    args = parser.parse_args()
+
+    results = main_work(**vars(args))
+
+    return 1 if any(r[3] is not None for r in results) else 0
+
 
 if __name__ == "__main__":
+    t1 = get_time()
+
+    code = main()
+
+    t2 = get_time()
+
+    print("Processing Time: %s" % str(t2 - t1))
 
-    names = ["CoverSec", "ChangeMap", "ChangeMagMap", "LastChange", "SegLength", "QAMap", "CoverConfPrim",
-             "CoverConfSec"]
-    acc_names = ["Change", "Cover"]
-
-    interpreter = r"C:\Python27\ArcGIS10.5\python.exe"
-
-    script = r"C:\Users\dzelenak\PycharmProjects\ArcPy_Tools\puget_raster_catalogs.py"
-
-    for n in names:
-        subprocess.call([
-            interpreter, script,
-            "-i", r"D:\LCMAP\PugetSound\regional\aoi_clipped_blocks" + os.sep + n,
-            "-o", r"D:\LCMAP\PugetSound\regional\aoi_clipped_blocks\Animations",
-            "-rc", n
-        ])
-
-    for n in acc_names:
-        subprocess.call([
-            interpreter, script,
-            "-i", r"D:\LCMAP\PugetSound\regional\aoi_clipped_blocks\AccumulatedChange" + os.sep + n,
-            "-o", r"D:\LCMAP\PugetSound\regional\aoi_clipped_blocks\Animations",
-            "-rc", "Accum%s" % n
-        ])
+    sys.exit(code)
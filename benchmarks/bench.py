@@ -0,0 +1,284 @@
+"""
+Benchmark every tool of the repository on synthetic data with a local arcpy stand-in.
+
+Each (case, size) pair gets a fresh work directory with synthetic inputs and runs in its own process, so that the
+peak resident memory of one case doesn't leak into the next.  Wall time, peak RSS, items/s and the MB of outputs the
+case left in its work directory are printed and saved as JSON; a previous results file can be given with --compare to
+flag regressions.
+
+Example:
+    python benchmarks/bench.py --sizes small medium -o results.json
+    python benchmarks/bench.py --sizes small medium --compare results.json
+
+Requires numpy, does not need (or use) ArcGIS.
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+REPO = os.path.dirname(HERE)
+
+# The stand-in has to shadow any real arcpy, and the tools are imported from the repository root
+for path in (REPO, HERE, os.path.join(HERE, "standin")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def get_time():
+    """
+    Return the current time
+    :return:
+    """
+    return dt.datetime.now()
+
+
+def peak_rss_mb(who="self"):
+    """
+    Return the peak resident set size of this process or of its largest child, in MB
+    :param who: <str> "self" or "children"
+    :return: <float> None when it can't be measured on this platform
+    """
+    # On Linux ru_maxrss survives exec, so a child would report the peak of the parent that set up its data;
+    # VmHWM belongs to the new address space
+    if who == "self" and os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+
+    try:
+        import resource
+
+    except ImportError:
+        try:
+            import psutil
+
+        except ImportError:
+            return None
+
+        if who != "self":
+            return None
+
+        info = psutil.Process().memory_info()
+
+        return getattr(info, "peak_wset", info.rss) / 1024.0 / 1024.0
+
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+
+    # Bytes on macOS, kilobytes elsewhere
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+
+    return usage.ru_maxrss / scale
+
+
+def tree_size_mb(root):
+    """
+    Return the size of the files under a directory, in MB
+    :param root: <str>
+    :return: <float>
+    """
+    total = 0
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+
+            except OSError:
+                pass
+
+    return total / 1024.0 / 1024.0
+
+
+def run_child(case_name, size, workdir, result_path):
+    """
+    Run one case in this process and write its measurements to result_path
+    """
+    import cases
+
+    case = cases.CASES[case_name]
+
+    os.chdir(workdir)
+
+    before = tree_size_mb(workdir)
+
+    t1 = time.time()
+
+    items = case.run(workdir, case.sizes[size])
+
+    wall = time.time() - t1
+
+    result = {"case": case_name, "size": size, "params": case.sizes[size], "wall_s": wall, "items": items,
+              "items_per_s": items / wall if wall > 0 else None, "peak_rss_mb": peak_rss_mb("self"),
+              "peak_child_rss_mb": peak_rss_mb("children"), "output_mb": tree_size_mb(workdir) - before}
+
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+    return None
+
+
+def run_case(case_name, size, keep=False):
+    """
+    Set up a work directory and run one case in a child process
+    :return: <dict> The measurements
+    """
+    import cases
+
+    case = cases.CASES[case_name]
+
+    workdir = tempfile.mkdtemp(prefix="bench_%s_%s_" % (case_name, size))
+
+    try:
+        case.setup(workdir, case.sizes[size])
+
+        result_path = os.path.join(workdir, "result.json")
+
+        with open(os.path.join(workdir, "output.log"), "w") as log:
+            code = subprocess.call([sys.executable, os.path.abspath(__file__), "--child", case_name, size, workdir,
+                                    result_path], stdout=log, stderr=subprocess.STDOUT)
+
+        if code != 0:
+            with open(os.path.join(workdir, "output.log")) as log:
+                tail = log.read()[-2000:]
+
+            return {"case": case_name, "size": size, "error": "exit code %s\n%s" % (code, tail)}
+
+        with open(result_path) as f:
+            return json.load(f)
+
+    finally:
+        if keep:
+            print("  kept %s" % workdir)
+
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO).decode("ascii").strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Print the change in wall time against a previous results file
+    :return: <list> The (case, size) pairs that got slower by more than the threshold
+    """
+    with open(baseline_path) as f:
+        baseline = dict(((r["case"], r["size"]), r) for r in json.load(f)["results"] if "error" not in r)
+
+    regressions = list()
+
+    print("\n%-45s %-7s %10s %10s %8s" % ("Case", "Size", "Base s", "New s", "Change"))
+
+    for r in results:
+        old = baseline.get((r["case"], r["size"]))
+
+        if old is None or "error" in r:
+            continue
+
+        change = r["wall_s"] / old["wall_s"] - 1.0 if old["wall_s"] > 0 else 0.0
+
+        flag = ""
+
+        if change > threshold:
+            flag = "  REGRESSION"
+
+            regressions.append((r["case"], r["size"]))
+
+        print("%-45s %-7s %10.2f %10.2f %+7.0f%%%s" % (r["case"], r["size"], old["wall_s"], r["wall_s"],
+                                                       change * 100, flag))
+
+    return regressions
+
+
+def main():
+    import cases
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("--cases", dest="cases", nargs="*", default=list(cases.CASES),
+                        help="The cases to run, default is all of them: %s" % ", ".join(cases.CASES))
+
+    parser.add_argument("--sizes", dest="sizes", nargs="*", default=["small", "medium"],
+                        choices=["small", "medium", "large"],
+                        help="The data sizes to run, default is small and medium")
+
+    parser.add_argument("-o", "--output", dest="output", type=str, required=False,
+                        help="Save the results to this JSON file")
+
+    parser.add_argument("--compare", dest="baseline", type=str, required=False,
+                        help="A previous results file to compare the wall times against")
+
+    parser.add_argument("--threshold", dest="threshold", type=float, default=0.25,
+                        help="The slowdown counted as a regression, default is 0.25 (25%%)")
+
+    parser.add_argument("--keep", dest="keep", action="store_true",
+                        help="Keep the work directories for inspection")
+
+    args = parser.parse_args()
+
+    unknown = [c for c in args.cases if c not in cases.CASES]
+
+    if unknown:
+        parser.error("Unknown cases: %s" % ", ".join(unknown))
+
+    results = list()
+
+    print("%-45s %-7s %10s %10s %12s %10s" % ("Case", "Size", "Wall s", "Peak MB", "Items/s", "Output MB"))
+
+    for name in args.cases:
+        for size in args.sizes:
+            r = run_case(name, size, args.keep)
+
+            results.append(r)
+
+            if "error" in r:
+                print("%-45s %-7s FAILED: %s" % (name, size, r["error"]))
+
+                continue
+
+            peak = max(v for v in (r["peak_rss_mb"], r["peak_child_rss_mb"], 0.0) if v is not None)
+
+            print("%-45s %-7s %10.2f %10.1f %12.1f %10.1f" % (name, size, r["wall_s"], peak, r["items_per_s"] or 0.0,
+                                                           r.get("output_mb", 0.0)))
+
+    report = {"created": get_time().isoformat(), "python": sys.version.split()[0], "platform": platform.platform(),
+              "commit": git_commit(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print("Results saved to %s" % args.output)
+
+    regressions = list()
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+
+    failed = [r for r in results if "error" in r]
+
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(*sys.argv[2:6])
+
+    else:
+        sys.exit(main())
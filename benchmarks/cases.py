@@ -0,0 +1,367 @@
+"""
+Benchmark cases: one entry per tool (and per engine/mode where a tool has several), each with a setup that writes
+synthetic inputs into a work directory and a run that calls the tool's entry point and returns the number of items
+it processed.
+"""
+
+import collections
+import json
+import os
+import numpy as np
+
+import synthetic
+
+Case = collections.namedtuple("Case", ["name", "setup", "run", "sizes"])
+
+# The block layout of the Puget Sound study area, the catalog builder assumes these 35 blocks
+PUGET_BLOCKS = list(range(1, 36))
+
+CASES = collections.OrderedDict()
+
+
+def register(name, sizes):
+    def wrap(pair):
+        setup, run = pair
+
+        CASES[name] = Case(name, setup, run, sizes)
+
+        return pair
+
+    return wrap
+
+
+def years_of(p):
+    return [str(y) for y in range(1984, 1984 + p["years"])]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def setup_overlaps(workdir, p):
+    synthetic.write_overlapping_polygons(os.path.join(workdir, "data.gdb", "polys"), p["n"],
+                                         np.random.RandomState(1))
+
+
+def run_overlaps(workdir, p):
+    import count_overlaps
+
+    count_overlaps.main(os.path.join(workdir, "data.gdb"), "polys")
+
+    return p["n"]
+
+
+register("count_overlaps", {"small": {"n": 300}, "medium": {"n": 1500}, "large": {"n": 6000}})(
+    (setup_overlaps, run_overlaps))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+CLIP_SIZES = {"small": {"nx": 3, "ny": 3, "years": 4, "size": 600},
+              "medium": {"nx": 5, "ny": 7, "years": 8, "size": 1200},
+              "large": {"nx": 5, "ny": 7, "years": 32, "size": 2000}}
+
+
+def setup_clip(workdir, p):
+    rng = np.random.RandomState(2)
+
+    synthetic.write_annual_rasters(os.path.join(workdir, "in"), "ChangeMap", years_of(p), p["size"], p["size"], rng)
+
+    synthetic.write_blocks(os.path.join(workdir, "in", "blocks.shp"), p["nx"], p["ny"], p["size"], p["size"], rng)
+
+
+def clip_runner(engine, workers=1, out_format="none", stats=None):
+    def run(workdir, p):
+        import multi_feature_clip_raster
+
+        multi_feature_clip_raster.main_work(os.path.join(workdir, "in"), os.path.join(workdir, "out"),
+                                            os.path.join(workdir, "in", "blocks.shp"), "ChangeMap", field="id",
+                                            years=years_of(p), engine=engine, workers=workers,
+                                            out_format=out_format,
+                                            stats=None if stats is None else os.path.join(workdir, stats))
+
+        return p["nx"] * p["ny"] * p["years"]
+
+    return run
+
+
+register("multi_feature_clip_raster.numpy", CLIP_SIZES)((setup_clip, clip_runner("numpy")))
+
+register("multi_feature_clip_raster.arcpy", CLIP_SIZES)((setup_clip, clip_runner("arcpy")))
+
+register("multi_feature_clip_raster.numpy.workers4", CLIP_SIZES)((setup_clip, clip_runner("numpy", 4)))
+
+# Compressed outputs, compare the Output MB and wall time with multi_feature_clip_raster.numpy
+for _format in ("lzw", "deflate"):
+    register("multi_feature_clip_raster.numpy.%s" % _format, CLIP_SIZES)((setup_clip,
+                                                                          clip_runner("numpy", 1, _format)))
+
+register("multi_feature_clip_raster.numpy.lzw.workers4", CLIP_SIZES)((setup_clip, clip_runner("numpy", 4, "lzw")))
+
+# Zonal statistics in the clip pass, compare with multi_feature_clip_raster.numpy and zonal_stats.reread
+register("multi_feature_clip_raster.numpy.stats", CLIP_SIZES)((setup_clip, clip_runner("numpy", 1, "none",
+                                                                                       "stats.csv")))
+
+register("multi_feature_clip_raster.numpy.stats.workers4", CLIP_SIZES)((setup_clip, clip_runner("numpy", 4, "none",
+                                                                                                "stats.csv")))
+
+
+def setup_stats_reread(workdir, p):
+    setup_clip(workdir, p)
+
+    clip_runner("numpy")(workdir, p)
+
+
+def stats_reread(workdir, p):
+    # The second job the statistics of the clip pass replace: read every output again
+    import arcpy
+    import zonal_stats
+
+    stats = zonal_stats.ZonalStats("ChangeMap", 255)
+
+    for block in range(1, p["nx"] * p["ny"] + 1):
+        for year in years_of(p):
+            name = os.path.join(workdir, "out", "block_%s" % block, "ChangeMap_block_%s_%s.tif" % (block, year))
+
+            stats.add_data(block, year, arcpy.RasterToNumPyArray(name, nodata_to_value=255))
+
+    stats.write(os.path.join(workdir, "stats.csv"))
+
+    return p["nx"] * p["ny"] * p["years"]
+
+
+register("zonal_stats.reread", CLIP_SIZES)((setup_stats_reread, stats_reread))
+
+register("multi_feature_clip_raster.cube", CLIP_SIZES)((setup_clip, clip_runner("numpy", 1, "cube")))
+
+register("multi_feature_clip_raster.cube.workers4", CLIP_SIZES)((setup_clip, clip_runner("numpy", 4, "cube")))
+
+
+def setup_histories(workdir, p):
+    setup_clip(workdir, p)
+
+    for out_format in ("none", "cube"):
+        clip_runner("numpy", 1, out_format)(workdir, p)
+
+
+def history_runner(out_format, pixels=50):
+    def run(workdir, p):
+        from arcpy import _storage
+        import raster_cube
+
+        rng = np.random.RandomState(5)
+
+        for block in range(1, p["nx"] * p["ny"] + 1):
+            subdir = os.path.join(workdir, "out", "block_%s" % block)
+
+            if out_format == "cube":
+                with raster_cube.RasterCube(os.path.join(subdir, "ChangeMap_block_%s.cube" % block)) as cube:
+                    for row, col in zip(rng.randint(0, cube.nrows, pixels), rng.randint(0, cube.ncols, pixels)):
+                        cube.history(row, col)
+
+                continue
+
+            # One file per year, every history opens all of them
+            names = [os.path.join(subdir, "ChangeMap_block_%s_%s.tif" % (block, year)) for year in years_of(p)]
+
+            nrows, ncols = _storage.read_raster(names[0]).shape
+
+            for row, col in zip(rng.randint(0, nrows, pixels), rng.randint(0, ncols, pixels)):
+                [_storage.read_raster(name)[row, col] for name in names]
+
+        return p["nx"] * p["ny"] * pixels
+
+    return run
+
+
+# Pixel time series read from the yearly GeoTiffs and from the cubes of the same clips
+for _format in ("none", "cube"):
+    register("pixel_history.%s" % _format, CLIP_SIZES)((setup_histories, history_runner(_format)))
+
+
+def setup_accumulated(workdir, p):
+    rng = np.random.RandomState(3)
+
+    synthetic.write_annual_rasters(os.path.join(workdir, "in"), "AccumChange", years_of(p), p["size"], p["size"],
+                                   rng)
+
+    synthetic.write_blocks(os.path.join(workdir, "in", "blocks.shp"), p["nx"], p["ny"], p["size"], p["size"], rng)
+
+
+def accumulated_runner(engine):
+    def run(workdir, p):
+        import clip_accumulated_change
+
+        clip_accumulated_change.main_work(os.path.join(workdir, "in"), os.path.join(workdir, "out"),
+                                          os.path.join(workdir, "in", "blocks.shp"), "Change", field="id",
+                                          engine=engine)
+
+        return p["nx"] * p["ny"] * p["years"]
+
+    return run
+
+
+register("clip_accumulated_change.numpy", CLIP_SIZES)((setup_accumulated, accumulated_runner("numpy")))
+
+register("clip_accumulated_change.arcpy", CLIP_SIZES)((setup_accumulated, accumulated_runner("arcpy")))
+
+
+def setup_annual(workdir, p):
+    rng = np.random.RandomState(3)
+
+    for product in ("ChangeMap", "CoverPrim"):
+        synthetic.write_annual_rasters(os.path.join(workdir, "in"), product, years_of(p), p["size"], p["size"], rng)
+
+    synthetic.write_blocks(os.path.join(workdir, "in", "blocks.shp"), p["nx"], p["ny"], p["size"], p["size"], rng)
+
+
+def accumulate_runner(out_prod, workers=1):
+    def run(workdir, p):
+        import clip_accumulated_change
+
+        clip_accumulated_change.main_work(os.path.join(workdir, "in"), os.path.join(workdir, "out"),
+                                          os.path.join(workdir, "in", "blocks.shp"), out_prod, field="id",
+                                          workers=workers, accumulate=True)
+
+        return p["nx"] * p["ny"] * p["years"]
+
+    return run
+
+
+for _prod in ("Change", "Cover"):
+    register("clip_accumulated_change.accumulate.%s" % _prod, CLIP_SIZES)((setup_annual, accumulate_runner(_prod)))
+
+register("clip_accumulated_change.accumulate.Change.workers4", CLIP_SIZES)((setup_annual,
+                                                                           accumulate_runner("Change", 4)))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+NETCDF_SIZES = {"small": {"files": 2, "size": 500}, "medium": {"files": 4, "size": 1500},
+                "large": {"files": 8, "size": 3000}}
+
+
+def setup_netcdf(workdir, p):
+    synthetic.write_netcdf(os.path.join(workdir, "nc"), p["files"], p["size"], p["size"], np.random.RandomState(4))
+
+
+def netcdf_runner(mode, out_format="none"):
+    def run(workdir, p):
+        import netcdf_shifter
+
+        netcdf_shifter.main_work(os.path.join(workdir, "nc"), os.path.join(workdir, "out"), mode=mode,
+                                 out_format=out_format)
+
+        return p["files"]
+
+    return run
+
+
+for _mode in ("single", "stream", "legacy"):
+    register("netcdf_shifter.%s" % _mode, NETCDF_SIZES)((setup_netcdf, netcdf_runner(_mode)))
+
+register("netcdf_shifter.single.deflate", NETCDF_SIZES)((setup_netcdf, netcdf_runner("single", "deflate")))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def setup_puget_catalogs(workdir, p):
+    synthetic.write_block_rasters(os.path.join(workdir, "ChangeMap"), "ChangeMap", PUGET_BLOCKS, years_of(p),
+                                  p["size"], np.random.RandomState(5))
+
+
+def puget_catalogs_runner(catalog_type):
+    def run(workdir, p):
+        import puget_raster_catalogs
+
+        puget_raster_catalogs.main_work(os.path.join(workdir, "ChangeMap"), "ChangeMap",
+                                        outdir=os.path.join(workdir, "Animations"), catalog_type=catalog_type)
+
+        return len(PUGET_BLOCKS) * p["years"]
+
+    return run
+
+
+PUGET_CATALOG_SIZES = {"small": {"years": 2, "size": 100}, "medium": {"years": 8, "size": 200},
+                       "large": {"years": 32, "size": 300}}
+
+register("puget_raster_catalogs", PUGET_CATALOG_SIZES)((setup_puget_catalogs, puget_catalogs_runner("MANAGED")))
+
+register("puget_raster_catalogs.unmanaged", PUGET_CATALOG_SIZES)((setup_puget_catalogs,
+                                                                  puget_catalogs_runner("UNMANAGED")))
+
+
+def setup_batch_catalogs(workdir, p):
+    jobs = list()
+
+    for i, prod in enumerate(synthetic.PRODUCTS[:p["products"]]):
+        synthetic.write_block_rasters(os.path.join(workdir, prod), prod, PUGET_BLOCKS, years_of(p), p["size"],
+                                      np.random.RandomState(10 + i))
+
+        jobs.append({"indir": os.path.join(workdir, prod), "rc_name": prod, "gdb_name": "%s.gdb" % prod})
+
+    with open(os.path.join(workdir, "batch.json"), "w") as f:
+        json.dump({"defaults": {"outdir": os.path.join(workdir, "Animations")}, "jobs": jobs}, f)
+
+
+def batch_catalogs_runner(workers):
+    def run(workdir, p):
+        import batch_raster_catalogs
+
+        results = batch_raster_catalogs.main_work(os.path.join(workdir, "batch.json"), workers)
+
+        if any(r[3] is not None for r in results):
+            raise RuntimeError("batch_raster_catalogs jobs failed")
+
+        return len(results) * len(PUGET_BLOCKS) * p["years"]
+
+    return run
+
+
+BATCH_CATALOG_SIZES = {"small": {"products": 2, "years": 2, "size": 100},
+                       "medium": {"products": 4, "years": 4, "size": 200},
+                       "large": {"products": 8, "years": 8, "size": 300}}
+
+register("batch_raster_catalogs", BATCH_CATALOG_SIZES)((setup_batch_catalogs, batch_catalogs_runner(1)))
+
+register("batch_raster_catalogs.workers4", BATCH_CATALOG_SIZES)((setup_batch_catalogs, batch_catalogs_runner(4)))
+
+
+def setup_rasters_to_catalog(workdir, p):
+    synthetic.write_annual_rasters(os.path.join(workdir, "in"), "ChangeMap", years_of(p), p["size"], p["size"],
+                                   np.random.RandomState(6))
+
+
+def run_rasters_to_catalog(workdir, p):
+    import rasters_to_catalog
+
+    rasters_to_catalog.main_work(os.path.join(workdir, "in"), "Animations.gdb", "ChangeMap",
+                                 outdir=os.path.join(workdir, "out"))
+
+    return p["years"]
+
+
+register("rasters_to_catalog", {"small": {"years": 8, "size": 300}, "medium": {"years": 16, "size": 800},
+                                "large": {"years": 32, "size": 1500}})((setup_rasters_to_catalog,
+                                                                        run_rasters_to_catalog))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def setup_populate(workdir, p):
+    rng = np.random.RandomState(7)
+
+    synthetic.write_blocks(os.path.join(workdir, "blocks.shp"), 5, 7, 700, 500, rng)
+
+    synthetic.write_pngs(os.path.join(workdir, "png"), PUGET_BLOCKS, p["extra"])
+
+
+def run_populate(workdir, p):
+    import puget_populate_field
+
+    puget_populate_field.main_work(os.path.join(workdir, "png"), feature=os.path.join(workdir, "blocks.shp"),
+                                   field="cnfmat", option="2000")
+
+    return len(PUGET_BLOCKS)
+
+
+register("puget_populate_field", {"small": {"extra": 100}, "medium": {"extra": 2000}, "large": {"extra": 20000}})(
+    (setup_populate, run_populate))
@@ -0,0 +1,1059 @@
+"""
+A local stand-in for the parts of arcpy used by the tools in this repository, so that they can be benchmarked on
+synthetic data without an ArcGIS install.  It is only put on sys.path by benchmarks/bench.py.
+
+The stand-in mimics the cost structure of the real tools where it matters for the benchmarks: Clip_management and
+Shift_management read the whole input raster, window reads through RasterToNumPyArray only touch the rows they need,
+managed raster catalogs copy every pixel.  See _storage for the on-disk formats.
+"""
+
+import math
+import os
+import re
+import shutil
+import struct
+import numpy as np
+
+from arcpy import _storage
+
+PIXEL_TYPES = {"uint8": "U8", "int8": "S8", "uint16": "U16", "int16": "S16", "uint32": "U32", "int32": "S32",
+               "float32": "F32", "float64": "F64"}
+
+
+class _Env(object):
+    def __init__(self):
+        self.workspace = None
+        self.scratchWorkspace = None
+        self.compression = None
+        self.outputCoordinateSystem = None
+        self.overwriteOutput = False
+        self.tileSize = None
+        self.pyramid = None
+        self.parallelProcessingFactor = None
+
+
+env = _Env()
+
+# Layers made by MakeFeatureLayer_management and MakeNetCDFRasterLayer_md, keyed by layer name
+_layers = dict()
+
+
+class ExecuteError(Exception):
+    pass
+
+
+def AddMessage(message):
+    return None
+
+
+def AddWarning(message):
+    return None
+
+
+def AddError(message):
+    return None
+
+
+class Result(object):
+    def __init__(self, *outputs):
+        self._outputs = outputs
+
+    def getOutput(self, index):
+        return self._outputs[index]
+
+    def __str__(self):
+        return str(self._outputs[0])
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Geometry
+
+class Point(object):
+    def __init__(self, X=0.0, Y=0.0, *args):
+        self.X = X
+        self.Y = Y
+
+
+class Array(list):
+    pass
+
+
+class Extent(object):
+    def __init__(self, XMin=None, YMin=None, XMax=None, YMax=None, *args):
+        self.XMin = XMin
+        self.YMin = YMin
+        self.XMax = XMax
+        self.YMax = YMax
+
+    @property
+    def width(self):
+        return self.XMax - self.XMin
+
+    @property
+    def height(self):
+        return self.YMax - self.YMin
+
+
+class SpatialReference(object):
+    def __init__(self, item=None):
+        self._string = None
+
+        self.name = "Unknown"
+
+        self.factoryCode = 0
+
+        if isinstance(item, int):
+            self.factoryCode = item
+
+            self.name = "EPSG_%d" % item
+
+        elif item:
+            self.loadFromString(item)
+
+    def loadFromString(self, string):
+        self._string = string
+
+        match = re.match(r"\s*(?:PROJCS|GEOGCS)\['([^']*)'", string)
+
+        self.name = match.group(1) if match else "Unknown"
+
+    def exportToString(self):
+        return self._string if self._string is not None else self.name
+
+
+def _sr_string(coor_system):
+    if coor_system is None:
+        return "Unknown"
+
+    if isinstance(coor_system, SpatialReference):
+        return coor_system.exportToString()
+
+    return str(coor_system)
+
+
+def _segments_intersect(a, b):
+    (x1, y1, x2, y2), (x3, y3, x4, y4) = a, b
+
+    def orient(ax, ay, bx, by, cx, cy):
+        v = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+        return 0 if v == 0 else (1 if v > 0 else -1)
+
+    def on_segment(ax, ay, bx, by, cx, cy):
+        return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+    o1 = orient(x1, y1, x2, y2, x3, y3)
+    o2 = orient(x1, y1, x2, y2, x4, y4)
+    o3 = orient(x3, y3, x4, y4, x1, y1)
+    o4 = orient(x3, y3, x4, y4, x2, y2)
+
+    if o1 != o2 and o3 != o4:
+        return True
+
+    return ((o1 == 0 and on_segment(x1, y1, x2, y2, x3, y3)) or (o2 == 0 and on_segment(x1, y1, x2, y2, x4, y4)) or
+            (o3 == 0 and on_segment(x3, y3, x4, y4, x1, y1)) or (o4 == 0 and on_segment(x3, y3, x4, y4, x2, y2)))
+
+
+def _part_rings(part):
+    """
+    The rings of a part given as a list of rings of (x, y) pairs or, as arcpy does, an Array of Points with a None
+    before every interior ring
+    """
+    if not part or not (part[0] is None or isinstance(part[0], Point)):
+        return part
+
+    rings = [[]]
+
+    for point in part:
+        if point is None:
+            rings.append([])
+
+        else:
+            rings[-1].append((point.X, point.Y))
+
+    return [ring for ring in rings if ring]
+
+
+class Polygon(object):
+    """
+    A polygon made of parts, every part being a list of rings (exterior first) of (x, y) pairs
+    """
+
+    def __init__(self, parts, spatial_reference=None, *args):
+        self._parts = [[[(float(x), float(y)) for x, y in ring] for ring in _part_rings(part)] for part in parts]
+
+        self.spatialReference = spatial_reference
+
+        xs = [p[0] for part in self._parts for ring in part for p in ring]
+
+        ys = [p[1] for part in self._parts for ring in part for p in ring]
+
+        self.extent = Extent(min(xs), min(ys), max(xs), max(ys))
+
+        self.type = "polygon"
+
+    def to_json(self):
+        return self._parts
+
+    @property
+    def partCount(self):
+        return len(self._parts)
+
+    def getPart(self, index=None):
+        if index is None:
+            return Array(self.getPart(i) for i in range(len(self._parts)))
+
+        points = Array()
+
+        for i, ring in enumerate(self._parts[index]):
+            if i > 0:
+                points.append(None)
+
+            points.extend(Point(x, y) for x, y in ring)
+
+        return points
+
+    def __iter__(self):
+        for i in range(len(self._parts)):
+            yield self.getPart(i)
+
+    def rings(self):
+        return [ring for part in self._parts for ring in part]
+
+    @property
+    def area(self):
+        total = 0.0
+
+        for part in self._parts:
+            for i, ring in enumerate(part):
+                a = 0.0
+
+                for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                    a += x1 * y2 - x2 * y1
+
+                total += abs(a) / 2.0 if i == 0 else -abs(a) / 2.0
+
+        return total
+
+    @property
+    def WKB(self):
+        data = struct.pack("<I", len(self.rings()))
+
+        for ring in self.rings():
+            data += struct.pack("<I", len(ring)) + struct.pack("<%dd" % (2 * len(ring)), *[c for p in ring for c in p])
+
+        return bytearray(data)
+
+    def _segments(self):
+        for ring in self.rings():
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                yield x1, y1, x2, y2
+
+    def _contains_point(self, x, y):
+        inside = False
+
+        for x1, y1, x2, y2 in self._segments():
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+
+        return inside
+
+    def disjoint(self, other):
+        a, b = self.extent, other.extent
+
+        if a.XMax < b.XMin or b.XMax < a.XMin or a.YMax < b.YMin or b.YMax < a.YMin:
+            return True
+
+        other_segments = list(other._segments())
+
+        for s in self._segments():
+            if max(s[0], s[2]) < b.XMin or min(s[0], s[2]) > b.XMax:
+                continue
+
+            for t in other_segments:
+                if _segments_intersect(s, t):
+                    return False
+
+        x, y = other.rings()[0][0]
+
+        if self._contains_point(x, y):
+            return False
+
+        x, y = self.rings()[0][0]
+
+        return not other._contains_point(x, y)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Tables, feature classes and layers
+
+class Field(object):
+    def __init__(self, name, type, length=None):
+        self.name = name
+        self.type = type
+        self.length = length
+        self.baseName = name
+
+
+_memory = dict()
+
+
+def _memory_dir():
+    """
+    The in_memory workspace of this process, a directory on a RAM backed file system where there is one
+    """
+    pid = os.getpid()
+
+    if pid not in _memory:
+        import atexit
+        import tempfile
+
+        shm = "/dev/shm"
+
+        _memory[pid] = tempfile.mkdtemp(prefix="standin_in_memory_", dir=shm if os.path.isdir(shm) else None)
+
+        atexit.register(shutil.rmtree, _memory[pid], True)
+
+    return _memory[pid]
+
+
+def _path(name):
+    """
+    Resolve a dataset name against the current workspace
+    """
+    for prefix in ("in_memory/", "in_memory\\", "memory/", "memory\\"):
+        if name.startswith(prefix):
+            return os.path.join(_memory_dir(), name[len(prefix):])
+
+    if os.path.isabs(name) or env.workspace is None:
+        return name
+
+    candidate = os.path.join(env.workspace, name)
+
+    if os.path.exists(candidate) or not os.path.exists(name):
+        return candidate
+
+    return name
+
+
+_WHERE = re.compile(r"""^\s*"?(\w+)"?\s*=\s*(?:'([^']*)'|"([^"]*)"|(\S+))\s*$""")
+
+
+def _where_filter(where):
+    if not where:
+        return None
+
+    match = _WHERE.match(where)
+
+    if match is None:
+        raise ExecuteError("Unsupported where clause: %s" % where)
+
+    field, quoted, double_quoted, bare = match.groups()
+
+    if quoted is not None or double_quoted is not None:
+        value = quoted if quoted is not None else double_quoted
+
+    else:
+        value = float(bare)
+
+    def keep(table, row):
+        current = table.value(row, field)
+
+        if isinstance(value, float):
+            try:
+                return float(current) == value
+
+            except (TypeError, ValueError):
+                return False
+
+        return current == value
+
+    return keep
+
+
+class _Table(object):
+    oid_names = ("OBJECTID", "FID", "OID")
+
+    def __init__(self, path):
+        self.path = path
+
+        self.doc = _storage.read_table(path)
+
+        self._shapes = dict()
+
+    @property
+    def rows(self):
+        return self.doc["rows"]
+
+    def field_names(self):
+        return [f[0] for f in self.doc["fields"]]
+
+    def shape(self, row):
+        if row["shape"] is None:
+            return None
+
+        key = row["oid"]
+
+        if key not in self._shapes:
+            self._shapes[key] = Polygon(row["shape"])
+
+        return self._shapes[key]
+
+    def value(self, row, field):
+        if field == "OID@" or field.upper() in self.oid_names:
+            return row["oid"]
+
+        if field == "SHAPE@":
+            return self.shape(row)
+
+        if field == "SHAPE@AREA":
+            shape = self.shape(row)
+
+            return None if shape is None else shape.area
+
+        if field.upper() == "SHAPE":
+            return self.shape(row)
+
+        return row["values"].get(field)
+
+    def set_value(self, row, field, value):
+        if field == "OID@" or field.upper() in self.oid_names:
+            return None
+
+        if field in ("SHAPE@", "SHAPE"):
+            row["shape"] = None if value is None else value.to_json()
+
+            self._shapes.pop(row["oid"], None)
+
+            return None
+
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+
+        row["values"][field] = value
+
+        return None
+
+    def save(self):
+        _storage.write_table(self.path, self.doc)
+
+
+def _open_rows(dataset, where=None):
+    """
+    Return the table behind a dataset or layer and the rows visible through it
+    """
+    if dataset in _layers and "dataset" in _layers[dataset]:
+        layer = _layers[dataset]
+
+        table = _Table(layer["dataset"])
+
+        rows = table.rows
+
+        keep = _where_filter(layer["where"])
+
+        if keep is not None:
+            rows = [r for r in rows if keep(table, r)]
+
+        if layer["selection"] is not None:
+            rows = [r for r in rows if r["oid"] in layer["selection"]]
+
+    else:
+        table = _Table(_path(dataset))
+
+        rows = table.rows
+
+    keep = _where_filter(where)
+
+    if keep is not None:
+        rows = [r for r in rows if keep(table, r)]
+
+    return table, rows
+
+
+class _LegacyRow(object):
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def getValue(self, field):
+        return self._table.value(self._row, field)
+
+    def setValue(self, field, value):
+        if isinstance(value, str) and re.match(r"^\d+/\d+/\d{4}$", value):
+            month, day, year = value.split("/")
+
+            value = "%04d-%02d-%02dT00:00:00" % (int(year), int(month), int(day))
+
+        self._table.set_value(self._row, field, value)
+
+
+class SearchCursor(object):
+    """
+    Legacy cursor, arcpy.SearchCursor(dataset, where_clause)
+    """
+
+    def __init__(self, dataset, where_clause=None, *args):
+        self._table, self._rows = _open_rows(dataset, where_clause)
+
+    def __iter__(self):
+        for row in self._rows:
+            yield _LegacyRow(self._table, row)
+
+
+class UpdateCursor(SearchCursor):
+    """
+    Legacy cursor, arcpy.UpdateCursor(dataset, where_clause), changes are written when the iteration ends
+    """
+
+    def __iter__(self):
+        for row in self._rows:
+            yield _LegacyRow(self._table, row)
+
+        self._table.save()
+
+    def updateRow(self, row):
+        return None
+
+
+def ListFields(dataset, wild_card=None, field_type=None):
+    table = _Table(_layers[dataset]["dataset"] if dataset in _layers else _path(dataset))
+
+    return [Field(name, ftype, length) for name, ftype, length in
+            [f + [None] * (3 - len(f)) for f in [["OBJECTID", "OID"]] + table.doc["fields"]]]
+
+
+def AddField_management(in_table, field_name, field_type, *args, **kwargs):
+    table = _Table(_layers[in_table]["dataset"] if in_table in _layers else _path(in_table))
+
+    if field_name not in table.field_names():
+        table.doc["fields"].append([field_name, field_type, kwargs.get("field_length")])
+
+        for row in table.rows:
+            row["values"].setdefault(field_name, None)
+
+        table.save()
+
+    return Result(in_table)
+
+
+def MakeFeatureLayer_management(in_features, out_layer, where_clause=None, *args, **kwargs):
+    _layers[out_layer] = {"dataset": _path(in_features), "where": where_clause, "selection": None}
+
+    return Result(out_layer)
+
+
+def SelectLayerByAttribute_management(in_layer_or_view, selection_type="NEW_SELECTION", where_clause=None, *args):
+    layer = _layers[in_layer_or_view]
+
+    if selection_type == "CLEAR_SELECTION":
+        layer["selection"] = None
+
+    else:
+        layer["selection"] = None
+
+        table, rows = _open_rows(in_layer_or_view, where_clause)
+
+        layer["selection"] = set(r["oid"] for r in rows)
+
+    return Result(in_layer_or_view)
+
+
+def SelectLayerByLocation_management(in_layer, overlap_type="INTERSECT", select_features=None, *args):
+    layer = _layers[in_layer]
+
+    select_table, select_rows = _open_rows(select_features)
+
+    shapes = [select_table.shape(r) for r in select_rows if r["shape"] is not None]
+
+    layer["selection"] = None
+
+    table, rows = _open_rows(in_layer)
+
+    layer["selection"] = set(r["oid"] for r in rows if r["shape"] is not None and
+                             any(not table.shape(r).disjoint(s) for s in shapes))
+
+    return Result(in_layer)
+
+
+def GetCount_management(in_rows):
+    table, rows = _open_rows(in_rows)
+
+    return Result(str(len(rows)))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Rasters
+
+class Raster(object):
+    def __init__(self, inRaster=None, _data=None, _header=None):
+        self._data = _data
+
+        if inRaster is None:
+            self.catalogPath = None
+
+            self._header = _header
+
+            return
+
+        if inRaster in _layers and "raster" in _layers[inRaster]:
+            inRaster = _layers[inRaster]["raster"]
+
+        self.catalogPath = _path(inRaster)
+
+        if not _storage.is_raster(self.catalogPath):
+            raise ExecuteError("ERROR 000732: Input Raster: Dataset %s does not exist" % inRaster)
+
+        self._header = _storage.read_header(self.catalogPath)
+
+    def _pixels(self, mmap=True):
+        if self._data is not None:
+            return self._data
+
+        return _storage.read_raster(self.catalogPath, mmap)
+
+    @property
+    def width(self):
+        return self._header["ncols"]
+
+    @property
+    def height(self):
+        return self._header["nrows"]
+
+    @property
+    def meanCellWidth(self):
+        return self._header["cell_width"]
+
+    @property
+    def meanCellHeight(self):
+        return self._header["cell_height"]
+
+    @property
+    def noDataValue(self):
+        nodata = self._header["nodata"]
+
+        if nodata is not None and self._header["dtype"].startswith(("uint", "int")):
+            return int(nodata)
+
+        return nodata
+
+    @property
+    def pixelType(self):
+        return PIXEL_TYPES[self._header["dtype"]]
+
+    @property
+    def extent(self):
+        h = self._header
+
+        return Extent(h["xmin"], h["ymax"] - h["nrows"] * h["cell_height"],
+                      h["xmin"] + h["ncols"] * h["cell_width"], h["ymax"])
+
+    @property
+    def spatialReference(self):
+        return SpatialReference(self._header["sr"]) if self._header["sr"] != "Unknown" else SpatialReference()
+
+    @property
+    def name(self):
+        return os.path.basename(self.catalogPath) if self.catalogPath else None
+
+    def save(self, name):
+        path = _path(name)
+
+        h = self._header
+
+        _storage.write_raster(path, self._pixels(False), h["xmin"], h["ymax"], h["cell_width"], h["cell_height"],
+                              h["nodata"], h["sr"], env.compression, env.tileSize)
+
+        self.catalogPath = path
+
+        self._header = _storage.read_header(path)
+
+        self._data = None
+
+
+def _as_raster(in_raster):
+    return in_raster if isinstance(in_raster, Raster) else Raster(in_raster)
+
+
+def RasterToNumPyArray(in_raster, lower_left_corner=None, ncols=None, nrows=None, nodata_to_value=None):
+    raster = _as_raster(in_raster)
+
+    pixels = raster._pixels()
+
+    h = raster._header
+
+    if lower_left_corner is None:
+        c0, r1 = 0, h["nrows"]
+
+    else:
+        c0 = int(round((lower_left_corner.X - h["xmin"]) / h["cell_width"]))
+
+        r1 = int(round((h["ymax"] - lower_left_corner.Y) / h["cell_height"]))
+
+    ncols = h["ncols"] - c0 if not ncols else ncols
+
+    nrows = r1 if not nrows else nrows
+
+    r0 = r1 - nrows
+
+    data = np.array(pixels[max(r0, 0):max(r1, 0), max(c0, 0):max(c0 + ncols, 0)])
+
+    if nodata_to_value is not None and h["nodata"] is not None:
+        data[data == h["nodata"]] = nodata_to_value
+
+    return data
+
+
+def NumPyArrayToRaster(in_array, lower_left_corner=None, x_cell_size=1.0, y_cell_size=None, value_to_nodata=None):
+    if lower_left_corner is None:
+        lower_left_corner = Point(0.0, 0.0)
+
+    if y_cell_size is None:
+        y_cell_size = x_cell_size
+
+    nrows, ncols = in_array.shape
+
+    header = {"xmin": float(lower_left_corner.X), "ymax": float(lower_left_corner.Y + nrows * y_cell_size),
+              "cell_width": float(x_cell_size), "cell_height": float(y_cell_size),
+              "nodata": None if value_to_nodata is None else float(value_to_nodata),
+              "sr": _sr_string(env.outputCoordinateSystem), "nrows": nrows, "ncols": ncols,
+              "dtype": str(in_array.dtype)}
+
+    return Raster(_data=np.ascontiguousarray(in_array), _header=header)
+
+
+def ListRasters(wild_card=None, raster_type=None):
+    workspace = env.workspace
+
+    if workspace is None or not os.path.isdir(workspace):
+        return []
+
+    return sorted(f for f in os.listdir(workspace) if f.lower().endswith(_storage.RASTER_EXTENSIONS) and
+                  _storage.is_raster(os.path.join(workspace, f)))
+
+
+def _rasterize(rings, xmin, ymax, cell_width, cell_height, ncols, nrows):
+    xs = xmin + (np.arange(ncols) + 0.5) * cell_width
+
+    ys = ymax - (np.arange(nrows) + 0.5) * cell_height
+
+    X, Y = np.meshgrid(xs, ys)
+
+    inside = np.zeros((nrows, ncols), dtype=bool)
+
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if y1 == y2:
+                continue
+
+            crossing = ((y1 > Y) != (y2 > Y)) & (X < (x2 - x1) * (Y - y1) / (y2 - y1) + x1)
+
+            inside ^= crossing
+
+    return inside
+
+
+def Clip_management(in_raster, rectangle="#", out_raster=None, in_template_dataset=None, nodata_value=None,
+                    clipping_geometry=None, maintain_clipping_extent=None):
+    raster = _as_raster(in_raster)
+
+    # The clip scans the whole input
+    pixels = raster._pixels(mmap=False)
+
+    h = raster._header
+
+    if isinstance(in_template_dataset, Polygon):
+        shapes = [in_template_dataset]
+
+    else:
+        table, rows = _open_rows(in_template_dataset)
+
+        shapes = [table.shape(r) for r in rows if r["shape"] is not None]
+
+    xmin = min(s.extent.XMin for s in shapes)
+    ymin = min(s.extent.YMin for s in shapes)
+    xmax = max(s.extent.XMax for s in shapes)
+    ymax = max(s.extent.YMax for s in shapes)
+
+    c0 = int(math.floor((xmin - h["xmin"]) / h["cell_width"]))
+    c1 = int(math.ceil((xmax - h["xmin"]) / h["cell_width"]))
+    r0 = int(math.floor((h["ymax"] - ymax) / h["cell_height"]))
+    r1 = int(math.ceil((h["ymax"] - ymin) / h["cell_height"]))
+
+    nodata = float(nodata_value) if nodata_value not in (None, "#", "") else h["nodata"]
+
+    out = np.full((r1 - r0, c1 - c0), nodata if nodata is not None else 0, dtype=pixels.dtype)
+
+    sr0, sr1 = max(r0, 0), min(r1, h["nrows"])
+    sc0, sc1 = max(c0, 0), min(c1, h["ncols"])
+
+    if sr1 > sr0 and sc1 > sc0:
+        out[sr0 - r0:sr1 - r0, sc0 - c0:sc1 - c0] = pixels[sr0:sr1, sc0:sc1]
+
+    if clipping_geometry == "ClippingGeometry":
+        wx, wy = h["xmin"] + c0 * h["cell_width"], h["ymax"] - r0 * h["cell_height"]
+
+        rings = [ring for s in shapes for ring in s.rings()]
+
+        mask = _rasterize(rings, wx, wy, h["cell_width"], h["cell_height"], c1 - c0, r1 - r0)
+
+        out[~mask] = nodata
+
+    _storage.write_raster(_path(out_raster), out, h["xmin"] + c0 * h["cell_width"], h["ymax"] - r0 * h["cell_height"],
+                          h["cell_width"], h["cell_height"], nodata, h["sr"], env.compression, env.tileSize)
+
+    return Result(out_raster)
+
+
+def Shift_management(in_raster, out_raster, x_value, y_value, in_snap_raster=None):
+    raster = _as_raster(in_raster)
+
+    h = raster._header
+
+    _storage.write_raster(_path(out_raster), raster._pixels(mmap=False), h["xmin"] + float(x_value),
+                          h["ymax"] + float(y_value), h["cell_width"], h["cell_height"], h["nodata"], h["sr"],
+                          env.compression, env.tileSize)
+
+    return Result(out_raster)
+
+
+def MosaicToNewRaster_management(input_rasters, output_location, raster_dataset_name_with_extension,
+                                 coordinate_system_for_the_raster=None, pixel_type=None, cellsize=None,
+                                 number_of_bands=None, *args):
+    if isinstance(input_rasters, str):
+        input_rasters = input_rasters.split(";")
+
+    rasters = [_as_raster(r) for r in input_rasters]
+
+    h = rasters[0]._header
+
+    xmin = min(r.extent.XMin for r in rasters)
+    ymin = min(r.extent.YMin for r in rasters)
+    xmax = max(r.extent.XMax for r in rasters)
+    ymax = max(r.extent.YMax for r in rasters)
+
+    ncols = int(round((xmax - xmin) / h["cell_width"]))
+    nrows = int(round((ymax - ymin) / h["cell_height"]))
+
+    nodata = h["nodata"]
+
+    out = np.full((nrows, ncols), nodata if nodata is not None else 0, dtype=h["dtype"])
+
+    for r in rasters:
+        c0 = int(round((r.extent.XMin - xmin) / h["cell_width"]))
+        r0 = int(round((ymax - r.extent.YMax) / h["cell_height"]))
+
+        out[r0:r0 + r.height, c0:c0 + r.width] = r._pixels()
+
+    _storage.write_raster(os.path.join(output_location, raster_dataset_name_with_extension), out, xmin, ymax,
+                          h["cell_width"], h["cell_height"], nodata, _sr_string(coordinate_system_for_the_raster),
+                          env.compression, env.tileSize)
+
+    return Result(raster_dataset_name_with_extension)
+
+
+def MakeNetCDFRasterLayer_md(in_netCDF_file, variable, x_dimension, y_dimension, out_raster_layer, *args, **kwargs):
+    _layers[out_raster_layer] = {"raster": _path(in_netCDF_file)}
+
+    return Result(out_raster_layer)
+
+
+def DefineProjection_management(in_dataset, coor_system):
+    path = _layers[in_dataset]["raster"] if in_dataset in _layers else _path(in_dataset)
+
+    if _storage.is_raster(path):
+        header = _storage.read_header(path)
+
+        header["sr"] = _sr_string(coor_system)
+
+        _storage.write_header(path, header)
+
+    else:
+        table = _Table(path)
+
+        table.doc["sr"] = _sr_string(coor_system)
+
+        table.save()
+
+    return Result(in_dataset)
+
+
+def BuildPyramids_management(in_raster_dataset, pyramid_level=None, SKIP_FIRST=None, resample_technique=None,
+                             compression_type=None, compression_quality=None, skip_existing=None):
+    raster = _as_raster(in_raster_dataset)
+
+    ovr = raster.catalogPath + ".ovr"
+
+    if skip_existing == "SKIP_EXISTING" and os.path.exists(ovr):
+        return Result(in_raster_dataset)
+
+    level = raster._pixels(mmap=False)
+
+    levels = dict()
+
+    while min(level.shape) > 64:
+        level = level[::2, ::2]
+
+        levels["level_%d" % len(levels)] = level
+
+    with open(ovr, "wb") as f:
+        np.savez(f, **levels)
+
+    return Result(in_raster_dataset)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Workspaces and catalogs
+
+class _Describe(object):
+    def __init__(self, value):
+        if value in _layers and "raster" in _layers[value]:
+            value = _layers[value]["raster"]
+
+        path = _layers[value]["dataset"] if value in _layers else _path(value)
+
+        self.catalogPath = path
+
+        self.name = os.path.basename(path)
+
+        if _storage.is_raster(path):
+            raster = Raster(path)
+
+            self.dataType = "RasterDataset"
+            self.spatialReference = raster.spatialReference
+            self.extent = raster.extent
+            self.width = raster.width
+            self.height = raster.height
+            self.meanCellWidth = raster.meanCellWidth
+            self.meanCellHeight = raster.meanCellHeight
+            self.noDataValue = raster.noDataValue
+            self.pixelType = raster.pixelType
+
+        elif os.path.isdir(path):
+            self.dataType = "Workspace"
+
+        else:
+            table = _Table(path)
+
+            self.dataType = "FeatureClass" if table.doc.get("shape_type") else "Table"
+            self.spatialReference = SpatialReference(table.doc.get("sr") or None)
+
+            shapes = [table.shape(r) for r in table.rows if r["shape"] is not None]
+
+            if shapes:
+                self.extent = Extent(min(s.extent.XMin for s in shapes), min(s.extent.YMin for s in shapes),
+                                     max(s.extent.XMax for s in shapes), max(s.extent.YMax for s in shapes))
+
+
+def Describe(value):
+    return _Describe(value)
+
+
+def Exists(dataset):
+    if dataset in _layers:
+        return True
+
+    return os.path.exists(_path(dataset))
+
+
+def Delete_management(in_data, *args):
+    if in_data in _layers:
+        del _layers[in_data]
+
+        return Result(True)
+
+    path = _path(in_data)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+    elif _storage.is_raster(path):
+        _storage.delete_raster(path)
+
+    elif os.path.exists(path):
+        os.remove(path)
+
+    return Result(True)
+
+
+def CreateFileGDB_management(out_folder_path, out_name, *args):
+    name = out_name if out_name.endswith(".gdb") else out_name + ".gdb"
+
+    path = os.path.join(out_folder_path, name)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    return Result(path)
+
+
+def CreateRasterCatalog_management(out_path, out_name, raster_spatial_reference=None, spatial_reference=None,
+                                   config_keyword=None, spatial_grid_1=None, spatial_grid_2=None,
+                                   spatial_grid_3=None, raster_management_type="MANAGED", template_raster_catalog=None):
+    path = os.path.join(out_path, out_name)
+
+    table = {"fields": [["Name", "TEXT"], ["Raster", "RASTER"]], "shape_type": "Polygon",
+             "sr": _sr_string(spatial_reference), "management": raster_management_type or "MANAGED", "rows": []}
+
+    _storage.write_table(path, table)
+
+    return Result(path)
+
+
+def _load_into_catalog(rasters, catalog):
+    table = _Table(_path(catalog))
+
+    managed = table.doc.get("management", "MANAGED") == "MANAGED"
+
+    data_dir = table.path + "_rasters"
+
+    if managed and not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    oid = max([r["oid"] for r in table.rows] or [0])
+
+    for path in rasters:
+        raster = Raster(path)
+
+        if managed:
+            # A managed catalog holds a copy of every pixel
+            target = os.path.join(data_dir, os.path.basename(path))
+
+            shutil.copyfile(path, target)
+
+            shutil.copyfile(_storage.header_path(path), _storage.header_path(target))
+
+            path = target
+
+        oid += 1
+
+        e = raster.extent
+
+        table.rows.append({"oid": oid,
+                           "shape": [[[(e.XMin, e.YMin), (e.XMin, e.YMax), (e.XMax, e.YMax), (e.XMax, e.YMin)]]],
+                           "values": {"Name": os.path.splitext(os.path.basename(path))[0], "Raster": path}})
+
+    table.save()
+
+    return None
+
+
+def WorkspaceToRasterCatalog_management(in_workspace, in_raster_catalog, include_subdirectories=None, project=None):
+    rasters = sorted(os.path.join(in_workspace, f) for f in os.listdir(in_workspace)
+                     if f.lower().endswith(_storage.RASTER_EXTENSIONS) and
+                     _storage.is_raster(os.path.join(in_workspace, f)))
+
+    _load_into_catalog(rasters, in_raster_catalog)
+
+    return Result(in_raster_catalog)
+
+
+def RasterToGeodatabase_conversion(Input_Rasters, Output_Geodatabase, Configuration_Keyword=None):
+    if isinstance(Input_Rasters, str):
+        Input_Rasters = Input_Rasters.split(";")
+
+    _load_into_catalog([_path(r) for r in Input_Rasters], Output_Geodatabase)
+
+    return Result(Output_Geodatabase)
+
+
+from arcpy import da
@@ -0,0 +1,180 @@
+"""
+On-disk formats of the arcpy stand-in.
+
+Rasters keep the file name they would have in ArcGIS (.tif, .nc4, ...) but hold a numpy .npy array, or zlib compressed
+tiles when arcpy.env.compression asks for LZW or LZ77, the georeference lives in a '<raster>.hdr.json' sidecar.
+Feature classes, tables and raster catalogs are JSON documents stored under the dataset path.
+"""
+
+import json
+import multiprocessing
+import os
+import zlib
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+HEADER_SUFFIX = ".hdr.json"
+
+RASTER_EXTENSIONS = (".tif", ".tiff", ".img", ".nc4", ".nc")
+
+# zlib levels standing in for the arcpy.env.compression types, LZW is the faster and weaker of the two
+COMPRESSION_LEVELS = {"LZW": 1, "LZ77": 6}
+
+COMPRESSED_MAGIC = b"STANDINZ"
+
+COMPRESSION_THREADS = multiprocessing.cpu_count()
+
+
+def header_path(path):
+    return path + HEADER_SUFFIX
+
+
+def is_raster(path):
+    return os.path.isfile(path) and os.path.exists(header_path(path))
+
+
+def write_raster(path, data, xmin, ymax, cell_width, cell_height, nodata=None, sr="Unknown", compression=None,
+                 tile_size=None):
+    """
+    Write a raster and its header
+    :param path: <str>
+    :param data: <numpy.ndarray> 2-D array
+    :param xmin: <float> The left edge
+    :param ymax: <float> The top edge
+    :param cell_width: <float>
+    :param cell_height: <float>
+    :param nodata: <int> or None
+    :param sr: <str> Spatial reference string
+    :param compression: <str> arcpy.env.compression, LZW and LZ77 write zlib compressed tiles
+    :param tile_size: <str> arcpy.env.tileSize, "<width> <height>", 128 by 128 by default for compressed rasters
+    :return:
+    """
+    header = {"xmin": float(xmin), "ymax": float(ymax), "cell_width": float(cell_width),
+              "cell_height": float(cell_height), "nodata": None if nodata is None else float(nodata), "sr": sr,
+              "nrows": int(data.shape[0]), "ncols": int(data.shape[1]), "dtype": str(data.dtype)}
+
+    kind = (compression or "NONE").split()[0].upper()
+
+    if kind in COMPRESSION_LEVELS:
+        header["compression"] = write_tiles(path, np.ascontiguousarray(data), COMPRESSION_LEVELS[kind], tile_size)
+
+    else:
+        with open(path, "wb") as f:
+            np.save(f, np.ascontiguousarray(data))
+
+    write_header(path, header)
+
+    return None
+
+
+def write_tiles(path, data, level, tile_size=None):
+    """
+    Write the pixels as zlib compressed tiles, compressed on a thread per core like GDAL's NUM_THREADS
+    :return: <dict> The tile index kept in the header
+    """
+    tw, th = [int(v) for v in tile_size.split()] if tile_size else (128, 128)
+
+    windows = [(r, c) for r in range(0, data.shape[0], th) for c in range(0, data.shape[1], tw)]
+
+    def compress(window):
+        r, c = window
+
+        return zlib.compress(np.ascontiguousarray(data[r:r + th, c:c + tw]).tobytes(), level)
+
+    pool = ThreadPool(COMPRESSION_THREADS)
+
+    try:
+        blobs = pool.map(compress, windows)
+
+    finally:
+        pool.close()
+
+    with open(path, "wb") as f:
+        f.write(COMPRESSED_MAGIC)
+
+        for blob in blobs:
+            f.write(blob)
+
+    return {"tile": [th, tw], "sizes": [len(b) for b in blobs]}
+
+
+def read_tiles(path, header):
+    """
+    Decompress a raster written by write_tiles
+    """
+    th, tw = header["compression"]["tile"]
+
+    out = np.empty((header["nrows"], header["ncols"]), dtype=header["dtype"])
+
+    with open(path, "rb") as f:
+        f.read(len(COMPRESSED_MAGIC))
+
+        for (r, c), size in zip([(r, c) for r in range(0, out.shape[0], th) for c in range(0, out.shape[1], tw)],
+                                header["compression"]["sizes"]):
+            window = out[r:r + th, c:c + tw]
+
+            window[...] = np.frombuffer(zlib.decompress(f.read(size)), dtype=out.dtype).reshape(window.shape)
+
+    return out
+
+
+def write_header(path, header):
+    with open(header_path(path), "w") as f:
+        json.dump(header, f)
+
+    return None
+
+
+def read_header(path):
+    with open(header_path(path)) as f:
+        return json.load(f)
+
+
+def read_raster(path, mmap=True):
+    """
+    Open the pixels of a raster, memory mapped so that a window read only touches the rows it needs, compressed
+    rasters are decompressed as a whole
+    :param path: <str>
+    :param mmap: <bool>
+    :return: <numpy.ndarray>
+    """
+    header = read_header(path)
+
+    if "compression" in header:
+        return read_tiles(path, header)
+
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def delete_raster(path):
+    for p in (path, header_path(path), path + ".ovr"):
+        if os.path.exists(p):
+            os.remove(p)
+
+    return None
+
+
+def write_table(path, table):
+    """
+    Write a feature class or table document
+    :param path: <str>
+    :param table: <dict> {"fields": [[name, type], ...], "shape_type": str or None, "rows": [...], ...}
+    :return:
+    """
+    with open(path, "w") as f:
+        json.dump(table, f)
+
+    return None
+
+
+def read_table(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_table(path):
+    if not os.path.isfile(path) or is_raster(path):
+        return False
+
+    with open(path, "rb") as f:
+        return f.read(1) == b"{"
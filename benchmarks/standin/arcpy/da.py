@@ -0,0 +1,104 @@
+"""
+arcpy.da cursors and numpy conversions of the stand-in, see arcpy/__init__.py
+"""
+
+import os
+import arcpy
+from arcpy import _storage
+
+# numpy kind -> field type
+FIELD_TYPES = {"i": "LONG", "u": "LONG", "f": "DOUBLE", "U": "TEXT", "S": "TEXT", "b": "SHORT"}
+
+
+class SearchCursor(object):
+    def __init__(self, in_table, field_names, where_clause=None, *args, **kwargs):
+        if isinstance(field_names, str):
+            field_names = [field_names]
+
+        self.fields = tuple(field_names)
+
+        self._table, self._rows = arcpy._open_rows(in_table, where_clause)
+
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= len(self._rows):
+            raise StopIteration
+
+        self._current = self._rows[self._index]
+
+        self._index += 1
+
+        return self._make_row(self._current)
+
+    next = __next__
+
+    def _make_row(self, row):
+        return tuple(self._table.value(row, f) for f in self.fields)
+
+    def reset(self):
+        self._index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class UpdateCursor(SearchCursor):
+    def __init__(self, *args, **kwargs):
+        SearchCursor.__init__(self, *args, **kwargs)
+
+        self._dirty = False
+
+    def _make_row(self, row):
+        return [self._table.value(row, f) for f in self.fields]
+
+    def updateRow(self, values):
+        for field, value in zip(self.fields, values):
+            self._table.set_value(self._current, field, value)
+
+        self._dirty = True
+
+    def deleteRow(self):
+        self._table.rows.remove(self._current)
+
+        self._rows.remove(self._current)
+
+        self._index -= 1
+
+        self._dirty = True
+
+    def __exit__(self, *args):
+        if self._dirty:
+            self._table.save()
+
+            self._dirty = False
+
+        return False
+
+    def __del__(self):
+        if getattr(self, "_dirty", False):
+            self._table.save()
+
+
+def NumPyArrayToTable(in_array, out_table):
+    path = arcpy._path(out_table)
+
+    if os.path.exists(path):
+        raise RuntimeError("ERROR 000258: Output %s already exists" % out_table)
+
+    names = in_array.dtype.names
+
+    fields = [[name, FIELD_TYPES[in_array.dtype[name].kind]] for name in names]
+
+    rows = [{"oid": i + 1, "values": dict((name, row[name].item()) for name in names)}
+            for i, row in enumerate(in_array)]
+
+    _storage.write_table(path, {"fields": fields, "shape_type": None, "rows": rows})
+
+    return None
@@ -0,0 +1,191 @@
+"""
+Generate synthetic inputs for the benchmarks in the on-disk formats of the arcpy stand-in: annual product rasters,
+a multi-feature block layer, overlapping polygons, .nc4 files, per-block annual rasters and PNG file names.
+"""
+
+import os
+import numpy as np
+
+from arcpy import _storage
+
+# The products that batch_raster_catalogs builds catalogs for
+PRODUCTS = ["CoverPrim", "CoverSec", "ChangeMap", "ChangeMagMap", "LastChange", "SegLength", "QAMap",
+            "CoverConfPrim", "CoverConfSec"]
+
+ALBERS = "PROJCS['WGS_1984_Albers',GEOGCS['GCS_WGS_1984']]"
+
+# Upper left corner of the synthetic study area, on the 30 m ARD grid
+XMIN = -2115585.0
+
+YMAX = 3134805.0
+
+CELL = 30.0
+
+
+def product_array(product, nrows, ncols, rng):
+    """
+    Return a synthetic product array: patches of a few classes for the categorical products and a smooth field for
+    ChangeMagMap, with mostly empty (0) pixels like the real annual products
+    """
+    patch = 16
+
+    shape = (nrows // patch + 1, ncols // patch + 1)
+
+    if product == "ChangeMagMap":
+        coarse = rng.gamma(2.0, 50.0, shape).astype(np.float32)
+
+        coarse[rng.random_sample(shape) < 0.8] = 0
+
+    else:
+        coarse = rng.randint(1, 9, shape).astype(np.uint8)
+
+        coarse[rng.random_sample(shape) < 0.7] = 0
+
+    return coarse.repeat(patch, 0).repeat(patch, 1)[:nrows, :ncols]
+
+
+def write_annual_rasters(dirpath, product, years, nrows, ncols, rng, name="{product}_{year}.tif"):
+    """
+    Write one raster per year covering the whole study area
+    :return: <list> The raster paths
+    """
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    paths = list()
+
+    for year in years:
+        path = os.path.join(dirpath, name.format(product=product, year=year))
+
+        _storage.write_raster(path, product_array(product, nrows, ncols, rng), XMIN, YMAX, CELL, CELL, None, ALBERS)
+
+        paths.append(path)
+
+    return paths
+
+
+def write_feature_class(path, fields, rows, sr=ALBERS):
+    """
+    :param path: <str>
+    :param fields: <list> [name, type] pairs
+    :param rows: <list> (parts, values) tuples, see arcpy.Polygon for the layout of parts
+    :param sr: <str>
+    :return:
+    """
+    dirpath = os.path.dirname(path)
+
+    if dirpath and not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    _storage.write_table(path, {"fields": fields, "shape_type": "Polygon", "sr": sr,
+                                "rows": [{"oid": i + 1, "shape": parts, "values": values}
+                                         for i, (parts, values) in enumerate(rows)]})
+
+    return None
+
+
+def block_polygon(x0, y0, x1, y1, rng):
+    """
+    An irregular octagon filling most of the given cell
+    """
+    w, h = x1 - x0, y1 - y0
+
+    j = lambda: rng.uniform(0.0, 0.15)
+
+    ring = [(x0 + w * j(), y0 + h * 0.3), (x0 + w * j(), y0 + h * 0.7), (x0 + w * 0.3, y1 - h * j()),
+            (x0 + w * 0.7, y1 - h * j()), (x1 - w * j(), y0 + h * 0.7), (x1 - w * j(), y0 + h * 0.3),
+            (x0 + w * 0.7, y0 + h * j()), (x0 + w * 0.3, y0 + h * j())]
+
+    return [[ring]]
+
+
+def write_blocks(path, nx, ny, nrows, ncols, rng):
+    """
+    Write an nx by ny layer of block polygons over a study area of nrows by ncols cells.  The blocks have an 'id'
+    field and a 'BlockID' field following the 'Trends Block <n>' pattern.
+    :return: <int> The number of blocks
+    """
+    width, height = ncols * CELL / nx, nrows * CELL / ny
+
+    rows = list()
+
+    for j in range(ny):
+        for i in range(nx):
+            n = len(rows) + 1
+
+            x0, y1 = XMIN + i * width, YMAX - j * height
+
+            rows.append((block_polygon(x0, y1 - height, x0 + width, y1, rng),
+                         {"id": n, "BlockID": "Trends Block %d" % n}))
+
+    write_feature_class(path, [["id", "LONG"], ["BlockID", "TEXT"]], rows)
+
+    return len(rows)
+
+
+def write_overlapping_polygons(path, n, rng, overlaps=6):
+    """
+    Write n random rectangles sized so that each one intersects about 'overlaps' others
+    """
+    side = 100000.0
+
+    size = side * np.sqrt(overlaps / (4.0 * n))
+
+    rows = list()
+
+    for _ in range(n):
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+
+        w, h = size * rng.uniform(0.5, 1.5), size * rng.uniform(0.5, 1.5)
+
+        rows.append(([[[(x, y), (x, y + h), (x + w, y + h), (x + w, y)]]], {"count": None}))
+
+    write_feature_class(path, [["count", "LONG"]], rows)
+
+    return None
+
+
+def write_netcdf(dirpath, n, nrows, ncols, rng):
+    """
+    Write n '.nc4' files, in the raster format of the stand-in, with a band_1 like int16 variable
+    """
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    for i in range(n):
+        data = (product_array("ChangeMap", nrows, ncols, rng).astype(np.int16) * 100)
+
+        _storage.write_raster(os.path.join(dirpath, "h%03dv%03d.nc4" % (i, i)), data, XMIN - 15, YMAX + 15, CELL,
+                              CELL, -9999, "Unknown")
+
+    return None
+
+
+def write_block_rasters(indir, product, blocks, years, size, rng):
+    """
+    Write the outputs of a clip tool: indir/block_<id>/<product>_block_<id>_<year>.tif
+    """
+    for block in blocks:
+        subdir = os.path.join(indir, "block_%s" % block)
+
+        write_annual_rasters(subdir, product, years, size, size, rng,
+                             name="{product}_block_%s_{year}.tif" % block)
+
+    return None
+
+
+def write_pngs(img_dir, blocks, extra, option="2000"):
+    """
+    Write empty PNG files, one per block plus 'extra' unrelated files matching the same pattern
+    """
+    if not os.path.exists(img_dir):
+        os.makedirs(img_dir)
+
+    names = ["trends_blk%d_cnfmat_%s.png" % (b, option) for b in blocks]
+
+    names += ["other_%d_cnfmat_%s.png" % (i, option) for i in range(extra)]
+
+    for name in names:
+        open(os.path.join(img_dir, name), "wb").close()
+
+    return None
@@ -0,0 +1,261 @@
+"""
+A build manifest for the clip tools.  For every output it records the fingerprints of the inputs (size, modification
+time and optionally an MD5), the parameters it was made with and a checksum of the output itself, so that a rerun
+only skips outputs that are still valid: a missing entry, a changed input, changed parameters or an output that was
+modified or truncated all cause the output to be made again.
+
+Outputs are written under a temporary name and renamed into place once they are complete (atomic_output), so a
+killed run leaves no half-written raster behind under the final name.
+
+"""
+import contextlib
+import hashlib
+import json
+import os
+
+# Files that make up a shapefile, a change to any of them changes the features
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf", ".prj")
+
+
+def file_md5(path, block_size=1 << 20):
+    """
+    Return the MD5 of a file
+    :param path: <str>
+    :param block_size: <int> The number of bytes read at a time
+    :return: <str>
+    """
+    md5 = hashlib.md5()
+
+    with open(path, "rb") as f:
+        block = f.read(block_size)
+
+        while block:
+            md5.update(block)
+
+            block = f.read(block_size)
+
+    return md5.hexdigest()
+
+
+def dataset_files(path):
+    """
+    Return the files of a dataset, a shapefile is more than one file
+    :param path: <str>
+    :return: <list>
+    """
+    stem, ext = os.path.splitext(path)
+
+    if ext.lower() == ".shp":
+        return [stem + part for part in SHAPEFILE_PARTS if os.path.exists(stem + part)]
+
+    return [path]
+
+
+def fingerprint(path, checksum=False):
+    """
+    Return the fingerprint of an input dataset
+    :param path: <str> The full path to the dataset
+    :param checksum: <bool> Include the MD5 of the files, slower but catches changes that keep size and mtime
+    :return: <list> [size, mtime, md5 or None] per file, None when the dataset doesn't exist
+    """
+    files = dataset_files(path)
+
+    if not all(os.path.isfile(f) for f in files):
+        return None
+
+    return [[os.path.getsize(f), os.path.getmtime(f), file_md5(f) if checksum else None] for f in files]
+
+
+def output_files(result_name):
+    """
+    Return the file of an output raster followed by its sidecars (x.tif.aux.xml, x.tif.ovr, x.tfw, ...)
+    :param result_name: <str>
+    :return: <list> The files that exist
+    """
+    directory, name = os.path.split(os.path.abspath(result_name))
+
+    if not os.path.isdir(directory):
+        return list()
+
+    world_file = os.path.splitext(name)[0] + ".tfw"
+
+    sidecars = sorted(f for f in os.listdir(directory) if f.startswith(name + ".") or f == world_file)
+
+    return [os.path.join(directory, f) for f in ([name] if os.path.exists(result_name) else list()) + sidecars]
+
+
+@contextlib.contextmanager
+def atomic_output(result_name):
+    """
+    Write an output raster under a temporary name and move it and its sidecars into place on success.  Leftovers of
+    an earlier attempt and the previous output are removed first.
+        with atomic_output(result_name) as tmp_name:
+            arcpy.Clip_management(..., out_raster=tmp_name, ...)
+    :param result_name: <str> The full path to the output raster
+    :return: <str> The temporary name to write to
+    """
+    stem, ext = os.path.splitext(result_name)
+
+    tmp_name = "%s_partial%s" % (stem, ext)
+
+    for path in output_files(tmp_name) + output_files(result_name):
+        os.remove(path)
+
+    try:
+        yield tmp_name
+
+    except BaseException:
+        for path in output_files(tmp_name):
+            os.remove(path)
+
+        raise
+
+    tmp_stem = os.path.basename(stem) + "_partial"
+
+    # The raster itself goes last, so a raster under the final name always has its sidecars
+    for path in sorted(output_files(tmp_name), key=lambda p: p == os.path.abspath(tmp_name)):
+        directory, name = os.path.split(path)
+
+        os.rename(path, os.path.join(directory, os.path.basename(stem) + name[len(tmp_stem):]))
+
+
+class BuildManifest(object):
+    """
+    The manifest of an output directory, a JSON file mapping every output to how it was made
+    """
+
+    def __init__(self, path, params=None, checksum=False, save_every=100):
+        """
+        :param path: <str> The full path to the manifest file, created on the first save
+        :param params: <dict> Parameters shared by every output, e.g. the product name and nodata value
+        :param checksum: <bool> Fingerprint the inputs with MD5 and verify the MD5 of existing outputs
+        :param save_every: <int> Save after this many recorded outputs, so an interrupted run keeps its work
+        """
+        self.path = path
+
+        self.params = params or dict()
+
+        self.checksum = checksum
+
+        self.save_every = save_every
+
+        self._fingerprints = dict()
+
+        self._unsaved = 0
+
+        self.entries = dict()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.save()
+
+        return False
+
+    def fingerprint(self, path):
+        """
+        The fingerprint of an input, computed once per run
+        :param path: <str>
+        :return: See fingerprint
+        """
+        if path not in self._fingerprints:
+            self._fingerprints[path] = fingerprint(path, self.checksum)
+
+        return self._fingerprints[path]
+
+    def forget(self, path):
+        """
+        Drop the fingerprint of an input that was written again during the run, e.g. by an earlier stage
+        :param path: <str>
+        :return:
+        """
+        self._fingerprints.pop(path, None)
+
+        return None
+
+    def describe(self, inputs, params=None):
+        """
+        :param inputs: <list> Full paths to the inputs of an output
+        :param params: <dict> Parameters of this output only, e.g. the hash of the clipping feature
+        :return: <dict> The inputs and parameters part of an entry
+        """
+        merged = dict(self.params)
+
+        merged.update(params or dict())
+
+        return {"inputs": dict((os.path.abspath(p), self.fingerprint(p)) for p in inputs), "params": merged}
+
+    def is_current(self, result_name, inputs, params=None):
+        """
+        Check whether an output exists and was made from the given inputs and parameters
+        :param result_name: <str> The full path to the output
+        :param inputs: <list> Full paths to its inputs
+        :param params: <dict> Parameters of this output only
+        :return: <bool>
+        """
+        entry = self.entries.get(os.path.abspath(result_name))
+
+        if entry is None or not os.path.isfile(result_name):
+            return False
+
+        expected = self.describe(inputs, params)
+
+        # A round trip through JSON turns tuples into lists
+        if json.loads(json.dumps(expected)) != {"inputs": entry["inputs"], "params": entry["params"]}:
+            return False
+
+        if [os.path.getsize(result_name), os.path.getmtime(result_name)] != entry["output"][:2]:
+            return False
+
+        return not self.checksum or file_md5(result_name) == entry["output"][2]
+
+    def record(self, result_name, inputs, params=None):
+        """
+        Record a finished output
+        :param result_name: <str> The full path to the output
+        :param inputs: <list> Full paths to its inputs
+        :param params: <dict> Parameters of this output only
+        :return:
+        """
+        entry = self.describe(inputs, params)
+
+        entry["output"] = [os.path.getsize(result_name), os.path.getmtime(result_name), file_md5(result_name)]
+
+        self.entries[os.path.abspath(result_name)] = entry
+
+        self._unsaved += 1
+
+        if self._unsaved >= self.save_every:
+            self.save()
+
+        return None
+
+    def save(self):
+        """
+        Write the manifest under a temporary name and move it into place
+        :return:
+        """
+        if not self._unsaved and os.path.exists(self.path):
+            return None
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        os.rename(self.path + ".tmp", self.path)
+
+        self._unsaved = 0
+
+        return None
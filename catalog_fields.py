@@ -0,0 +1,42 @@
+"""
+Attribute writers for the raster catalogs built by puget_raster_catalogs and rasters_to_catalog.  The year of every
+catalog row is parsed and checked before anything is written, then all dates go out in one arcpy.da.UpdateCursor
+pass.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import datetime as dt
+import arcpy
+from raster_index import parse_years
+
+
+def write_year_field(catalog, year_field="Year", name_field="Name", position=1, month=7, day=1):
+    """
+    Add a DATE field to a raster catalog, if it is missing, and set it from the year in each raster name
+    :param catalog: <str> The full path to the raster catalog
+    :param year_field: <str> The DATE field to write
+    :param name_field: <str> The field holding the raster names
+    :param position: <int> Which year to use when a name holds more than one, see raster_index.parse_year
+    :param month: <int> The month of the written dates
+    :param day: <int> The day of the written dates
+    :return: <int> The number of rows written
+    """
+    if year_field not in [f.name for f in arcpy.ListFields(catalog)]:
+        arcpy.AddField_management(catalog, year_field, "DATE", "", "", "", "", "")
+
+        arcpy.AddMessage("Year Field Added")
+
+    with arcpy.da.SearchCursor(catalog, ["OID@", name_field]) as cur:
+        rows = [row for row in cur]
+
+    # Raises for every name without a usable year, before a single row is touched
+    years = parse_years([row[1] for row in rows], position)
+
+    dates = dict((row[0], dt.datetime(year, month, day)) for row, year in zip(rows, years))
+
+    with arcpy.da.UpdateCursor(catalog, ["OID@", year_field]) as cur:
+        for row in cur:
+            cur.updateRow([row[0], dates[row[0]]])
+
+    return len(dates)
@@ -2,14 +2,42 @@
 Use a shapefile with multiple features to clip a raster or multiple rasters.  The script will process all rasters in
 the specified input directory.  The input directory must also contain the clipping shapefile.
 
+With --accumulate the accumulated product is computed instead of clipped: the annual rasters of the product (ChangeMap
+for Change, CoverPrim for Cover) are streamed in year order for each block, running counts of the changes and the
+first and last change year are kept in numpy arrays, and the accumulated output of every year is written in the same
+pass, so each annual raster is read once per block.  A Cover change is a pixel whose class differs from its class in
+the last year it had one.  The first and last change years are not time slices and are written to
+<outdir>/change_years/block_<id> instead of the block directories the raster catalogs are built from.
+
 ****Requires the ArcGIS python interpreter****
 
 """
 import os
+import numpy as np
 import arcpy
 import argparse
 import datetime as dt
 from arcpy import env
+import gp_profiler
+import clip_engine
+import clip_pool
+import geometry_store
+import output_format
+import raster_cube
+import raster_index
+from build_manifest import BuildManifest
+from footprints import FootprintFilter
+from mask_cache import MaskCache, feature_hashes
+from scratch import Scratch
+
+# Accumulated product -> the annual product it is computed from
+ANNUAL_PRODUCTS = {"Change": "ChangeMap", "Cover": "CoverPrim"}
+
+# Year of the first and last change of the pixels that never changed
+NO_CHANGE = 0
+
+# The directory next to the block directories that holds the first and last change years
+CHANGE_YEARS = "change_years"
 
 
 def get_time():
@@ -20,7 +48,344 @@ def get_time():
     return dt.datetime.now()
 
 
-def main_work(indir, outdir, shp, out_prod, field="id", years=None):
+def output_name(in_rast, subdir, block):
+    """
+    Return the full path to the clip of a raster to a block
+    :param in_rast: <str> The full path to the input raster
+    :param subdir: <str> The output directory of the block
+    :param block: The block id
+    :return: <str>
+    """
+    name = os.path.splitext(os.path.basename(in_rast))[0]
+
+    return subdir + os.sep + name + "_block_%s.tif" % block
+
+
+def build_tasks(in_rasters, areas, outdir, manifest, hashes, footprints=None):
+    """
+    Turn the (feature, raster) cross product into a list of clip tasks, leaving out the outputs that are current
+    :param in_rasters: <list> The rasters in the workspace
+    :param areas: <dict> Feature id -> area, see geometry_store.GeometryStore.areas
+    :param outdir: <str>
+    :param manifest: <build_manifest.BuildManifest>
+    :param hashes: <dict> Feature id -> geometry hash, see mask_cache.feature_hashes
+    :param footprints: <footprints.FootprintFilter> Optional, leaves out the features that cannot overlap a raster
+    :return: <list> clip_pool.ClipTask tuples
+    """
+    tasks = list()
+
+    for block, area in areas.items():
+
+        subdir = outdir + os.sep + "block_%s" % block
+
+        if not os.path.exists(subdir):
+
+            os.makedirs(subdir)
+
+        for in_rast in in_rasters:
+
+            if footprints is not None and not footprints.overlaps(block, in_rast):
+
+                continue
+
+            result_name = output_name(in_rast, subdir, block)
+
+            if manifest.is_current(result_name, [in_rast], {"feature": hashes[block]}):
+
+                continue
+
+            tasks.append(clip_pool.ClipTask(block, in_rast, result_name, area))
+
+    return tasks
+
+
+def accumulated_names(subdir, out_prod, block, years, cube=False):
+    """
+    Return the outputs of the accumulated product of a block
+    :param subdir: <str> The output directory of the block
+    :param out_prod: <str> "Change" or "Cover"
+    :param block: The block id
+    :param years: <list> The years in ascending order
+    :param cube: <bool> The yearly outputs are one raster_cube
+    :return: <tuple> (list of the per-year output paths or the cube path, first change year path, last change year
+    path), the first and last change years are in the CHANGE_YEARS directory of the block
+    """
+    stem = subdir + os.sep + "Accum" + out_prod
+
+    if cube:
+        yearly = [stem + "_block_%s%s" % (block, raster_cube.EXTENSION)]
+
+    else:
+        yearly = [stem + "_block_%s_%s.tif" % (block, year) for year in years]
+
+    stem = os.path.join(os.path.dirname(subdir), CHANGE_YEARS, os.path.basename(subdir), "Accum" + out_prod)
+
+    return yearly, stem + "First_block_%s.tif" % block, stem + "Last_block_%s.tif" % block
+
+
+def annual_index(in_rasters, out_prod, years=None):
+    """
+    Find the annual rasters an accumulated product is computed from
+    :param in_rasters: <list> The rasters in the workspace
+    :param out_prod: <str> "Change" or "Cover"
+    :param years: <list> Optional, the years to use, by default every year found
+    :return: <list> (year, raster) tuples in year order
+    """
+    annual = ANNUAL_PRODUCTS[out_prod]
+
+    index = raster_index.RasterIndex([r for r in in_rasters if os.path.basename(r).startswith(annual)])
+
+    if years is None:
+        years = index.years()
+
+    missing = [y for y in years if y not in index]
+
+    if missing or not years:
+        raise ValueError("No %s raster for the years %s" % (annual, ", ".join(str(y) for y in missing or ["any"])))
+
+    return [(int(y), index.get(y)) for y in sorted(int(y) for y in years)]
+
+
+def accumulate(data, year, out_prod, count, first, last, previous, nodata=clip_engine.NODATA):
+    """
+    Add one year to the running arrays of a block, in place
+    :param data: <numpy.ndarray> The annual pixels of the block, 0 or nodata where there is no value
+    :param year: <int>
+    :param out_prod: <str> "Change" or "Cover"
+    :param count: <numpy.ndarray> uint8 number of changes so far, capped below nodata
+    :param first: <numpy.ndarray> uint16 year of the first change, NO_CHANGE if none
+    :param last: <numpy.ndarray> uint16 year of the last change, NO_CHANGE if none
+    :param previous: <numpy.ndarray> The last valid class of every pixel, only used for Cover
+    :param nodata: <int>
+    :return:
+    """
+    valid = (data != 0) & (data != nodata)
+
+    if out_prod == "Cover":
+        changed = valid & (previous != 0) & (data != previous)
+
+        np.copyto(previous, data, where=valid)
+
+    else:
+        changed = valid
+
+    count[changed & (count < nodata - 1)] += 1
+
+    first[changed & (first == NO_CHANGE)] = year
+
+    last[changed] = year
+
+    return None
+
+
+def accumulate_block(feature, annual, subdir, out_prod, cube=False, masks=None, nodata=clip_engine.NODATA):
+    """
+    Stream the annual rasters over one block in year order and write its accumulated outputs
+    :param feature: <clip_engine.Feature>
+    :param annual: <list> (year, raster) tuples in year order, see annual_index
+    :param subdir: <str> The output directory of the block
+    :param out_prod: <str> "Change" or "Cover"
+    :param cube: <bool> Write the yearly outputs as one raster_cube instead of a raster per year
+    :param masks: <mask_cache.MaskCache>
+    :param nodata: <int>
+    :return: <list> The outputs written
+    """
+    years = [y for y, r in annual]
+
+    names, first_name, last_name = accumulated_names(subdir, out_prod, feature.fid, years, cube)
+
+    if masks is None:
+        masks = MaskCache()
+
+    raster, grid = clip_pool.open_cached(annual[0][1])
+
+    sr = raster.spatialReference
+
+    mask, window = masks.get(feature, grid)
+
+    count = np.zeros(mask.shape, dtype=np.uint8)
+
+    first = np.full(mask.shape, NO_CHANGE, dtype=np.uint16)
+
+    last = np.full(mask.shape, NO_CHANGE, dtype=np.uint16)
+
+    previous = np.zeros(mask.shape, dtype=np.int64) if out_prod == "Cover" else None
+
+    with clip_engine.BlockWriter(names, years, grid, window, sr, nodata) as writer:
+        for year, in_rast in annual:
+            raster, year_grid = clip_pool.open_cached(in_rast)
+
+            if year_grid != grid:
+                raise ValueError("%s is not on the grid of %s" % (in_rast, annual[0][1]))
+
+            data = clip_engine.read_window(raster, grid, window, nodata)
+
+            accumulate(data, year, out_prod, count, first, last, previous, nodata)
+
+            out = count.copy()
+
+            out[~mask] = nodata
+
+            writer.write(year, out)
+
+    for result_name, values in ((first_name, first), (last_name, last)):
+        values[~mask] = NO_CHANGE
+
+        clip_engine.write_window(values, grid, window, result_name, sr, NO_CHANGE)
+
+    return names + [first_name, last_name]
+
+
+def accumulate_blocks(annual, features, outdir, out_prod, manifest, workers=1, env_settings=None, mask_dir=None,
+                      cube=False, footprints=None):
+    """
+    Compute the accumulated product of every block whose outputs are not current
+    :param annual: <list> (year, raster) tuples in year order, see annual_index
+    :param features: <list> clip_engine.Feature tuples
+    :param outdir: <str>
+    :param out_prod: <str> "Change" or "Cover"
+    :param manifest: <build_manifest.BuildManifest>
+    :param workers: <int> The number of worker processes, blocks are computed in parallel
+    :param env_settings: <dict> arcpy.env attributes to set in the workers
+    :param mask_dir: <str> Optional spill directory of the mask cache
+    :param cube: <bool> Write the yearly outputs of a block as one raster_cube
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that overlap none of the rasters
+    :return: <list> (block id, error message) tuples of the failed blocks
+    """
+    hashes = feature_hashes(features)
+
+    years = [y for y, r in annual]
+
+    def inputs(result_name, names):
+        # A year's output depends on the rasters up to that year, the cube and the first and last change years on all
+        if not cube and result_name in names:
+            return [r for y, r in annual[:names.index(result_name) + 1]]
+
+        return [r for y, r in annual]
+
+    def record(job, outputs):
+        names = accumulated_names(job[2], out_prod, job[0].fid, years, cube)[0]
+
+        for result_name in outputs:
+            manifest.record(result_name, inputs(result_name, names), {"feature": hashes[job[0].fid]})
+
+    jobs = list()
+
+    for feature in features:
+        # The accumulation runs over every year, so only a feature outside of all of the rasters is left out
+        if footprints is not None and not any([footprints.overlaps(feature.fid, r) for y, r in annual]):
+            continue
+
+        subdir = outdir + os.sep + "block_%s" % feature.fid
+
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+
+        names, first_name, last_name = accumulated_names(subdir, out_prod, feature.fid, years, cube)
+
+        if not os.path.exists(os.path.dirname(first_name)):
+            os.makedirs(os.path.dirname(first_name))
+
+        if all(manifest.is_current(n, inputs(n, names), {"feature": hashes[feature.fid]})
+               for n in names + [first_name, last_name]):
+            continue
+
+        jobs.append((feature, annual, subdir, out_prod, cube))
+
+    return clip_pool.run_block_tasks(accumulate_block, jobs, workers, env_settings, mask_dir, record, hashes)
+
+
+def clip_by_raster(in_rasters, features, outdir, manifest, masks=None, footprints=None):
+    """
+    Open each raster once and write the outputs of every feature from that one open
+    :param in_rasters: <list> The rasters in the workspace
+    :param features: <list> clip_engine.Feature tuples
+    :param outdir: <str>
+    :param manifest: <build_manifest.BuildManifest> Skips the outputs that are current and records the new ones
+    :param masks: <mask_cache.MaskCache> Optional cache of the rasterized features
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that cannot overlap a raster
+    :return:
+    """
+    hashes = feature_hashes(features)
+
+    for in_rast in in_rasters:
+
+        jobs = list()
+
+        for feature in features:
+
+            if footprints is not None and not footprints.overlaps(feature.fid, in_rast):
+
+                continue
+
+            subdir = outdir + os.sep + "block_%s" % feature.fid
+
+            if not os.path.exists(subdir):
+
+                os.makedirs(subdir)
+
+            result_name = output_name(in_rast, subdir, feature.fid)
+
+            if manifest.is_current(result_name, [in_rast], {"feature": hashes[feature.fid]}):
+
+                continue
+
+            jobs.append((feature, result_name))
+
+        if jobs:
+            clip_engine.clip_raster(in_rast, jobs, masks=masks,
+                                    on_done=lambda f, r: manifest.record(r, [in_rast], {"feature": hashes[f.fid]}))
+
+    return None
+
+
+def clip_by_feature(in_rasters, store, outdir, manifest, footprints=None):
+    """
+    Clip with Clip_management, one clip per feature and raster to the polygon of the feature
+    :param in_rasters: <list> The rasters in the workspace
+    :param store: <geometry_store.GeometryStore> The clipping features
+    :param outdir: <str>
+    :param manifest: <build_manifest.BuildManifest> Skips the outputs that are current and records the new ones
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that cannot overlap a raster
+    :return:
+    """
+    hashes = feature_hashes(store)
+
+    sr = store.spatial_reference()
+
+    for feature in store:
+
+        block = feature.fid
+
+        subdir = outdir + os.sep + "block_%s" % block
+
+        if not os.path.exists(subdir):
+
+            os.makedirs(subdir)
+
+        for in_rast in in_rasters:
+
+            if footprints is not None and not footprints.overlaps(block, in_rast):
+
+                continue
+
+            result_name = output_name(in_rast, subdir, block)
+
+            params = {"feature": hashes[block]}
+
+            if manifest.is_current(result_name, [in_rast], params):
+
+                continue
+
+            clip_pool.clip_to_template(in_rast, result_name, store.polygon(block, sr))
+
+            manifest.record(result_name, [in_rast], params)
+
+    return None
+
+
+def main_work(indir, outdir, shp, out_prod, field="id", years=None, engine="numpy", workers=1, mask_dir=None,
+              checksum=False, out_format=output_format.DEFAULT, accumulate=False, footprint=True):
     """
 
     :param indir:
@@ -29,58 +394,83 @@ def main_work(indir, outdir, shp, out_prod, field="id", years=None):
     :param out_prod:
     :param field:
     :param years:
+    :param engine: <str> "numpy" reads each raster once for all features, "arcpy" runs Clip_management for every
+    feature and raster
+    :param workers: <int> The number of worker processes, more than 1 runs the clips on a process pool
+    :param mask_dir: <str> Optional directory that keeps the rasterized features for reuse by later runs
+    :param checksum: <bool> Fingerprint the input rasters with MD5 and verify existing outputs against their MD5
+    :param out_format: <str> The output format, see output_format.FORMATS
+    :param accumulate: <bool> Compute the accumulated product from the annual rasters instead of clipping the
+    accumulated rasters of the workspace
+    :param footprint: <bool> Skip the feature/raster pairs whose extents do not intersect, see footprints.py
     :return:
     """
+    if out_format == output_format.CUBE and not accumulate:
+        raise ValueError("The cube format needs accumulate, the rasters of the workspace are not one per year")
+
     env.workspace = indir
 
     split_shape = shp
 
-    in_rasters = arcpy.ListRasters()
+    in_rasters = [os.path.join(indir, r) for r in arcpy.ListRasters()]
+
+    if years is not None:
+        years = [int(y) for y in years]
+
+        if not accumulate:
+            in_rasters = [r for r in in_rasters if set(raster_index.year_tokens(r)) & set(years)]
 
     split_field = field
 
-    cursor = arcpy.SearchCursor(split_shape)
+    scratch = Scratch()
 
-    for row in cursor:
+    store = geometry_store.write_scratch(split_shape, split_field, scratch)
 
-        block = row.getValue(split_field)
+    features = store.features()
 
-        subdir = outdir + os.sep + "block_%s" % block
+    hashes = feature_hashes(features)
 
-        if not os.path.exists(subdir):
+    footprints = FootprintFilter(features, store.spatial_reference()) if footprint else None
 
-            os.makedirs(subdir)
+    manifest = BuildManifest(os.path.join(outdir, "build_manifest_%s.json" % out_prod),
+                             {"tool": "clip_accumulated_change", "nodata": clip_engine.NODATA, "format": out_format},
+                             checksum)
 
-        for in_rast in in_rasters:
+    with scratch, manifest, output_format.using(out_format) as settings:
 
-            name = os.path.splitext(in_rast)[0]
+        if accumulate:
 
-            result_name = subdir + os.sep + name + "_block_%s.tif" % block
+            failed = accumulate_blocks(annual_index(in_rasters, out_prod, years), features, outdir, out_prod,
+                                       manifest, workers, dict(settings, workspace=indir), mask_dir,
+                                       out_format == output_format.CUBE, footprints)
 
-            if os.path.exists(result_name):
+            if failed:
+                raise RuntimeError("The accumulated %s of %s blocks failed" % (out_prod, len(failed)))
 
-                continue
+        elif workers > 1:
+
+            tasks = build_tasks(in_rasters, store.areas(), outdir, manifest, hashes, footprints)
+
+            failed = clip_pool.run_tasks(tasks, workers, split_shape, split_field, engine,
+                                         env_settings=dict(settings, workspace=indir), mask_dir=mask_dir,
+                                         on_done=lambda t: manifest.record(t.result_name, [t.in_rast],
+                                                                           {"feature": hashes[t.fid]}),
+                                         store=store.path, hashes=hashes)
+
+            if failed:
+                raise RuntimeError("%s of %s clips failed" % (len(failed), len(tasks)))
 
-            # Create feature layer of current clipping polygon
-            where_clause = "%s = %s" % (split_field, block)
+        elif engine == "numpy":
 
-            arcpy.MakeFeatureLayer_management(split_shape, 'currentMask', where_clause)
+            clip_by_raster(in_rasters, features, outdir, manifest, MaskCache(spill_dir=mask_dir, hashes=hashes),
+                           footprints)
 
-            arcpy.AddMessage("Processing: " + result_name)
+        else:
 
-            # Save the clipped raster
-            arcpy.Clip_management(
-                in_rast,
-                rectangle="#",
-                out_raster=result_name,
-                in_template_dataset='currentMask',
-                nodata_value="255",
-                clipping_geometry="ClippingGeometry",
-                maintain_clipping_extent="MAINTAIN_EXTENT"
-            )
+            clip_by_feature(in_rasters, store, outdir, manifest, footprints)
 
-            if arcpy.Exists('currentMask'):
-                arcpy.Delete_management('currentMask')
+    if footprints is not None:
+        footprints.report()
 
     return None
 
@@ -111,8 +501,46 @@ def main():
     parser.add_argument("-n", "--name", dest="out_prod", required=True, type=str, choices=["Change", "Cover"],
                         help="Specify the name of the product")
 
+    parser.add_argument("-a", "--accumulate", dest="accumulate", action="store_true",
+                        help="Optional, compute the accumulated product from the annual ChangeMap (Change) or "
+                             "CoverPrim (Cover) rasters in the workspace instead of clipping accumulated rasters")
+
+    parser.add_argument("-e", "--engine", dest="engine", required=False, type=str, default="numpy",
+                        choices=["numpy", "arcpy"],
+                        help="numpy (default) reads each raster once and clips every feature from it, arcpy runs "
+                             "Clip_management for every feature and raster")
+
+    parser.add_argument("-w", "--workers", dest="workers", required=False, type=int, default=1,
+                        help="The number of worker processes, default is 1 (serial)")
+
+    parser.add_argument("-m", "--mask-cache", dest="mask_dir", required=False, type=str,
+                        help="Optional directory that keeps the rasterized features of the numpy engine, share it "
+                             "between products that are clipped on the same grid")
+
+    parser.add_argument("--checksum", dest="checksum", action="store_true",
+                        help="Optional, fingerprint the input rasters with MD5 instead of size and modification time "
+                             "and verify the MD5 of existing outputs before skipping them")
+
+    parser.add_argument("-F", "--format", dest="out_format", required=False, type=str,
+                        default=output_format.DEFAULT, choices=sorted(output_format.FORMATS),
+                        help="Optional, the output format: none (default) for striped uncompressed GeoTiffs, lzw or "
+                             "deflate for tiled compressed GeoTiffs, cube (with --accumulate) for one raster_cube per "
+                             "block holding every year")
+
+    parser.add_argument("--no-footprint", dest="footprint", action="store_false",
+                        help="Optional, clip every feature against every raster instead of skipping the pairs whose "
+                             "extents do not intersect")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main_work(**vars(args))
 
     return None
@@ -0,0 +1,339 @@
+"""
+Clip a raster to many features with a single open of the raster.  For every feature only the pixel window under the
+feature's bounding box is read, the pixels outside of the polygon are set to nodata and the window is written out.
+
+The outputs follow the Clip_management settings used by the clip tools (nodata_value="255",
+clipping_geometry="ClippingGeometry", maintain_clipping_extent="MAINTAIN_EXTENT"), except that the output extent is
+the feature extent snapped outward to the cells of the input raster, so the pixels are never resampled.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import collections
+import math
+import numpy as np
+import arcpy
+import raster_cube
+from build_manifest import atomic_output
+
+NODATA = 255
+
+Feature = collections.namedtuple("Feature", ["fid", "rings", "bbox"])
+
+Grid = collections.namedtuple("Grid", ["xmin", "ymax", "cell_width", "cell_height", "ncols", "nrows"])
+
+
+def geometry_rings(geom):
+    """
+    Return the rings of every part of a polygon, interior rings included
+    :param geom: <arcpy.Polygon>
+    :return: <list> numpy arrays of shape (n, 2) holding the x, y coordinates of each ring
+    """
+    rings = list()
+
+    for part in geom:
+        ring = list()
+
+        for point in part:
+            # A None point separates the exterior ring from the interior rings of a part
+            if point is None:
+                if ring:
+                    rings.append(np.array(ring, dtype=np.float64))
+
+                ring = list()
+
+            else:
+                ring.append((point.X, point.Y))
+
+        if ring:
+            rings.append(np.array(ring, dtype=np.float64))
+
+    return rings
+
+
+def read_features(shp, field):
+    """
+    Read the clipping features once
+    :param shp: <str> The full path to the clipping shapefile
+    :param field: <str> The attribute field that identifies each feature
+    :return: <list> Feature tuples
+    """
+    features = list()
+
+    with arcpy.da.SearchCursor(shp, [field, 'SHAPE@']) as cursor:
+        for fid, geom in cursor:
+            if geom is None:
+                continue
+
+            ext = geom.extent
+
+            features.append(Feature(fid, geometry_rings(geom), (ext.XMin, ext.YMin, ext.XMax, ext.YMax)))
+
+    return features
+
+
+def raster_grid(raster):
+    """
+    Get the grid definition of a raster
+    :param raster: <arcpy.Raster>
+    :return: <Grid>
+    """
+    return Grid(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth, raster.meanCellHeight,
+                raster.width, raster.height)
+
+
+def feature_window(bbox, grid):
+    """
+    Snap a bounding box outward to the cells of a grid.  The window may extend past the edges of the grid.
+    :param bbox: <tuple> (xmin, ymin, xmax, ymax)
+    :param grid: <Grid>
+    :return: <tuple> (col_off, row_off, ncols, nrows) in cells relative to the upper left corner of the grid
+    """
+    col0 = int(math.floor((bbox[0] - grid.xmin) / grid.cell_width))
+
+    col1 = int(math.ceil((bbox[2] - grid.xmin) / grid.cell_width))
+
+    row0 = int(math.floor((grid.ymax - bbox[3]) / grid.cell_height))
+
+    row1 = int(math.ceil((grid.ymax - bbox[1]) / grid.cell_height))
+
+    return col0, row0, max(col1 - col0, 1), max(row1 - row0, 1)
+
+
+def rasterize(rings, xmin, ymax, cell_width, cell_height, ncols, nrows):
+    """
+    Burn polygon rings into a boolean mask, a cell is inside when its center is inside the polygon (even-odd rule)
+    :param rings: <list> numpy arrays of shape (n, 2), see geometry_rings
+    :param xmin: <float> The left edge of the mask
+    :param ymax: <float> The top edge of the mask
+    :param cell_width: <float>
+    :param cell_height: <float>
+    :param ncols: <int>
+    :param nrows: <int>
+    :return: <numpy.ndarray> Boolean array of shape (nrows, ncols)
+    """
+    mask = np.zeros((nrows, ncols), dtype=np.bool_)
+
+    starts = np.concatenate([r for r in rings])
+
+    ends = np.concatenate([np.roll(r, -1, axis=0) for r in rings])
+
+    # Drop horizontal edges, they never cross a scanline
+    keep = starts[:, 1] != ends[:, 1]
+
+    x1, y1 = starts[keep, 0], starts[keep, 1]
+
+    x2, y2 = ends[keep, 0], ends[keep, 1]
+
+    ylo = np.minimum(y1, y2)
+
+    yhi = np.maximum(y1, y2)
+
+    for row in range(nrows):
+        yc = ymax - (row + 0.5) * cell_height
+
+        crossing = (ylo <= yc) & (yc < yhi)
+
+        if not crossing.any():
+            continue
+
+        xs = x1[crossing] + (yc - y1[crossing]) * (x2[crossing] - x1[crossing]) / (y2[crossing] - y1[crossing])
+
+        xs.sort()
+
+        # Cell centers at or past the entering crossing and before the leaving crossing are inside
+        cols = np.ceil((xs - xmin) / cell_width - 0.5).astype(np.int64)
+
+        cols = np.clip(cols, 0, ncols)
+
+        for c0, c1 in zip(cols[0::2], cols[1::2]):
+            mask[row, c0:c1] = True
+
+    return mask
+
+
+def read_window(raster, grid, window, nodata=NODATA):
+    """
+    Read the pixels of a window, the part of the window outside of the raster is filled with nodata
+    :param raster: <arcpy.Raster>
+    :param grid: <Grid> The grid of the raster
+    :param window: <tuple> (col_off, row_off, ncols, nrows), see feature_window
+    :param nodata: <int> The value given to the nodata pixels of the input
+    :return: <numpy.ndarray>
+    """
+    col_off, row_off, ncols, nrows = window
+
+    c0, r0 = max(col_off, 0), max(row_off, 0)
+
+    c1, r1 = min(col_off + ncols, grid.ncols), min(row_off + nrows, grid.nrows)
+
+    if c1 <= c0 or r1 <= r0:
+        return np.full((nrows, ncols), nodata, dtype=np.uint8)
+
+    lower_left = arcpy.Point(grid.xmin + c0 * grid.cell_width, grid.ymax - r1 * grid.cell_height)
+
+    data = arcpy.RasterToNumPyArray(raster, lower_left, c1 - c0, r1 - r0, nodata)
+
+    if (c0, r0, c1, r1) == (col_off, row_off, col_off + ncols, row_off + nrows):
+        return data
+
+    out = np.full((nrows, ncols), nodata, dtype=data.dtype)
+
+    out[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = data
+
+    return out
+
+
+def write_window(data, grid, window, out_raster, sr, nodata=NODATA):
+    """
+    Save an array as a raster placed at the given window of the grid, see build_manifest.atomic_output
+    :param data: <numpy.ndarray>
+    :param grid: <Grid>
+    :param window: <tuple> (col_off, row_off, ncols, nrows)
+    :param out_raster: <str> The full path to the output raster
+    :param sr: <arcpy.SpatialReference>
+    :param nodata: <int>
+    :return:
+    """
+    col_off, row_off, ncols, nrows = window
+
+    lower_left = arcpy.Point(grid.xmin + col_off * grid.cell_width, grid.ymax - (row_off + nrows) * grid.cell_height)
+
+    out = arcpy.NumPyArrayToRaster(data, lower_left, grid.cell_width, grid.cell_height, nodata)
+
+    with atomic_output(out_raster) as tmp_name:
+        out.save(tmp_name)
+
+        # The saved Raster holds the file open, on Windows it has to be released before the rename
+        del out
+
+        arcpy.DefineProjection_management(tmp_name, sr)
+
+    return None
+
+
+class BlockWriter(object):
+    """
+    Writes the yearly outputs of one block as they are made: a raster per year, or all years into one raster_cube
+    when the only output name is a cube
+    """
+
+    def __init__(self, names, years, grid, window, sr, nodata=NODATA):
+        """
+        :param names: <list> The output raster of every year, or the path of the cube
+        :param years: <list> The years in the order they are written
+        :param grid: <Grid> The grid of the input rasters
+        :param window: <tuple> (col_off, row_off, ncols, nrows) of the block
+        :param sr: <arcpy.SpatialReference>
+        :param nodata: <int>
+        """
+        self.names = dict(zip(years, names))
+
+        self.years = list(years)
+
+        self.grid = grid
+
+        self.window = window
+
+        self.sr = sr
+
+        self.nodata = nodata
+
+        self.cube = names[0] if len(names) == 1 and names[0].endswith(raster_cube.EXTENSION) else None
+
+        self._create = None
+
+        self._writer = None
+
+    def write(self, year, data):
+        """
+        :param year: <int>
+        :param data: <numpy.ndarray> The pixels of the block window
+        :return:
+        """
+        if self.cube is None:
+            return write_window(data, self.grid, self.window, self.names[year], self.sr, self.nodata)
+
+        if self._writer is None:
+            col_off, row_off, ncols, nrows = self.window
+
+            self._create = raster_cube.create(self.cube, self.years, nrows, ncols, data.dtype,
+                                              self.grid.xmin + col_off * self.grid.cell_width,
+                                              self.grid.ymax - row_off * self.grid.cell_height, self.grid.cell_width,
+                                              self.grid.cell_height, self.nodata, self.sr.exportToString())
+
+            self._writer = self._create.__enter__()
+
+        self._writer.write(year, data)
+
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._create is not None:
+            self._create.__exit__(exc_type, exc_value, tb)
+
+        return False
+
+
+def clip_feature(raster, grid, feature, nodata=NODATA, masks=None):
+    """
+    Clip the already opened raster to one feature
+    :param raster: <arcpy.Raster>
+    :param grid: <Grid>
+    :param feature: <Feature>
+    :param nodata: <int>
+    :param masks: <mask_cache.MaskCache> Optional cache of the rasterized features
+    :return: <tuple> (data, window)
+    """
+    if masks is not None:
+        mask, window = masks.get(feature, grid)
+
+    else:
+        window = feature_window(feature.bbox, grid)
+
+        col_off, row_off, ncols, nrows = window
+
+        mask = rasterize(feature.rings, grid.xmin + col_off * grid.cell_width, grid.ymax - row_off * grid.cell_height,
+                         grid.cell_width, grid.cell_height, ncols, nrows)
+
+    data = read_window(raster, grid, window, nodata)
+
+    np.putmask(data, ~mask, nodata)
+
+    return data, window
+
+
+def clip_raster(in_rast, jobs, nodata=NODATA, masks=None, on_done=None, on_data=None):
+    """
+    Open a raster once and write a clipped output for every feature
+    :param in_rast: <str> The input raster
+    :param jobs: <list> (Feature, result_name) tuples
+    :param nodata: <int>
+    :param masks: <mask_cache.MaskCache> Optional cache of the rasterized features
+    :param on_done: <function> Optional, called with (feature, result_name) after each output is written
+    :param on_data: <function> Optional, called with (feature, clipped pixels) of each output, e.g. for statistics
+    :return: <int> The number of rasters written
+    """
+    raster = arcpy.Raster(in_rast)
+
+    grid = raster_grid(raster)
+
+    sr = raster.spatialReference
+
+    for feature, result_name in jobs:
+        arcpy.AddMessage("Processing: " + result_name)
+
+        data, window = clip_feature(raster, grid, feature, nodata, masks)
+
+        write_window(data, grid, window, result_name, sr, nodata)
+
+        if on_data is not None:
+            on_data(feature, data)
+
+        if on_done is not None:
+            on_done(feature, result_name)
+
+    return len(jobs)
@@ -0,0 +1,370 @@
+"""
+Run (feature, raster) clip tasks on a pool of worker processes.  Every worker gets its own scratch workspace and its
+own feature layer name.  The tasks are handed out one raster after the other, so the workers keep clipping from the
+raster they have open, and within a raster the largest features go first so that the long clips of a raster don't
+end up at its tail.  Each idle worker pulls the next task.
+
+Work that streams all the years over one block at a time (accumulated products, raster cubes) runs as block tasks
+instead: one task per feature, with the annual rasters opened once per worker.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import collections
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+import arcpy
+import clip_engine
+import geometry_store
+import zonal_stats
+from build_manifest import atomic_output
+from mask_cache import MaskCache
+from scratch import Scratch
+
+ClipTask = collections.namedtuple("ClipTask", ["fid", "in_rast", "result_name", "weight"])
+
+# Per-process state of a worker, filled in by init_worker
+_worker = dict()
+
+# The rasters opened by the block tasks of this process, path -> (arcpy.Raster, clip_engine.Grid)
+_opened = dict()
+
+
+def layer_name():
+    """
+    Return a feature layer name that is unique to the current process
+    :return: <str>
+    """
+    return "currentMask_%d" % os.getpid()
+
+
+def clip_with_layer(in_rast, result_name, split_shape, split_field, fid, layer=None):
+    """
+    Clip a raster to one feature with Clip_management, see build_manifest.atomic_output
+    :param in_rast: <str> The input raster
+    :param result_name: <str> The full path to the output raster
+    :param split_shape: <str> The full path to the clipping shapefile
+    :param split_field: <str> The attribute field that identifies each feature
+    :param fid: The id of the clipping feature
+    :param layer: <str> The name of the temporary feature layer, default is unique to the current process
+    :return:
+    """
+    if layer is None:
+        layer = layer_name()
+
+    # Create feature layer of current clipping polygon
+    where_clause = "%s = %s" % (split_field, fid)
+
+    arcpy.MakeFeatureLayer_management(split_shape, layer, where_clause)
+
+    clip_to_template(in_rast, result_name, layer)
+
+    if arcpy.Exists(layer):
+        arcpy.Delete_management(layer)
+
+    return None
+
+
+def clip_to_template(in_rast, result_name, template):
+    """
+    Clip a raster to a feature layer or a geometry with Clip_management, see build_manifest.atomic_output
+    :param in_rast: <str> The input raster
+    :param result_name: <str> The full path to the output raster
+    :param template: <str> or <arcpy.Polygon> The feature layer or the polygon, see geometry_store.polygon
+    :return:
+    """
+    arcpy.AddMessage("Processing: " + result_name)
+
+    # Save the clipped raster
+    with atomic_output(result_name) as tmp_name:
+        arcpy.Clip_management(
+            in_rast,
+            rectangle="#",
+            out_raster=tmp_name,
+            in_template_dataset=template,
+            nodata_value="255",
+            clipping_geometry="ClippingGeometry",
+            maintain_clipping_extent="MAINTAIN_EXTENT"
+        )
+
+    return None
+
+
+def init_worker(split_shape, split_field, engine, scratch_root, env_settings, mask_dir=None, continuous=None,
+                store=None, hashes=None):
+    """
+    Set up a worker process: a private scratch workspace, the arcpy environment and, for the numpy engine, the
+    clipping features read once per worker and a mask cache.  With a geometry store the features are mapped from the
+    store instead of read and the arcpy engine clips to their polygons instead of a feature layer per clip
+    :param split_shape: <str>
+    :param split_field: <str>
+    :param engine: <str> "numpy" or "arcpy"
+    :param scratch_root: <str> The directory holding the scratch workspaces of all workers
+    :param env_settings: <dict> arcpy.env attributes to set, e.g. workspace and compression
+    :param mask_dir: <str> Optional spill directory of the mask cache, shared by all workers
+    :param continuous: <bool> Return the zonal statistics of every clip of the numpy engine, see
+    zonal_stats.summarize, None for no statistics
+    :param store: <str> Optional, the full path to the geometry store of the clipping features, see geometry_store.py
+    :param hashes: <dict> Optional, the geometry hashes of the mask cache, see mask_cache.feature_hashes
+    :return:
+    """
+    for key, value in env_settings.items():
+        setattr(arcpy.env, key, value)
+
+    scratch = tempfile.mkdtemp(prefix="worker_%d_" % os.getpid(), dir=scratch_root)
+
+    arcpy.env.scratchWorkspace = scratch
+
+    _worker.update(split_shape=split_shape, split_field=split_field, engine=engine, rasters=dict(),
+                   continuous=continuous, store=None)
+
+    if store is not None:
+        _worker["store"] = geometry_store.open_store(store)
+
+        _worker["sr"] = _worker["store"].spatial_reference()
+
+    if engine == "numpy":
+        if store is not None:
+            _worker["features"] = _worker["store"]
+
+        else:
+            _worker["features"] = dict((f.fid, f) for f in clip_engine.read_features(split_shape, split_field))
+
+        _worker["masks"] = MaskCache(spill_dir=mask_dir, hashes=hashes)
+
+    return None
+
+
+def open_raster(in_rast):
+    """
+    Open a raster in the worker, keeping the most recent one open for the next task on the same raster
+    :param in_rast: <str>
+    :return: <tuple> (arcpy.Raster, clip_engine.Grid)
+    """
+    rasters = _worker["rasters"]
+
+    if in_rast not in rasters:
+        rasters.clear()
+
+        raster = arcpy.Raster(in_rast)
+
+        rasters[in_rast] = (raster, clip_engine.raster_grid(raster))
+
+    return rasters[in_rast]
+
+
+def run_task(task):
+    """
+    Run one clip task in a worker
+    :param task: <ClipTask>
+    :return: <tuple> (result_name, seconds, error message or None, zonal statistics or None)
+    """
+    t1 = time.time()
+
+    groups = None
+
+    try:
+        if _worker["engine"] == "numpy":
+            raster, grid = open_raster(task.in_rast)
+
+            data, window = clip_engine.clip_feature(raster, grid, _worker["features"][task.fid],
+                                                     masks=_worker["masks"])
+
+            clip_engine.write_window(data, grid, window, task.result_name, raster.spatialReference)
+
+            if _worker["continuous"] is not None:
+                groups = zonal_stats.summarize(data, _worker["continuous"], clip_engine.NODATA)
+
+        elif _worker["store"] is not None:
+            clip_to_template(task.in_rast, task.result_name, _worker["store"].polygon(task.fid, _worker["sr"]))
+
+        else:
+            clip_with_layer(task.in_rast, task.result_name, _worker["split_shape"], _worker["split_field"], task.fid)
+
+    except Exception:
+        return task.result_name, time.time() - t1, traceback.format_exc(), None
+
+    return task.result_name, time.time() - t1, None, groups
+
+
+def open_cached(in_rast):
+    """
+    Open a raster once per process, for block tasks that read every year's raster for every block
+    :param in_rast: <str>
+    :return: <tuple> (arcpy.Raster, clip_engine.Grid)
+    """
+    if in_rast not in _opened:
+        raster = arcpy.Raster(in_rast)
+
+        _opened[in_rast] = (raster, clip_engine.raster_grid(raster))
+
+    return _opened[in_rast]
+
+
+def init_block_worker(env_settings, mask_dir=None, hashes=None):
+    """
+    Set up a worker process of run_block_tasks
+    :param env_settings: <dict> arcpy.env attributes to set
+    :param mask_dir: <str> Optional spill directory of the mask cache, shared by all workers
+    :param hashes: <dict> Optional, the geometry hashes of the mask cache, see mask_cache.feature_hashes
+    :return:
+    """
+    for key, value in env_settings.items():
+        setattr(arcpy.env, key, value)
+
+    _worker["masks"] = MaskCache(spill_dir=mask_dir, hashes=hashes)
+
+    return None
+
+
+def run_block_task(args):
+    """
+    Run one block task in a worker, errors are returned instead of stopping the other blocks
+    :param args: <tuple> (func, job index, job), see run_block_tasks
+    :return: <tuple> (job index, outputs written, seconds, error message or None)
+    """
+    func, index, job = args
+
+    t1 = time.time()
+
+    try:
+        return index, func(*job, masks=_worker["masks"]), time.time() - t1, None
+
+    except Exception:
+        return index, list(), time.time() - t1, traceback.format_exc()
+
+
+def run_block_tasks(func, jobs, workers=1, env_settings=None, mask_dir=None, on_done=None, hashes=None):
+    """
+    Run one function call per block, on a process pool when there is more than one worker
+    :param func: <function> A module level function called as func(*job, masks=MaskCache) that returns the outputs
+    it wrote, the first item of every job is the clip_engine.Feature of the block
+    :param jobs: <list> Argument tuples
+    :param workers: <int> The number of worker processes
+    :param env_settings: <dict> arcpy.env attributes to set in every worker
+    :param mask_dir: <str> Optional spill directory of the mask cache
+    :param on_done: <function> Optional, called in this process with the job and its outputs for every block done
+    :param hashes: <dict> Optional, the geometry hashes of the blocks, see mask_cache.feature_hashes
+    :return: <list> (block id, error message) tuples of the failed blocks
+    """
+    failed = list()
+
+    if workers <= 1 or len(jobs) <= 1:
+        masks = MaskCache(spill_dir=mask_dir, hashes=hashes)
+
+        for i, job in enumerate(jobs):
+            arcpy.AddMessage("Processing: block %s (%s of %s)" % (job[0].fid, i + 1, len(jobs)))
+
+            outputs = func(*job, masks=masks)
+
+            if on_done is not None:
+                on_done(job, outputs)
+
+        return failed
+
+    pool = multiprocessing.Pool(workers, init_block_worker, (env_settings or dict(), mask_dir, hashes))
+
+    try:
+        results = pool.imap_unordered(run_block_task, [(func, i, job) for i, job in enumerate(jobs)], 1)
+
+        for done, (i, outputs, seconds, error) in enumerate(results):
+            fid = jobs[i][0].fid
+
+            if error is None:
+                print("%s of %s: block %s (%.1f s)" % (done + 1, len(jobs), fid, seconds))
+
+                if on_done is not None:
+                    on_done(jobs[i], outputs)
+
+            else:
+                failed.append((fid, error))
+
+                sys.stderr.write("%s of %s FAILED: block %s\n%s\n" % (done + 1, len(jobs), fid, error))
+
+    except BaseException:
+        pool.terminate()
+
+        raise
+
+    else:
+        pool.close()
+
+    finally:
+        pool.join()
+
+    return failed
+
+
+def run_tasks(tasks, workers, split_shape, split_field, engine="arcpy", env_settings=None, mask_dir=None,
+              on_done=None, on_stats=None, continuous=False, store=None, hashes=None):
+    """
+    Run clip tasks on a process pool, one raster after the other and the largest features of a raster first, so a
+    worker keeps clipping from the raster it has open, see open_raster
+    :param tasks: <list> ClipTask tuples, outputs that already exist should be left out
+    :param workers: <int> The number of worker processes
+    :param split_shape: <str> The full path to the clipping shapefile
+    :param split_field: <str> The attribute field that identifies each feature
+    :param engine: <str> "numpy" or "arcpy"
+    :param env_settings: <dict> arcpy.env attributes to set in every worker
+    :param mask_dir: <str> Optional spill directory of the mask cache, see mask_cache.MaskCache
+    :param on_done: <function> Optional, called in this process with the ClipTask of every output that was written
+    :param on_stats: <function> Optional, called in this process with the ClipTask and the zonal statistics of every
+    output of the numpy engine, see zonal_stats.summarize
+    :param continuous: <bool> Summarize the statistics as a continuous product
+    :param store: <str> Optional, the full path to the geometry store the workers map the features from
+    :param hashes: <dict> Optional, the geometry hashes of the features for the mask cache of the numpy engine, see
+    mask_cache.feature_hashes
+    :return: <list> (result_name, error message) tuples of the failed tasks
+    """
+    if env_settings is None:
+        env_settings = dict()
+
+    tasks = sorted(tasks, key=lambda t: (t.in_rast, -t.weight))
+
+    by_name = dict((t.result_name, t) for t in tasks)
+
+    scratch = Scratch()
+
+    scratch_root = scratch.directory("clip")
+
+    failed = list()
+
+    pool = multiprocessing.Pool(workers, init_worker,
+                                (split_shape, split_field, engine, scratch_root, env_settings, mask_dir,
+                                 continuous if on_stats is not None else None, store,
+                                 hashes if engine == "numpy" else None))
+
+    try:
+        for i, (result_name, seconds, error, groups) in enumerate(pool.imap_unordered(run_task, tasks, 1)):
+            if error is None:
+                print("%s of %s: %s (%.1f s)" % (i + 1, len(tasks), result_name, seconds))
+
+                if on_done is not None:
+                    on_done(by_name[result_name])
+
+                if on_stats is not None and groups is not None:
+                    on_stats(by_name[result_name], groups)
+
+            else:
+                failed.append((result_name, error))
+
+                sys.stderr.write("%s of %s FAILED: %s\n%s\n" % (i + 1, len(tasks), result_name, error))
+
+    except BaseException:
+        pool.terminate()
+
+        raise
+
+    else:
+        pool.close()
+
+    finally:
+        pool.join()
+
+        scratch.close()
+
+    return failed
@@ -1,18 +1,26 @@
 """Calculate the number of shapes that intersect each shape for a multifeature polygon.
 
-1. Creates a new layer from the full shapefile dataset
-2. Parses through each row of the layer and creates a new selection for that row
-3. Generates a new spatial selection using the intersection with the currently selected row
-4. Calculates the number of features selected by the intersection, appends this value to a list
+1. Reads the geometry of every feature once
+2. Builds a packed spatial index (STR-tree) over the feature bounding boxes
+3. For each feature, tests only the candidates whose bounding box intersects its own against the actual geometry
+4. Counts the intersecting features for each row, the feature itself included, the same way a spatial selection
+   with the INTERSECT relationship would, and appends the count to a checkpoint journal keyed by OID
 5. Updates the original shapefile with the count for each row
 
+The journal makes the tool restartable and incremental: on a rerun only the features that are missing from the
+journal or whose geometry changed, plus their neighbours, are counted again.  Every run writes the features it is going
+to count to the journal first, so a resume after a crash only counts what is left of that plan instead of treating
+the features it didn't reach as new ones.
+
 Note: Must run with the arc python 2.7 interpreter (e.g. C:/Python27/ArcGISx6410.5/python.exe)"""
 
 
 import os
 import argparse
-import pickle
+import hashlib
 import arcpy
+import gp_profiler
+from spatial_index import STRTree, extent_to_bbox
 
 
 def make_layer(in_feature, out_lyr, **args):
@@ -21,43 +29,427 @@ def make_layer(in_feature, out_lyr, **args):
     return None
 
 
-def main(env, feature):
+def format_bbox(bbox):
+    """
+    :param bbox: <tuple> (xmin, ymin, xmax, ymax) or None
+    :return: <str> The bounding box as it is written to the journal
+    """
+    return ','.join(repr(float(v)) for v in bbox) if bbox is not None else ''
+
+
+def parse_bbox(text):
+    """
+    :param text: <str> See format_bbox
+    :return: <tuple> (xmin, ymin, xmax, ymax) or None
+    """
+    return tuple(float(v) for v in text.split(',')) if text else None
+
+
+class OverlapJournal(object):
+    """
+    Append-only checkpoint journal of overlap counts keyed by OID.  Each line holds the OID, the count, a fingerprint
+    of the geometry and its bounding box, separated by tabs.  A later line for an OID supersedes the earlier ones and
+    a line holding only the OID and 'DELETED' removes it.  A line starting with 'PLAN' holds the OID, fingerprint and
+    bounding box of every feature a run is going to count, the planned features without a later record are pending.
+    Lines are flushed to disk every 'flush_every' records, a partially written last line left by a crash is ignored
+    when the journal is read back.
+    """
+    deleted = "DELETED"
+
+    planned = "PLAN"
+
+    def __init__(self, path, flush_every=1000):
+        """
+        :param path: <str> The full path to the journal file
+        :param flush_every: <int> The number of records between flushes to disk
+        """
+        self.path = path
+
+        self.flush_every = flush_every
+
+        self._pending = 0
+
+        self._file = None
+
+        # OID -> (fingerprint, bbox) of the features the last run planned and didn't count, set by load
+        self.pending = dict()
+
+    def load(self):
+        """
+        Read the journal back, the features left over from an interrupted run are put in 'pending'
+        :return: <dict> OID -> (count, fingerprint, bbox)
+        """
+        records = dict()
+
+        self.pending = dict()
+
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Partial record from an interrupted write
+                    break
+
+                fields = line.rstrip('\n').split('\t')
+
+                try:
+                    if fields[0] == self.planned:
+                        self.pending = dict()
+
+                        for entry in fields[1].split(';') if fields[1] else list():
+                            oid, fingerprint, bbox = entry.split(':')
+
+                            self.pending[int(oid)] = (fingerprint, parse_bbox(bbox))
+
+                        continue
+
+                    oid = int(fields[0])
+
+                    self.pending.pop(oid, None)
+
+                    if fields[1] == self.deleted:
+                        records.pop(oid, None)
+
+                        continue
+
+                    records[oid] = (int(fields[1]), fields[2], parse_bbox(fields[3]))
+
+                except (IndexError, ValueError):
+                    continue
+
+        return records
+
+    def open(self):
+        # Make sure a partial last line doesn't swallow the first new record
+        needs_newline = False
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+
+                needs_newline = f.read(1) != b'\n'
+
+        self._file = open(self.path, 'a')
+
+        if needs_newline:
+            self._file.write('\n')
+
+        return self
+
+    def plan(self, entries):
+        """
+        Record the features a run is going to count, on one line so that a crash can't leave half a plan
+        :param entries: <dict> OID -> (fingerprint, bbox)
+        :return:
+        """
+        self._file.write('{}\t{}\n'.format(self.planned, ';'.join(
+            '{}:{}:{}'.format(oid, fingerprint, format_bbox(bbox)) for oid, (fingerprint, bbox) in entries.items())))
+
+        self.flush()
+
+        return None
+
+    def append(self, oid, count, fingerprint, bbox):
+        """
+        Append the count of one feature
+        :param oid: <int>
+        :param count: <int>
+        :param fingerprint: <str> See geometry_fingerprint
+        :param bbox: <tuple> (xmin, ymin, xmax, ymax) or None
+        :return:
+        """
+        self._file.write('{}\t{}\t{}\t{}\n'.format(oid, count, fingerprint, format_bbox(bbox)))
+
+        self._tick()
+
+        return None
+
+    def remove(self, oid):
+        """
+        Record that a feature no longer exists
+        :param oid: <int>
+        :return:
+        """
+        self._file.write('{}\t{}\n'.format(oid, self.deleted))
+
+        self._tick()
+
+        return None
+
+    def _tick(self):
+        self._pending += 1
+
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+
+        os.fsync(self._file.fileno())
+
+        self._pending = 0
+
+        return None
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+
+            self._file.close()
+
+            self._file = None
+
+        return None
+
+    def compact(self, records):
+        """
+        Rewrite the journal so that it holds only the current record of each OID
+        :param records: <dict> OID -> (count, fingerprint, bbox)
+        :return:
+        """
+        temp = self.path + '.tmp'
+
+        with open(temp, 'w') as f:
+            for oid in sorted(records):
+                count, fingerprint, bbox = records[oid]
+
+                f.write('{}\t{}\t{}\t{}\n'.format(oid, count, fingerprint, format_bbox(bbox)))
+
+            f.flush()
+
+            os.fsync(f.fileno())
+
+        # os.rename won't replace an existing file on Windows
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        os.rename(temp, self.path)
+
+        return None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def geometry_fingerprint(geom):
+    """
+    Return a fingerprint used to detect a changed geometry between runs
+    :param geom: <arcpy.Geometry> or None
+    :return: <str>
+    """
+    if geom is None:
+        return 'null'
+
+    return hashlib.md5(bytes(geom.WKB)).hexdigest()
+
+
+def load_geometries(feature):
+    """
+    Read the geometry of every feature in a single cursor pass
+    :param feature: <str> The feature class
+    :return: <dict> OID -> arcpy geometry (None for rows with a null shape)
+    """
+    geometries = dict()
+
+    with arcpy.da.SearchCursor(feature, ['OID@', 'SHAPE@']) as cursor:
+        for oid, shape in cursor:
+            geometries[oid] = shape
+
+    return geometries
+
+
+def build_index(geometries, node_capacity=16):
+    """
+    Build the spatial index over the bounding boxes of the non-null geometries
+    :param geometries: <dict> OID -> arcpy geometry
+    :param node_capacity: <int> The node size of the spatial index
+    :return: <STRTree>
+    """
+    return STRTree([(extent_to_bbox(geom.extent), oid) for oid, geom in geometries.items() if geom is not None],
+                   node_capacity)
+
+
+def intersecting(geom, geometries, tree):
+    """
+    Return the OIDs of all features that intersect a geometry
+    :param geom: <arcpy.Geometry>
+    :param geometries: <dict> OID -> arcpy geometry
+    :param tree: <STRTree> See build_index
+    :return: <set>
+    """
+    return set(other for other in tree.query(extent_to_bbox(geom.extent)) if not geom.disjoint(geometries[other]))
+
+
+def iter_intersection_counts(geometries, oids=None, tree=None):
+    """
+    Yield, for every requested feature, the number of features that intersect it.  The feature itself is included in
+    its own count, matching the result of SelectLayerByLocation_management(lyr, "INTERSECT", lyr) with only that
+    feature selected.  A pair of requested features is tested only once, and each count is final when it is yielded
+    so that it can be checkpointed right away.
+    :param geometries: <dict> OID -> arcpy geometry
+    :param oids: <iterable> The OIDs to count, default is all of them
+    :param tree: <STRTree> A prebuilt index over 'geometries', see build_index
+    :return: <generator> (oid, count) tuples in ascending OID order
+    """
+    if tree is None:
+        tree = build_index(geometries)
+
+    todo = sorted(geometries if oids is None else oids)
+
+    requested = set(todo)
+
+    # Intersections with not yet counted features found while counting an earlier feature
+    found = dict()
+
+    for oid in todo:
+        geom = geometries[oid]
+
+        if geom is None:
+            yield oid, 0
+
+            continue
+
+        count = 1 + found.pop(oid, 0)
+
+        for other in tree.query(extent_to_bbox(geom.extent)):
+            if other == oid or (other < oid and other in requested):
+                # Self-match is already counted, earlier requested features were tested when they were counted
+                continue
+
+            if not geom.disjoint(geometries[other]):
+                count += 1
+
+                if other in requested:
+                    found[other] = found.get(other, 0) + 1
+
+        yield oid, count
+
+
+def count_intersections(geometries, node_capacity=16):
+    """
+    Count, for every feature, the number of features that intersect it, see iter_intersection_counts
+    :param geometries: <dict> OID -> arcpy geometry
+    :param node_capacity: <int> The node size of the spatial index
+    :return: <dict> OID -> count
+    """
+    return dict(iter_intersection_counts(geometries, tree=build_index(geometries, node_capacity)))
+
+
+def stale_features(geometries, fingerprints, records, tree, pending=None):
+    """
+    Find the features that need to be counted again: those missing from the journal or whose geometry changed, and
+    every feature that intersects their old or new shape.  The old shape is only known by its bounding box, so its
+    neighbours are all bounding box candidates.  The neighbours of a feature missing from the journal are its
+    bounding box candidates too, the exact tests are left to the count, which runs them anyway: on a cold run most
+    features are missing and testing them here would double the geometry work.  A feature left over from an
+    interrupted run is counted on its own, its neighbours were in the plan of that run, unless it changed since.
+    :param geometries: <dict> OID -> arcpy geometry
+    :param fingerprints: <dict> OID -> current geometry fingerprint
+    :param records: <dict> OID -> (count, fingerprint, bbox), the journal contents
+    :param tree: <STRTree> See build_index
+    :param pending: <dict> OID -> (fingerprint, bbox) of the features an interrupted run didn't count, see
+    OverlapJournal.load
+    :return: <set> The OIDs to count
+    """
+    if pending is None:
+        pending = dict()
+
+    stale = set()
+
+    for oid, geom in geometries.items():
+        record = records.get(oid)
+
+        planned = pending.get(oid)
+
+        if planned is not None and planned[0] == fingerprints[oid]:
+            stale.add(oid)
+
+            continue
+
+        if planned is None and record is not None and record[1] == fingerprints[oid]:
+            continue
+
+        stale.add(oid)
+
+        if geom is not None and record is None:
+            stale.update(tree.query(extent_to_bbox(geom.extent)))
+
+        elif geom is not None:
+            stale.update(intersecting(geom, geometries, tree))
+
+        for bbox in (record[2] if record is not None else None, planned[1] if planned is not None else None):
+            if bbox is not None:
+                stale.update(tree.query(bbox))
+
+    # Neighbours of deleted features lose an overlap
+    for oid in (set(records) | set(pending)) - set(geometries):
+        for bbox in (records[oid][2] if oid in records else None, pending[oid][1] if oid in pending else None):
+            if bbox is not None:
+                stale.update(tree.query(bbox))
+
+    return stale
+
+
+def main(env, feature, journal=None, flush_every=1000):
     arcpy.env.workspace = env
 
-    lyr = '{}_lyr'.format(feature)
+    if journal is None:
+        journal = '{}_overlap_counts.journal'.format(os.path.basename(feature))
 
-    make_layer(feature, lyr)
+    geometries = load_geometries(feature)
 
-    total = arcpy.GetCount_management(lyr)
+    fingerprints = dict((oid, geometry_fingerprint(geom)) for oid, geom in geometries.items())
 
-    counts = list()
+    tree = build_index(geometries)
 
-    if not os.path.exists('overlap_counts.pkl'):
-        with arcpy.da.SearchCursor(lyr, ['OID@']) as cursor:
-            for row in cursor:
-                print("getting count for row {} of {}".format(row[0], total))
-                arcpy.SelectLayerByAttribute_management(lyr, "NEW_SELECTION", "OBJECTID={}".format(row[0]))
+    log = OverlapJournal(journal, flush_every)
 
-                arcpy.SelectLayerByLocation_management(lyr, "INTERSECT", lyr)
+    records = log.load()
 
-                counts.append(int(arcpy.GetCount_management(lyr).getOutput(0)))
+    stale = stale_features(geometries, fingerprints, records, tree, log.pending)
 
-                arcpy.SelectLayerByAttribute_management(lyr, "CLEAR_SELECTION")
+    print("{} of {} features need to be counted".format(len(stale), len(geometries)))
 
-        with open('overlap_counts.pkl', 'wb') as f:
-            pickle.dump(counts, f)
+    bboxes = dict((oid, extent_to_bbox(geometries[oid].extent) if geometries[oid] is not None else None)
+                  for oid in stale)
 
-    else:
-        with open('overlap_counts.pkl', 'rb') as f:
-            counts = pickle.load(f)
+    with log:
+        if stale:
+            log.plan(dict((oid, (fingerprints[oid], bboxes[oid])) for oid in stale))
 
-    with arcpy.da.UpdateCursor(feature, ['count']) as cursor:
+        for oid in set(records) - set(geometries):
+            log.remove(oid)
+
+            del records[oid]
+
+        for i, (oid, count) in enumerate(iter_intersection_counts(geometries, stale, tree)):
+            if i % 10000 == 0:
+                print("getting count for feature {} of {}".format(i + 1, len(stale)))
+
+            log.append(oid, count, fingerprints[oid], bboxes[oid])
+
+            records[oid] = (count, fingerprints[oid], bboxes[oid])
+
+    log.compact(records)
+
+    total = len(records)
+
+    with arcpy.da.UpdateCursor(feature, ['OID@', 'count']) as cursor:
         c = 0
         for row in cursor:
-            print('updateding row {} of {}'.format(c+1, total))
-            row[0] = counts[c]
-            cursor.updateRow(row)
-            c+=1
+            c += 1
+
+            count = records[row[0]][0]
+
+            if row[1] != count:
+                print('updating row {} of {}'.format(c, total))
+                row[1] = count
+                cursor.updateRow(row)
 
     return None
 
@@ -71,8 +463,23 @@ def cli():
     parser.add_argument('--feature', dest='feature', metavar='NAME',
                         help='Name of the feature class in the workspace')
 
+    parser.add_argument('--journal', dest='journal', metavar='PATH', required=False,
+                        help='Full path to the checkpoint journal, default is <feature>_overlap_counts.journal in the '
+                             'current directory')
+
+    parser.add_argument('--flush-every', dest='flush_every', metavar='N', type=int, default=1000,
+                        help='Number of rows between journal flushes to disk, default is 1000')
+
+    parser.add_argument('--profile', dest='profile', metavar='PATH', required=False,
+                        help='Profile the arcpy calls and write PATH.txt and PATH.trace.json at exit')
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main(**vars(args))
 
     return None
@@ -0,0 +1,99 @@
+"""
+Footprint pre-filter of the clip tools.  The extent of every input raster is read once from its header and the
+bounding boxes of the clipping features are indexed in an STR-tree, so only the (feature, raster) pairs whose
+footprints intersect are clipped.  With tiled inputs most features miss most rasters, and a clip of such a pair only
+writes an all-nodata raster.  A raster in another spatial reference than the features has its extent projected into
+theirs, when that fails every feature is kept for it.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import arcpy
+from spatial_index import STRTree, extent_to_bbox
+
+
+class FootprintFilter(object):
+    """
+    Answers whether a feature can overlap a raster and counts the pairs it pruned
+    """
+
+    def __init__(self, features, sr=None):
+        """
+        :param features: <list> clip_engine.Feature tuples
+        :param sr: <arcpy.SpatialReference> The spatial reference of the features, None skips the projection
+        """
+        self.sr = sr
+
+        self.tree = STRTree([(f.bbox, f.fid) for f in features])
+
+        self.footprints = dict()
+
+        self._hits = dict()
+
+        self.kept = 0
+
+        self.pruned = 0
+
+    def footprint(self, in_rast):
+        """
+        :param in_rast: <str> The input raster
+        :return: <tuple> (xmin, ymin, xmax, ymax) read from the raster header in the spatial reference of the
+        features, once per raster, None when the extent can't be projected
+        """
+        if in_rast not in self.footprints:
+            desc = arcpy.Describe(in_rast)
+
+            extent = desc.extent
+
+            if self.sr is not None and desc.spatialReference.name != self.sr.name:
+                try:
+                    extent = extent.projectAs(self.sr)
+
+                except Exception:
+                    extent = None
+
+            self.footprints[in_rast] = extent_to_bbox(extent) if extent is not None else None
+
+        return self.footprints[in_rast]
+
+    def features(self, in_rast):
+        """
+        :param in_rast: <str> The input raster
+        :return: <set> The ids of the features whose bounding box intersects the raster, None for all of them
+        """
+        if in_rast not in self._hits:
+            bbox = self.footprint(in_rast)
+
+            self._hits[in_rast] = set(self.tree.query(bbox)) if bbox is not None else None
+
+        return self._hits[in_rast]
+
+    def overlaps(self, fid, in_rast):
+        """
+        Check a (feature, raster) pair and count it as kept or pruned
+        :param fid: The feature id
+        :param in_rast: <str> The input raster
+        :return: <bool>
+        """
+        hits = self.features(in_rast)
+
+        keep = hits is None or fid in hits
+
+        if keep:
+            self.kept += 1
+
+        else:
+            self.pruned += 1
+
+        return keep
+
+    def report(self):
+        """
+        Print how many pairs were pruned, if any
+        :return:
+        """
+        if self.pruned:
+            print("Footprint filter: pruned %s of %s feature/raster pairs that cannot overlap" %
+                  (self.pruned, self.pruned + self.kept))
+
+        return None
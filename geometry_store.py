@@ -0,0 +1,352 @@
+"""
+Compact store of the clipping features.  The features are read from the shapefile once per run into flat arrays and
+written to one file that every worker process maps read-only, so the coordinates are shared through the page cache
+instead of every worker re-reading the shapefile or making a feature layer with a where clause for every clip.  A
+store is two files:
+
+    <name>.geom       The arrays, one after the other
+    <name>.geom.json  The header: the feature ids, the spatial reference and the offset and shape of every array
+
+The arrays are 8 bytes per item:
+
+    bbox          float64 (features, 4)   xmin, ymin, xmax, ymax of every feature
+    ring_start    int64 (features + 1)    The rings of feature i are ring_start[i]:ring_start[i + 1]
+    ring_part     int64 (rings)           The part of its feature ring j belongs to, the exterior ring of a part comes
+                                          first and its interior rings (holes) follow
+    vertex_start  int64 (rings + 1)       The vertices of ring j are vertex_start[j]:vertex_start[j + 1]
+    xy            float64 (vertices * 2)  The interleaved x, y coordinates of every vertex
+
+A feature is looked up by id in a dict of row numbers and its rings are views of the mapped xy buffer.  Pickling a
+feature record only sends the store path and the id, a worker maps the store on the first record it receives.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import json
+import os
+import numpy as np
+import arcpy
+
+EXTENSION = ".geom"
+
+HEADER_EXTENSION = ".json"
+
+VERSION = 2
+
+# (name, dtype, items per row) of the arrays, in file order
+ARRAYS = (("bbox", np.float64, 4), ("ring_start", np.int64, 1), ("ring_part", np.int64, 1),
+          ("vertex_start", np.int64, 1), ("xy", np.float64, 1))
+
+# The stores mapped by this process, path -> GeometryStore
+_opened = dict()
+
+
+def header_path(path):
+    """
+    :param path: <str> The full path to the store
+    :return: <str> The full path to its header
+    """
+    return path + HEADER_EXTENSION
+
+
+def write(shp, field, path):
+    """
+    Read the clipping features in one cursor pass and write them to a store
+    :param shp: <str> The full path to the clipping shapefile
+    :param field: <str> The attribute field that identifies each feature
+    :param path: <str> The full path to the store, see EXTENSION
+    :return: <GeometryStore> The store, mapped
+    """
+    ids = list()
+
+    bbox = list()
+
+    ring_start = [0]
+
+    ring_part = list()
+
+    vertex_start = [0]
+
+    xy = list()
+
+    rows = dict()
+
+    problems = list()
+
+    def close_ring(part):
+        if len(xy) // 2 > vertex_start[-1]:
+            vertex_start.append(len(xy) // 2)
+
+            ring_part.append(part)
+
+    with arcpy.da.SearchCursor(shp, [field, 'SHAPE@']) as cursor:
+        for fid, geom in cursor:
+            if geom is None:
+                continue
+
+            if fid in rows:
+                problems.append("Duplicate %s %s" % (field, fid))
+
+                continue
+
+            rows[fid] = len(ids)
+
+            ext = geom.extent
+
+            ids.append(fid)
+
+            bbox.extend((ext.XMin, ext.YMin, ext.XMax, ext.YMax))
+
+            for i, part in enumerate(geom):
+                # A None point separates the exterior ring from the interior rings of a part, as in
+                # clip_engine.geometry_rings
+                for point in part:
+                    if point is None:
+                        close_ring(i)
+
+                    else:
+                        xy.extend((point.X, point.Y))
+
+                close_ring(i)
+
+            ring_start.append(len(vertex_start) - 1)
+
+    if problems:
+        raise ValueError("Could not index the features of %s by %s:\n%s" % (shp, field, "\n".join(problems)))
+
+    arrays = {"bbox": bbox, "ring_start": ring_start, "ring_part": ring_part, "vertex_start": vertex_start, "xy": xy}
+
+    header = {"format": "geometry_store", "version": VERSION, "ids": ids,
+              "sr": arcpy.Describe(shp).spatialReference.exportToString(), "arrays": dict()}
+
+    offset = 0
+
+    with open(path, "wb") as f:
+        for name, dtype, width in ARRAYS:
+            data = np.array(arrays[name], dtype=dtype)
+
+            data.tofile(f)
+
+            header["arrays"][name] = [offset, len(data) // width, width]
+
+            offset += data.nbytes
+
+    with open(header_path(path), "w") as f:
+        json.dump(header, f)
+
+    _opened.pop(path, None)
+
+    return open_store(path)
+
+
+def write_scratch(shp, field, scratch):
+    """
+    Write the store of a run to its scratch storage, it is deleted when the scratch is closed
+    :param shp: <str> The full path to the clipping shapefile
+    :param field: <str> The attribute field that identifies each feature
+    :param scratch: <scratch.Scratch>
+    :return: <GeometryStore> The store, mapped
+    """
+    return write(shp, field, os.path.join(scratch.directory("geometry"), "features" + EXTENSION))
+
+
+def open_store(path):
+    """
+    Map a store once per process
+    :param path: <str> The full path to the store
+    :return: <GeometryStore>
+    """
+    if path not in _opened:
+        _opened[path] = GeometryStore(path)
+
+    return _opened[path]
+
+
+def open_feature(path, fid):
+    """
+    Look up a feature of a store, used to unpickle a FeatureRecord
+    :param path: <str> The full path to the store
+    :param fid: The feature id
+    :return: <FeatureRecord>
+    """
+    return open_store(path).feature(fid)
+
+
+class FeatureRecord(object):
+    """
+    One feature of a store, with the fid, rings and bbox attributes of a clip_engine.Feature
+    """
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        """
+        :param store: <GeometryStore>
+        :param row: <int> The row of the feature in the arrays of the store
+        """
+        self.store = store
+
+        self.row = row
+
+    @property
+    def fid(self):
+        return self.store.ids[self.row]
+
+    @property
+    def bbox(self):
+        """
+        :return: <tuple> (xmin, ymin, xmax, ymax)
+        """
+        return tuple(float(v) for v in self.store.bboxes[self.row])
+
+    @property
+    def rings(self):
+        """
+        :return: <list> Views of shape (n, 2) into the xy buffer, see clip_engine.geometry_rings
+        """
+        return self.store.rings(self.row)
+
+    def __reduce__(self):
+        return open_feature, (self.store.path, self.fid)
+
+    def __repr__(self):
+        return "FeatureRecord(fid=%r)" % (self.fid,)
+
+
+class GeometryStore(object):
+    """
+    The features of a store, mapped read-only
+    """
+
+    def __init__(self, path):
+        """
+        :param path: <str> The full path to the store
+        """
+        self.path = path
+
+        with open(header_path(path)) as f:
+            self.header = json.load(f)
+
+        if self.header.get("format") != "geometry_store" or self.header.get("version") != VERSION:
+            raise ValueError("%s is not a version %s geometry store" % (path, VERSION))
+
+        self.ids = self.header["ids"]
+
+        # Feature id -> row
+        self._rows = dict((fid, i) for i, fid in enumerate(self.ids))
+
+        arrays = dict()
+
+        for name, dtype, width in ARRAYS:
+            offset, rows, width = self.header["arrays"][name]
+
+            shape = (rows, width) if width > 1 else (rows,)
+
+            if rows == 0:
+                # An empty file or array can't be mapped
+                arrays[name] = np.zeros(shape, dtype=dtype)
+
+            else:
+                arrays[name] = np.asarray(np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape))
+
+        self.bboxes = arrays["bbox"]
+
+        self.ring_start = arrays["ring_start"]
+
+        self.ring_part = arrays["ring_part"]
+
+        self.vertex_start = arrays["vertex_start"]
+
+        self.xy = arrays["xy"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, fid):
+        return fid in self._rows
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield FeatureRecord(self, row)
+
+    def __getitem__(self, fid):
+        return self.feature(fid)
+
+    def feature(self, fid):
+        """
+        :param fid: The feature id
+        :return: <FeatureRecord>
+        """
+        return FeatureRecord(self, self._rows[fid])
+
+    def features(self):
+        """
+        :return: <list> FeatureRecords of every feature in cursor order, in place of clip_engine.read_features
+        """
+        return list(self)
+
+    def rings(self, row):
+        """
+        :param row: <int> The row of a feature
+        :return: <list> Views of shape (n, 2) into the xy buffer
+        """
+        v = self.vertex_start
+
+        return [self.xy[2 * v[r]:2 * v[r + 1]].reshape(-1, 2)
+                for r in range(self.ring_start[row], self.ring_start[row + 1])]
+
+    def spatial_reference(self):
+        """
+        :return: <arcpy.SpatialReference> The spatial reference of the shapefile
+        """
+        sr = arcpy.SpatialReference()
+
+        sr.loadFromString(self.header["sr"])
+
+        return sr
+
+    def polygon(self, fid, sr=None):
+        """
+        Build the arcpy geometry of a feature, for the geoprocessing tools in place of a feature layer
+        :param fid: The feature id
+        :param sr: <arcpy.SpatialReference> Optional, saves loading it for every polygon
+        :return: <arcpy.Polygon>
+        """
+        row = self._rows[fid]
+
+        r0 = self.ring_start[row]
+
+        parts = list()
+
+        for r, ring in enumerate(self.rings(row)):
+            if not parts or self.ring_part[r0 + r] != self.ring_part[r0 + r - 1]:
+                parts.append(arcpy.Array())
+
+            else:
+                # The holes of a part follow its exterior ring after a None point, as arcpy reads them
+                parts[-1].append(None)
+
+            for x, y in ring:
+                parts[-1].append(arcpy.Point(x, y))
+
+        return arcpy.Polygon(arcpy.Array(parts), sr or self.spatial_reference())
+
+    def areas(self):
+        """
+        Return the area of every feature from its rings, used to schedule the largest features first.  The holes run
+        the other way around than the exterior rings, so the signed areas of the rings add up to the area of the
+        feature.
+        :return: <dict> Feature id -> area
+        """
+        areas = dict()
+
+        for row, fid in enumerate(self.ids):
+            area = 0.0
+
+            for ring in self.rings(row):
+                x, y = ring[:, 0], ring[:, 1]
+
+                area += np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))
+
+            areas[fid] = abs(float(area)) / 2.0
+
+        return areas
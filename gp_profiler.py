@@ -0,0 +1,371 @@
+"""
+Opt-in profiler for the arcpy calls made by the tools.
+
+enable() replaces the geoprocessing tools (*_management, *_conversion, *_md, ...), the cursor constructors, the
+List*/Describe functions and the numpy conversions of the arcpy module with timing wrappers, and every row fetched from
+a cursor is timed as well.  Calls are grouped by stage: the innermost 'with stage(...)' block or, by default, the
+function that made the call.  At exit a text report (call counts, cumulative and percentile latency, arguments of the
+slowest calls) and a Chrome trace (chrome://tracing or https://ui.perfetto.dev) are written.
+
+Nothing is patched until enable() is called, so there is no overhead when profiling is off.  Only the calling process
+is profiled, not the workers of a process pool.
+"""
+
+import array
+import atexit
+import functools
+import heapq
+import json
+import os
+import re
+import sys
+import threading
+import timeit
+import arcpy
+
+clock = timeit.default_timer
+
+TOOL_PATTERN = re.compile(r"^[A-Z]\w*_(management|conversion|md|analysis|sa|cartography|edit)$")
+
+FUNCTIONS = ("Describe", "Exists", "ListRasters", "ListFields", "ListFeatureClasses", "ListFiles", "ListDatasets",
+             "ListTables", "RasterToNumPyArray", "NumPyArrayToRaster")
+
+CURSORS = ("SearchCursor", "UpdateCursor", "InsertCursor")
+
+DA_FUNCTIONS = ("NumPyArrayToTable", "TableToNumPyArray", "FeatureClassToNumPyArray", "Walk")
+
+CURSOR_METHODS = ("updateRow", "insertRow", "deleteRow", "next", "reset")
+
+_profiler = None
+
+
+class CallStats(object):
+    """
+    Statistics of one call name within one stage
+    """
+    __slots__ = ("count", "total", "durations", "slowest")
+
+    def __init__(self):
+        self.count = 0
+
+        self.total = 0.0
+
+        self.durations = array.array("d")
+
+        # Min-heap of (duration, sequence, description) holding the slowest calls
+        self.slowest = list()
+
+    def add(self, duration, describe, keep, sequence):
+        self.count += 1
+
+        self.total += duration
+
+        self.durations.append(duration)
+
+        if describe is None:
+            return None
+
+        if len(self.slowest) < keep:
+            heapq.heappush(self.slowest, (duration, sequence, describe()))
+
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sequence, describe()))
+
+        return None
+
+    def percentile(self, q):
+        values = sorted(self.durations)
+
+        if not values:
+            return 0.0
+
+        return values[min(int(round(q / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def describe_args(args, kwargs, limit=200):
+    """
+    Return a short description of the arguments of a call
+    """
+    text = ", ".join([repr(a) for a in args] + ["%s=%r" % item for item in sorted(kwargs.items())])
+
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+class Profiler(object):
+
+    def __init__(self, path, slowest=3, max_events=200000):
+        """
+        :param path: <str> The output prefix, the report goes to <path>.txt and the trace to <path>.trace.json
+        :param slowest: <int> The number of slowest calls to keep per call name
+        :param max_events: <int> The most calls kept for the trace
+        """
+        self.path = path
+
+        self.keep = slowest
+
+        self.max_events = max_events
+
+        self.stats = dict()
+
+        self.events = list()
+
+        self.stages = list()
+
+        self.originals = list()
+
+        self.sequence = 0
+
+        self.t0 = clock()
+
+    def current_stage(self, depth):
+        if self.stages:
+            return self.stages[-1]
+
+        frame = sys._getframe(depth)
+
+        return "%s.%s" % (os.path.splitext(os.path.basename(frame.f_code.co_filename))[0], frame.f_code.co_name)
+
+    def record(self, name, start, duration, args=None, kwargs=None, trace=True, depth=3):
+        stage = self.current_stage(depth)
+
+        key = (stage, name)
+
+        stats = self.stats.get(key)
+
+        if stats is None:
+            stats = self.stats[key] = CallStats()
+
+        self.sequence += 1
+
+        describe = None
+
+        if args is not None:
+            describe = lambda: describe_args(args, kwargs or {})
+
+        stats.add(duration, describe, self.keep, self.sequence)
+
+        if trace and len(self.events) < self.max_events:
+            event = {"name": name, "cat": stage, "ph": "X", "ts": (start - self.t0) * 1e6, "dur": duration * 1e6,
+                     "pid": os.getpid(), "tid": threading.current_thread().ident}
+
+            if describe is not None:
+                event["args"] = {"args": describe()}
+
+            self.events.append(event)
+
+        return None
+
+    def wrap(self, name, func, cursor=False):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+
+            try:
+                result = func(*args, **kwargs)
+
+            finally:
+                profiler.record(name, start, clock() - start, args, kwargs)
+
+            if cursor:
+                return CursorProxy(result, name, profiler)
+
+            return result
+
+        try:
+            functools.update_wrapper(wrapper, func)
+
+        except (AttributeError, TypeError):
+            pass
+
+        return wrapper
+
+    def patch(self, module, prefix=""):
+        for attr in dir(module):
+            if attr in CURSORS:
+                kind = "cursor"
+
+            elif TOOL_PATTERN.match(attr) or attr in FUNCTIONS or (prefix and attr in DA_FUNCTIONS):
+                kind = "call"
+
+            else:
+                continue
+
+            func = getattr(module, attr)
+
+            if not callable(func):
+                continue
+
+            self.originals.append((module, attr, func))
+
+            setattr(module, attr, self.wrap(prefix + attr, func, cursor=kind == "cursor"))
+
+        return None
+
+    def unpatch(self):
+        for module, attr, func in reversed(self.originals):
+            setattr(module, attr, func)
+
+        self.originals = list()
+
+        return None
+
+    def report(self):
+        """
+        :return: <str> The text report
+        """
+        lines = list()
+
+        wall = clock() - self.t0
+
+        lines.append("arcpy call profile, %.2f s wall time" % wall)
+
+        stages = sorted(set(stage for stage, name in self.stats),
+                        key=lambda s: -sum(v.total for (st, n), v in self.stats.items() if st == s))
+
+        header = "  %-44s %9s %10s %9s %9s %9s %9s" % ("Call", "Count", "Total s", "Mean ms", "p50 ms", "p95 ms",
+                                                       "p99 ms")
+
+        for stage in stages:
+            items = sorted(((name, s) for (st, name), s in self.stats.items() if st == stage),
+                           key=lambda item: -item[1].total)
+
+            lines.append("")
+
+            lines.append("Stage %s: %.2f s" % (stage, sum(s.total for name, s in items)))
+
+            lines.append(header)
+
+            for name, s in items:
+                lines.append("  %-44s %9d %10.3f %9.2f %9.2f %9.2f %9.2f" % (
+                    name, s.count, s.total, 1000 * s.total / s.count, 1000 * s.percentile(50),
+                    1000 * s.percentile(95), 1000 * s.percentile(99)))
+
+            for name, s in items:
+                for duration, sequence, description in sorted(s.slowest, reverse=True):
+                    lines.append("    slowest %s %.3f s: %s" % (name, duration, description))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        with open(self.path + ".txt", "w") as f:
+            f.write(self.report())
+
+        with open(self.path + ".trace.json", "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+        print("Profile written to %s.txt and %s.trace.json" % (self.path, self.path))
+
+        return None
+
+
+class CursorProxy(object):
+    """
+    Wraps an arcpy cursor so that every fetched row and every row operation is timed
+    """
+
+    def __init__(self, cursor, name, profiler):
+        self._cursor = cursor
+
+        self._name = name
+
+        self._profiler = profiler
+
+    def __iter__(self):
+        rows = iter(self._cursor)
+
+        name = self._name + ".row"
+
+        while True:
+            start = clock()
+
+            try:
+                row = next(rows)
+
+            except StopIteration:
+                break
+
+            # Rows are too many for the trace and their arguments, only their latency is kept
+            self._profiler.record(name, start, clock() - start, trace=False)
+
+            yield row
+
+    def __getattr__(self, attr):
+        value = getattr(self._cursor, attr)
+
+        if attr in CURSOR_METHODS and callable(value):
+            return self._profiler.wrap("%s.%s" % (self._name, attr), value)
+
+        return value
+
+    def __enter__(self):
+        self._cursor.__enter__()
+
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+
+class stage(object):
+    """
+    Context manager that groups the calls made inside it under a stage name
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _profiler is not None:
+            _profiler.stages.append(self.name)
+
+        return self
+
+    def __exit__(self, *args):
+        if _profiler is not None:
+            _profiler.stages.pop()
+
+        return False
+
+
+def enable(path, slowest=3):
+    """
+    Start profiling the arcpy calls of this process, the report is written at exit
+    :param path: <str> The output prefix, the report goes to <path>.txt and the trace to <path>.trace.json
+    :param slowest: <int> The number of slowest calls to keep per call name
+    :return: <Profiler>
+    """
+    global _profiler
+
+    if _profiler is not None:
+        return _profiler
+
+    _profiler = Profiler(path, slowest)
+
+    _profiler.patch(arcpy)
+
+    if hasattr(arcpy, "da"):
+        _profiler.patch(arcpy.da, "da.")
+
+    atexit.register(disable)
+
+    return _profiler
+
+
+def disable():
+    """
+    Stop profiling, restore the arcpy functions and write the report
+    :return:
+    """
+    global _profiler
+
+    if _profiler is None:
+        return None
+
+    profiler, _profiler = _profiler, None
+
+    profiler.unpatch()
+
+    profiler.write()
+
+    return None
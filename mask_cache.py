@@ -0,0 +1,171 @@
+"""
+Cache of rasterized clipping masks.  A polygon only has to be rasterized once per grid: the mask and the pixel window
+of a feature are kept in an in-memory LRU and, when a spill directory is given, also written to disk as bit-packed
+arrays as soon as they are made, so that they are reused after eviction and by later runs (other products) and other
+worker processes that clip on the same grid.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import collections
+import hashlib
+import os
+import numpy as np
+import clip_engine
+
+
+def geometry_hash(rings):
+    """
+    Return a hash of the coordinates of a feature
+    :param rings: <list> numpy arrays of shape (n, 2), see clip_engine.geometry_rings
+    :return: <str>
+    """
+    md5 = hashlib.md5()
+
+    for ring in rings:
+        md5.update(np.ascontiguousarray(ring, dtype=np.float64).tobytes())
+
+        # Keep ring boundaries in the hash
+        md5.update(b'|')
+
+    return md5.hexdigest()
+
+
+def feature_hashes(features):
+    """
+    Return the geometry hash of every feature, e.g. for the parameters of a build_manifest entry
+    :param features: <list> clip_engine.Feature tuples
+    :return: <dict> Feature id -> hash
+    """
+    return dict((f.fid, geometry_hash(f.rings)) for f in features)
+
+
+class MaskCache(object):
+    """
+    LRU of (mask, window) pairs keyed by (geometry hash, grid origin, cell size, grid shape)
+    """
+
+    def __init__(self, max_items=256, spill_dir=None, hashes=None):
+        """
+        :param max_items: <int> The number of masks kept in memory
+        :param spill_dir: <str> Optional directory that keeps every mask on disk
+        :param hashes: <dict> Optional, feature id -> geometry hash from feature_hashes, the hash of a feature that is
+        not in it is computed on its first lookup
+        """
+        self.max_items = max_items
+
+        self.spill_dir = spill_dir
+
+        # Feature id -> geometry hash, so the coordinates are hashed once per feature instead of on every lookup
+        self._hashes = dict(hashes) if hashes is not None else dict()
+
+        self.hits = 0
+
+        self.misses = 0
+
+        self._items = collections.OrderedDict()
+
+        if spill_dir is not None and not os.path.exists(spill_dir):
+            try:
+                os.makedirs(spill_dir)
+
+            except OSError:
+                # Created by another worker in the meantime
+                if not os.path.isdir(spill_dir):
+                    raise
+
+    def key(self, feature, grid):
+        """
+        :param feature: <clip_engine.Feature>
+        :param grid: <clip_engine.Grid>
+        :return: <tuple>
+        """
+        digest = self._hashes.get(feature.fid)
+
+        if digest is None:
+            digest = self._hashes[feature.fid] = geometry_hash(feature.rings)
+
+        return (digest, (grid.xmin, grid.ymax), (grid.cell_width, grid.cell_height),
+                (grid.nrows, grid.ncols))
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.md5(repr(key).encode('ascii')).hexdigest() + '.npz')
+
+    def _spill(self, key, mask, window):
+        path = self._spill_path(key)
+
+        if os.path.exists(path):
+            return None
+
+        temp = "%s.%d.tmp.npz" % (path[:-4], os.getpid())
+
+        np.savez(temp, bits=np.packbits(mask, axis=None), window=np.array(window), shape=np.array(mask.shape))
+
+        try:
+            os.rename(temp, path)
+
+        except OSError:
+            # Another process spilled the same mask first
+            os.remove(temp)
+
+        return None
+
+    def _load(self, key):
+        path = self._spill_path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as f:
+            shape = tuple(int(v) for v in f['shape'])
+
+            mask = np.unpackbits(f['bits'])[:shape[0] * shape[1]].reshape(shape).astype(np.bool_)
+
+            window = tuple(int(v) for v in f['window'])
+
+        return mask, window
+
+    def _put(self, key, value):
+        self._items[key] = value
+
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+        return None
+
+    def get(self, feature, grid):
+        """
+        Return the mask and the pixel window of a feature on a grid, rasterizing it only on a cache miss
+        :param feature: <clip_engine.Feature>
+        :param grid: <clip_engine.Grid>
+        :return: <tuple> (boolean mask, (col_off, row_off, ncols, nrows))
+        """
+        key = self.key(feature, grid)
+
+        value = self._items.pop(key, None)
+
+        if value is None and self.spill_dir is not None:
+            value = self._load(key)
+
+        if value is None:
+            self.misses += 1
+
+            window = clip_engine.feature_window(feature.bbox, grid)
+
+            col_off, row_off, ncols, nrows = window
+
+            mask = clip_engine.rasterize(feature.rings, grid.xmin + col_off * grid.cell_width,
+                                         grid.ymax - row_off * grid.cell_height, grid.cell_width, grid.cell_height,
+                                         ncols, nrows)
+
+            value = (mask, window)
+
+            if self.spill_dir is not None:
+                self._spill(key, mask, window)
+
+        else:
+            self.hits += 1
+
+        self._put(key, value)
+
+        return value
@@ -10,6 +10,18 @@ import arcpy
 import argparse
 import datetime as dt
 from arcpy import env
+import gp_profiler
+import clip_engine
+import clip_pool
+import geometry_store
+import output_format
+import raster_cube
+import raster_index
+from build_manifest import BuildManifest
+from footprints import FootprintFilter
+from mask_cache import MaskCache, feature_hashes
+from scratch import Scratch
+from zonal_stats import ZonalStats
 
 
 def get_time():
@@ -20,29 +32,265 @@ def get_time():
     return dt.datetime.now()
 
 
-def get_raster(raster_list, y):
+def clip_by_year(index, features, outdir, out_prod, years, manifest, masks=None, stats=None, footprints=None):
     """
-    Ensure we pull the appropriate raster for the given year and don't assume a 1:1 relationship
-    between items in raster_list and years.
-    :param raster_list:
-    :param y:
+    Open each year's raster once and write the outputs of every feature from that one open
+    :param index: <raster_index.RasterIndex> The rasters in the workspace by year
+    :param features: <list> clip_engine.Feature tuples
+    :param outdir: <str>
+    :param out_prod: <str>
+    :param years: <list>
+    :param manifest: <build_manifest.BuildManifest> Skips the outputs that are current and records the new ones
+    :param masks: <mask_cache.MaskCache> Optional cache of the rasterized features
+    :param stats: <zonal_stats.ZonalStats> Optional, collects the statistics of every output
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that cannot overlap a raster
     :return:
     """
-    raster = [r for r in raster_list if str(y) in r]
+    hashes = feature_hashes(features)
 
-    if len(raster) > 0:
+    for year in years:
 
-        # Here I'm assuming:
-        # 1.  that each file will contain a unique year, and
-        # 2.  there is only 1 year in the filename
-        return raster[-1]
+        in_rast = index.get(year)
 
-    else:
+        if in_rast is None:
 
-        return None
+            print("Could not find matching raster for year %s" % year)
 
+            continue
 
-def main_work(indir, outdir, shp, out_prod, field="id", years=None):
+        jobs = list()
+
+        for feature in features:
+
+            if footprints is not None and not footprints.overlaps(feature.fid, in_rast):
+
+                continue
+
+            subdir = outdir + os.sep + "block_%s" % feature.fid
+
+            if not os.path.exists(subdir):
+                os.makedirs(subdir)
+
+            result_name = "%s%s%s_block_%s_%s.tif" % (subdir, os.sep, out_prod, feature.fid, year)
+
+            if manifest.is_current(result_name, [in_rast], {"feature": hashes[feature.fid]}):
+
+                if stats is not None:
+                    stats.add_raster(feature.fid, year, result_name)
+
+                continue
+
+            jobs.append((feature, result_name))
+
+        if jobs:
+            clip_engine.clip_raster(in_rast, jobs, masks=masks,
+                                    on_done=lambda f, r: manifest.record(r, [in_rast], {"feature": hashes[f.fid]}),
+                                    on_data=None if stats is None else lambda f, d: stats.add_data(f.fid, year, d))
+
+    return None
+
+
+def clip_block_cube(feature, annual, result_name, masks=None):
+    """
+    Clip every year's raster to one feature and write them as the one raster_cube of the block
+    :param feature: <clip_engine.Feature>
+    :param annual: <list> (year, raster) tuples in year order
+    :param result_name: <str> The full path to the cube
+    :param masks: <mask_cache.MaskCache> Optional cache of the rasterized features
+    :return: <list> The outputs written
+    """
+    if masks is None:
+        masks = MaskCache()
+
+    raster, grid = clip_pool.open_cached(annual[0][1])
+
+    mask, window = masks.get(feature, grid)
+
+    with clip_engine.BlockWriter([result_name], [y for y, r in annual], grid, window,
+                                 raster.spatialReference) as writer:
+        for year, in_rast in annual:
+            raster, year_grid = clip_pool.open_cached(in_rast)
+
+            if year_grid != grid:
+                raise ValueError("%s is not on the grid of %s" % (in_rast, annual[0][1]))
+
+            data, window = clip_engine.clip_feature(raster, grid, feature, masks=masks)
+
+            writer.write(year, data)
+
+    return [result_name]
+
+
+def clip_to_cubes(index, features, outdir, out_prod, years, manifest, workers=1, env_settings=None, mask_dir=None,
+                  footprints=None):
+    """
+    Write one raster_cube per feature holding the clips of every year, blocks run in parallel on the workers
+    :param index: <raster_index.RasterIndex> The rasters in the workspace by year
+    :param features: <list> clip_engine.Feature tuples
+    :param outdir: <str>
+    :param out_prod: <str>
+    :param years: <list>
+    :param manifest: <build_manifest.BuildManifest> Skips the cubes that are current and records the new ones
+    :param workers: <int> The number of worker processes
+    :param env_settings: <dict> arcpy.env attributes to set in the workers
+    :param mask_dir: <str> Optional spill directory of the mask cache
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that overlap none of the rasters
+    :return: <list> (block id, error message) tuples of the failed blocks
+    """
+    hashes = feature_hashes(features)
+
+    annual = list()
+
+    for year in years:
+
+        if index.get(year) is None:
+
+            print("Could not find matching raster for year %s" % year)
+
+            continue
+
+        annual.append((int(year), index.get(year)))
+
+    if not annual:
+        return list()
+
+    in_rasters = [r for y, r in annual]
+
+    jobs = list()
+
+    for feature in features:
+
+        # A cube holds every year, so only a feature outside of all of the rasters is left out
+        if footprints is not None and not any([footprints.overlaps(feature.fid, r) for r in in_rasters]):
+
+            continue
+
+        subdir = outdir + os.sep + "block_%s" % feature.fid
+
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+
+        result_name = "%s%s%s_block_%s%s" % (subdir, os.sep, out_prod, feature.fid, raster_cube.EXTENSION)
+
+        if manifest.is_current(result_name, in_rasters, {"feature": hashes[feature.fid]}):
+
+            continue
+
+        jobs.append((feature, annual, result_name))
+
+    return clip_pool.run_block_tasks(clip_block_cube, jobs, workers, env_settings, mask_dir,
+                                     lambda job, outputs: manifest.record(job[2], in_rasters,
+                                                                          {"feature": hashes[job[0].fid]}),
+                                     hashes)
+
+
+def clip_by_feature(index, store, outdir, out_prod, years, manifest, footprints=None):
+    """
+    Clip with Clip_management, one clip per feature and year to the polygon of the feature
+    :param index: <raster_index.RasterIndex> The rasters in the workspace by year
+    :param store: <geometry_store.GeometryStore> The clipping features
+    :param outdir: <str>
+    :param out_prod: <str>
+    :param years: <list>
+    :param manifest: <build_manifest.BuildManifest> Skips the outputs that are current and records the new ones
+    :param footprints: <footprints.FootprintFilter> Optional, skips the features that cannot overlap a raster
+    :return:
+    """
+    hashes = feature_hashes(store)
+
+    sr = store.spatial_reference()
+
+    for feature in store:
+
+        current_val = feature.fid
+
+        subdir = outdir + os.sep + "block_%s" % current_val
+
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+
+        for year in years:
+
+            in_rast = index.get(year)
+
+            if in_rast is None:
+
+                print("Could not find matching raster for year %s" % year)
+
+                continue
+
+            if footprints is not None and not footprints.overlaps(current_val, in_rast):
+
+                continue
+
+            result_name = "%s%s%s_block_%s_%s.tif" % (subdir, os.sep, out_prod, current_val, year)
+
+            params = {"feature": hashes[current_val]}
+
+            if manifest.is_current(result_name, [in_rast], params):
+
+                continue
+
+            clip_pool.clip_to_template(in_rast, result_name, store.polygon(current_val, sr))
+
+            manifest.record(result_name, [in_rast], params)
+
+    return None
+
+
+def build_tasks(index, areas, outdir, out_prod, years, manifest, hashes, stats=None, footprints=None):
+    """
+    Turn the (feature, year) cross product into a list of clip tasks, leaving out the outputs that are current
+    :param index: <raster_index.RasterIndex> The rasters in the workspace by year
+    :param areas: <dict> Feature id -> area, see geometry_store.GeometryStore.areas
+    :param outdir: <str>
+    :param out_prod: <str>
+    :param years: <list>
+    :param manifest: <build_manifest.BuildManifest>
+    :param hashes: <dict> Feature id -> geometry hash, see mask_cache.feature_hashes
+    :param stats: <zonal_stats.ZonalStats> Optional, gets the statistics of the outputs that are current
+    :param footprints: <footprints.FootprintFilter> Optional, leaves out the features that cannot overlap a raster
+    :return: <list> clip_pool.ClipTask tuples
+    """
+    tasks = list()
+
+    for year in years:
+
+        in_rast = index.get(year)
+
+        if in_rast is None:
+
+            print("Could not find matching raster for year %s" % year)
+
+            continue
+
+        for fid, area in areas.items():
+
+            if footprints is not None and not footprints.overlaps(fid, in_rast):
+
+                continue
+
+            subdir = outdir + os.sep + "block_%s" % fid
+
+            if not os.path.exists(subdir):
+                os.makedirs(subdir)
+
+            result_name = "%s%s%s_block_%s_%s.tif" % (subdir, os.sep, out_prod, fid, year)
+
+            if manifest.is_current(result_name, [in_rast], {"feature": hashes[fid]}):
+
+                if stats is not None:
+                    stats.add_raster(fid, year, result_name)
+
+                continue
+
+            tasks.append(clip_pool.ClipTask(fid, in_rast, result_name, area))
+
+    return tasks
+
+
+def main_work(indir, outdir, shp, out_prod, field="id", years=None, engine="numpy", workers=1, mask_dir=None,
+              checksum=False, out_format=output_format.DEFAULT, stats=None, footprint=True):
     """
 
     :param indir:
@@ -51,15 +299,25 @@ def main_work(indir, outdir, shp, out_prod, field="id", years=None):
     :param out_prod:
     :param field:
     :param years:
+    :param engine: <str> "numpy" reads each year's raster once for all features, "arcpy" runs Clip_management for
+    every feature and year, the cube format always clips with numpy
+    :param workers: <int> The number of worker processes, more than 1 runs the clips on a process pool
+    :param mask_dir: <str> Optional directory that keeps the rasterized features for reuse by later runs
+    :param checksum: <bool> Fingerprint the input rasters with MD5 and verify existing outputs against their MD5
+    :param out_format: <str> The output format, see output_format.FORMATS
+    :param stats: <str> Optional, write the per-feature, per-year zonal statistics of the outputs to this table, a
+    .csv file or an arcpy table, see zonal_stats.py
+    :param footprint: <bool> Skip the feature/raster pairs whose extents do not intersect, see footprints.py
     :return:
     """
-    env.workspace = indir
+    if stats is not None and (engine != "numpy" or out_format == output_format.CUBE):
+        raise ValueError("Zonal statistics are computed by the numpy engine from the GeoTiff outputs")
 
-    env.compression = "NONE"
+    env.workspace = indir
 
     split_shape = shp
 
-    in_rasters = arcpy.ListRasters()
+    index = raster_index.RasterIndex([os.path.join(indir, r) for r in arcpy.ListRasters()])
 
     split_field = field
 
@@ -67,53 +325,65 @@ def main_work(indir, outdir, shp, out_prod, field="id", years=None):
 
         years = range(1984, 2016)
 
-    cursor = arcpy.SearchCursor(split_shape)
+    manifest = BuildManifest(os.path.join(outdir, "build_manifest_%s.json" % out_prod),
+                             {"tool": "multi_feature_clip_raster", "product": out_prod, "nodata": clip_engine.NODATA,
+                              "format": out_format}, checksum)
 
-    for row in cursor:
+    collector = None if stats is None else ZonalStats(out_prod, clip_engine.NODATA)
 
-        current_val = row.getValue(split_field)
+    scratch = Scratch()
 
-        subdir = outdir + os.sep + "block_%s" % current_val
+    store = geometry_store.write_scratch(split_shape, split_field, scratch)
 
-        if not os.path.exists(subdir):
-            os.makedirs(subdir)
+    features = store.features()
 
-        for year in years:
+    hashes = feature_hashes(features)
 
-            in_rast = get_raster(in_rasters, year)
+    footprints = FootprintFilter(features, store.spatial_reference()) if footprint else None
 
-            if in_rast is None:
+    with scratch, manifest, output_format.using(out_format) as settings:
 
-                print("Could not find matching raster for year %s" % year)
+        if out_format == output_format.CUBE:
 
-                continue
+            failed = clip_to_cubes(index, features, outdir, out_prod, years, manifest, workers,
+                                   dict(settings, workspace=indir), mask_dir, footprints)
 
-            result_name = "%s%s%s_block_%s_%s.tif" % (subdir, os.sep, out_prod, current_val, year)
+            if failed:
+                raise RuntimeError("The cubes of %s blocks failed" % len(failed))
 
-            if os.path.exists(result_name):
+        elif workers > 1:
 
-                continue
+            tasks = build_tasks(index, store.areas(), outdir, out_prod, years, manifest, hashes, collector, footprints)
+
+            year_of = dict((index.get(y), int(y)) for y in years if index.get(y) is not None)
+
+            failed = clip_pool.run_tasks(tasks, workers, split_shape, split_field, engine,
+                                         env_settings=dict(settings, workspace=indir), mask_dir=mask_dir,
+                                         on_done=lambda t: manifest.record(t.result_name, [t.in_rast],
+                                                                           {"feature": hashes[t.fid]}),
+                                         on_stats=None if collector is None else
+                                         lambda t, groups: collector.add(t.fid, year_of[t.in_rast], groups),
+                                         continuous=collector is not None and collector.continuous,
+                                         store=store.path, hashes=hashes)
+
+            if failed:
+                raise RuntimeError("%s of %s clips failed" % (len(failed), len(tasks)))
 
-            # Create feature layer of current clipping polygon
-            where_clause = "%s = %s" % (split_field, current_val)
+        elif engine == "numpy":
 
-            arcpy.MakeFeatureLayer_management(split_shape, 'currentMask', where_clause)
+            masks = MaskCache(spill_dir=mask_dir, hashes=hashes)
 
-            arcpy.AddMessage("Processing: " + result_name)
+            clip_by_year(index, features, outdir, out_prod, years, manifest, masks, collector, footprints)
 
-            # Save the clipped raster
-            arcpy.Clip_management(
-                in_rast,
-                rectangle="#",
-                out_raster=result_name,
-                in_template_dataset='currentMask',
-                nodata_value="255",
-                clipping_geometry="ClippingGeometry",
-                maintain_clipping_extent="MAINTAIN_EXTENT"
-            )
+        else:
 
-            if arcpy.Exists('currentMask'):
-                arcpy.Delete_management('currentMask')
+            clip_by_feature(index, store, outdir, out_prod, years, manifest, footprints)
+
+    if footprints is not None:
+        footprints.report()
+
+    if collector is not None:
+        print("Wrote %s rows of zonal statistics to %s" % (collector.write(stats), stats))
 
     return None
 
@@ -143,8 +413,46 @@ def main():
     parser.add_argument("-n", "--name", dest="out_prod", required=True, type=str,
                         help="Specify the name of the product (e.g. Trends, CoverPrim, etc.)")
 
+    parser.add_argument("-e", "--engine", dest="engine", required=False, type=str, default="numpy",
+                        choices=["numpy", "arcpy"],
+                        help="numpy (default) reads each year's raster once and clips every feature from it, arcpy "
+                             "runs Clip_management for every feature and year")
+
+    parser.add_argument("-w", "--workers", dest="workers", required=False, type=int, default=1,
+                        help="The number of worker processes, default is 1 (serial)")
+
+    parser.add_argument("-m", "--mask-cache", dest="mask_dir", required=False, type=str,
+                        help="Optional directory that keeps the rasterized features of the numpy engine, share it "
+                             "between products that are clipped on the same grid")
+
+    parser.add_argument("--checksum", dest="checksum", action="store_true",
+                        help="Optional, fingerprint the input rasters with MD5 instead of size and modification time "
+                             "and verify the MD5 of existing outputs before skipping them")
+
+    parser.add_argument("-F", "--format", dest="out_format", required=False, type=str,
+                        default=output_format.DEFAULT, choices=sorted(output_format.FORMATS),
+                        help="Optional, the output format: none (default) for striped uncompressed GeoTiffs, lzw or "
+                             "deflate for tiled compressed GeoTiffs, cube for one raster_cube per block holding every "
+                             "year")
+
+    parser.add_argument("--stats", dest="stats", required=False, type=str, metavar="TABLE",
+                        help="Optional, write the class histogram (min, max and mean for continuous products) of "
+                             "every feature and year to TABLE, a .csv file or a geodatabase table, numpy engine only")
+
+    parser.add_argument("--no-footprint", dest="footprint", action="store_false",
+                        help="Optional, clip every feature against every raster instead of skipping the pairs whose "
+                             "extents do not intersect")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main_work(**vars(args))
 
     return None
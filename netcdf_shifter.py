@@ -3,8 +3,21 @@ ARD projected coordinate system for the output projection."""
 
 import arcpy
 import os
+import sys
 import glob
+import time
+import traceback
 import argparse
+import multiprocessing
+import gp_profiler
+import output_format
+from scratch import Scratch
+
+try:
+    # Only used to look up the native chunk shape of the variable, not part of the ArcGIS python install
+    import netCDF4
+except ImportError:
+    netCDF4 = None
 
 # This is the projected coordinate system used by Collection 01 ARD
 # Generated from a reference file with arcpy.Description(<raster>).spatialReference.exporttostring()
@@ -14,6 +27,13 @@ wkt = "PROJCS['WGS_1984_Albers',GEOGCS['GCS_WGS_1984',DATUM['D_WGS_1984',SPHEROI
       "29.5],PARAMETER['standard_parallel_2',45.5],PARAMETER['latitude_of_origin',23.0],UNIT['Meter',1.0]];-16901100 " \
       "-6972200 266467840.990852;-100000 10000;-100000 10000;0.001;0.001;0.001;IsHighPrecision "
 
+# Bytes per pixel and MosaicToNewRaster pixel type of arcpy.Raster.pixelType values
+PIXEL_TYPES = {"U1": (1, "1_BIT"), "U2": (1, "2_BIT"), "U4": (1, "4_BIT"),
+               "U8": (1, "8_BIT_UNSIGNED"), "S8": (1, "8_BIT_SIGNED"),
+               "U16": (2, "16_BIT_UNSIGNED"), "S16": (2, "16_BIT_SIGNED"),
+               "U32": (4, "32_BIT_UNSIGNED"), "S32": (4, "32_BIT_SIGNED"),
+               "F32": (4, "32_BIT_FLOAT"), "F64": (8, "64_BIT")}
+
 
 def get_files(indir, ext=".nc4"):
     """
@@ -74,14 +94,278 @@ def set_prj(in_tif, srs=wkt):
     return None
 
 
-def main_work(indir, outdir, x_shift=15, y_shift=-15):
+def convert(in_nc, out_tif, x_shift, y_shift, srs=wkt, var="band_1", x_dim="easting", y_dim="northing"):
+    """
+    Read the NetCDF variable once and write the final GeoTiff in one write.  The shift only moves the origin of the
+    output and the projection is set while the raster is written, so no pixel is rewritten and no temp file is made.
+    :param in_nc: <str> The full path to the input nc file
+    :param out_tif: <str> The full path to the output tif file
+    :param x_shift: <int> The amount to shift x
+    :param y_shift: <int> The amount to shift y
+    :param srs: <str> A string containing the projection
+    :param var: <str> An identifying variable, default is band_1
+    :param x_dim: <str> The identifier x-dimension, default is easting
+    :param y_dim: <str> The identifier y-dimension, default is northing
+    :return:
+    """
+    layer = os.path.splitext(os.path.basename(in_nc))[0] + "_lyr"
+
+    make_netcdf_raster(in_nc=in_nc, out_layer=layer, var=var, x_dim=x_dim, y_dim=y_dim)
+
+    raster = arcpy.Raster(layer)
+
+    data = arcpy.RasterToNumPyArray(raster)
+
+    lower_left = arcpy.Point(raster.extent.XMin + x_shift, raster.extent.YMin + y_shift)
+
+    sr = arcpy.SpatialReference()
+
+    sr.loadFromString(srs)
+
+    previous_sr = arcpy.env.outputCoordinateSystem
+
+    arcpy.env.outputCoordinateSystem = sr
+
+    try:
+        out = arcpy.NumPyArrayToRaster(data, lower_left, raster.meanCellWidth, raster.meanCellHeight,
+                                       raster.noDataValue)
+
+        out.save(out_tif)
+
+    finally:
+        arcpy.env.outputCoordinateSystem = previous_sr
+
+    # Only touches the header, in case the output coordinate system wasn't picked up by the save
+    if arcpy.Describe(out_tif).spatialReference.name == "Unknown":
+        arcpy.DefineProjection_management(in_dataset=out_tif, coor_system=sr)
+
+    arcpy.Delete_management(layer)
+
+    return None
+
+
+def band_rows(in_nc, ncols, itemsize, memory_budget, var="band_1", y_dim="northing"):
+    """
+    Return the number of rows to read at a time so that a band and its output copy fit in the memory budget.  When
+    the netCDF4 package is available the band height is a multiple of the native chunk height of the variable, so that
+    every HDF5 chunk is read only once.
+    :param in_nc: <str> The full path to the input nc file
+    :param ncols: <int> The number of columns of the variable
+    :param itemsize: <int> Bytes per pixel
+    :param memory_budget: <int> Bytes available for one file
+    :param var: <str> An identifying variable, default is band_1
+    :param y_dim: <str> The identifier y-dimension, default is northing
+    :return: <int>
+    """
+    rows = max(int(memory_budget // (2 * ncols * itemsize)), 1)
+
+    if netCDF4 is None:
+        return rows
+
+    ds = netCDF4.Dataset(in_nc)
+
+    try:
+        variable = ds.variables[var]
+
+        chunking = variable.chunking()
+
+        if chunking == "contiguous":
+            return rows
+
+        chunk_height = chunking[list(variable.dimensions).index(y_dim)]
+
+    finally:
+        ds.close()
+
+    return max(rows // chunk_height, 1) * chunk_height
+
+
+def convert_streaming(in_nc, out_tif, x_shift, y_shift, memory_budget, srs=wkt, var="band_1", x_dim="easting",
+                      y_dim="northing"):
+    """
+    Convert a NetCDF file in bands of rows so that memory use is bounded by the budget.  Every band is written as a
+    shifted tile to scratch storage as soon as it is read, the tiles are then mosaicked into the output and removed.
+    arcpy can't write a band into a window of an existing raster, so the mosaic is an extra full pass over the pixels
+    and the stream mode trades that pass for the bounded memory of the single mode.
+    :param in_nc: <str> The full path to the input nc file
+    :param out_tif: <str> The full path to the output tif file
+    :param x_shift: <int> The amount to shift x
+    :param y_shift: <int> The amount to shift y
+    :param memory_budget: <int> Bytes available for this file
+    :param srs: <str> A string containing the projection
+    :param var: <str> An identifying variable, default is band_1
+    :param x_dim: <str> The identifier x-dimension, default is easting
+    :param y_dim: <str> The identifier y-dimension, default is northing
+    :return:
+    """
+    name = os.path.splitext(os.path.basename(out_tif))[0]
+
+    layer = name + "_lyr"
+
+    make_netcdf_raster(in_nc=in_nc, out_layer=layer, var=var, x_dim=x_dim, y_dim=y_dim)
+
+    raster = arcpy.Raster(layer)
+
+    itemsize, pixel_type = PIXEL_TYPES[raster.pixelType]
+
+    rows = band_rows(in_nc, raster.width, itemsize, memory_budget, var=var, y_dim=y_dim)
+
+    sr = arcpy.SpatialReference()
+
+    sr.loadFromString(srs)
+
+    xmin, ymax = raster.extent.XMin, raster.extent.YMax
+
+    cell_width, cell_height = raster.meanCellWidth, raster.meanCellHeight
+
+    tiles = list()
+
+    scratch = Scratch()
+
+    try:
+        for row in range(0, raster.height, rows):
+            nrows = min(rows, raster.height - row)
+
+            ymin = ymax - (row + nrows) * cell_height
+
+            data = arcpy.RasterToNumPyArray(raster, arcpy.Point(xmin, ymin), raster.width, nrows)
+
+            tile = arcpy.NumPyArrayToRaster(data, arcpy.Point(xmin + x_shift, ymin + y_shift), cell_width,
+                                            cell_height, raster.noDataValue)
+
+            tiles.append(scratch.raster("%s_%d.tif" % (name, row), data.nbytes))
+
+            # Only the mosaic is written in the output format, compressing the tiles would be wasted
+            with output_format.using("none"):
+                tile.save(tiles[-1])
+
+            del data, tile
+
+        arcpy.MosaicToNewRaster_management(";".join(tiles), os.path.dirname(out_tif), os.path.basename(out_tif), sr,
+                                           pixel_type, cell_width, 1)
+
+    finally:
+        arcpy.Delete_management(layer)
+
+        scratch.close()
+
+    return None
+
+
+def output_name(nc, outdir):
+    """
+    :param nc: <str> The full path to the input nc file
+    :param outdir: <str> The full path to the output directory
+    :return: <str> The full path to the GeoTiff the file is converted to
+    """
+    return outdir + os.sep + os.path.basename(nc).split(".")[0] + ".tif"
+
+
+def process_file(nc, outdir, x_shift=15, y_shift=-15, mode="single", memory_budget=None,
+                 out_format=output_format.DEFAULT):
+    """
+    Convert one file
+    :param nc: <str> The full path to the input nc file
+    :param outdir: <str> The full path to the output directory
+    :param x_shift: <int> Amount to shift x-direction, default is 15
+    :param y_shift: <int> Amount to shift y-direction, default is -15
+    :param mode: <str> See main_work
+    :param memory_budget: <int> Bytes available for this file in the stream mode
+    :param out_format: <str> The format of the output, see output_format.FORMATS
+    :return: <tuple> (nc, input size in bytes, seconds)
+    """
+    t1 = time.time()
+
+    temp_file = outdir + os.sep + os.path.basename(nc).split(".")[0] + "_temp.tif"
+
+    out_file = output_name(nc, outdir)
+
+    print("Working on file %s" % os.path.basename(nc))
+
+    with output_format.using(out_format):
+        if mode == "single":
+            convert(in_nc=nc, out_tif=out_file, x_shift=x_shift, y_shift=y_shift)
+
+            print("Converted with shift and projection\n")
+
+        elif mode == "stream":
+            convert_streaming(in_nc=nc, out_tif=out_file, x_shift=x_shift, y_shift=y_shift, memory_budget=memory_budget)
+
+            print("Converted in bands of rows with shift and projection\n")
+
+        else:
+            make_netcdf_raster(in_nc=nc, out_layer=temp_file)
+
+            print("Created NetCDF Raster Layer")
+
+            shift(in_tif=temp_file, out_tif=out_file, x_shift=x_shift, y_shift=y_shift)
+
+            print("Performed shift")
+
+            set_prj(in_tif=out_file)
+
+            if arcpy.Exists(temp_file):
+                arcpy.Delete_management(temp_file)
+
+            print("Set Projection\n")
+
+    return nc, os.path.getsize(nc), time.time() - t1
+
+
+def process_file_task(args):
+    """
+    Pool entry point for process_file, errors are returned instead of stopping the other files
+    :param args: <tuple> The process_file arguments
+    :return: <tuple> (nc, input size in bytes, seconds, error message or None)
+    """
+    try:
+        return process_file(*args) + (None,)
+
+    except Exception:
+        return args[0], os.path.getsize(args[0]), 0.0, traceback.format_exc()
+
+
+def report_throughput(results, wall_time):
+    """
+    Print the per-file and overall throughput
+    :param results: <list> (nc, input size in bytes, seconds, error message or None) tuples
+    :param wall_time: <float> Seconds for the whole run
+    :return:
+    """
+    mb = 1024.0 * 1024.0
+
+    print("%-40s %10s %10s %10s" % ("File", "MB", "Seconds", "MB/s"))
+
+    for nc, size, seconds, error in sorted(results):
+        if error is not None:
+            print("%-40s FAILED" % os.path.basename(nc))
+
+            continue
+
+        print("%-40s %10.1f %10.1f %10.2f" % (os.path.basename(nc), size / mb, seconds, size / mb / max(seconds, 1e-6)))
+
+    total = sum(r[1] for r in results if r[3] is None)
+
+    print("Total: %.1f MB in %.1f s, %.2f MB/s" % (total / mb, wall_time, total / mb / max(wall_time, 1e-6)))
+
+    return None
+
+
+def main_work(indir, outdir, x_shift=15, y_shift=-15, mode="single", workers=1, memory_budget=512,
+              out_format=output_format.DEFAULT):
     """
     Get the input files, parse through them and generate outputs
     :param x_shift: <int> Amount to shift x-direction, default is 15
     :param y_shift: <int> Amount to shift y-direction, default is -15
     :param indir: <str> The full path to the input directory
     :param outdir: <str> The full path to the output directory
-    :return:
+    :param mode: <str> "single" reads each file once and writes the shifted, projected output in one write, "stream"
+    does the same in bands of rows that fit in the memory budget, "legacy" makes the layer, shifts it and defines the
+    projection as separate steps
+    :param workers: <int> The number of files converted at the same time
+    :param memory_budget: <int> Megabytes shared by the workers in the stream mode, default is 512
+    :param out_format: <str> The format of the outputs, see output_format.FORMATS
+    :return: <list> (nc, input size in bytes, seconds, error message or None) tuples
     """
 
     if not os.path.exists(outdir):
@@ -89,26 +373,37 @@ def main_work(indir, outdir, x_shift=15, y_shift=-15):
 
     nc_files = get_files(indir=indir)
 
-    for nc in nc_files:
-        temp_file = outdir + os.sep + os.path.basename(nc).split(".")[0] + "_temp.tif"
+    per_file_budget = memory_budget * 1024 * 1024 // max(workers, 1)
 
-        out_file = outdir + os.sep + os.path.basename(nc).split(".")[0] + ".tif"
+    jobs = [(nc, outdir, x_shift, y_shift, mode, per_file_budget, out_format) for nc in nc_files]
 
-        print("Working on file %s" % os.path.basename(nc))
+    t1 = time.time()
 
-        make_netcdf_raster(in_nc=nc, out_layer=temp_file)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
 
-        print("Created NetCDF Raster Layer")
+        try:
+            results = pool.map(process_file_task, jobs, 1)
 
-        shift(in_tif=temp_file, out_tif=out_file, x_shift=x_shift, y_shift=y_shift)
+        finally:
+            pool.close()
 
-        print("Performed shift")
+            pool.join()
 
-        set_prj(in_tif=out_file)
+    else:
+        results = [process_file_task(job) for job in jobs]
 
-        print("Set Projection\n")
+    report_throughput(results, time.time() - t1)
 
-    return None
+    failed = [r for r in results if r[3] is not None]
+
+    for nc, size, seconds, error in failed:
+        sys.stderr.write("FAILED %s\n%s\n" % (nc, error))
+
+    if failed:
+        sys.stderr.write("%s of %s files failed\n" % (len(failed), len(results)))
+
+    return results
 
 
 def main():
@@ -120,18 +415,44 @@ def main():
     parser.add_argument("-o", dest="outdir", type=str, required=True,
                         help="The full path to the output directory")
 
-    parser.add_argument("-x", dest="x_shift", type=int, required=False,
-                        help="Optional, the amount to shift in x-direction")
+    parser.add_argument("-x", dest="x_shift", type=int, required=False, default=15,
+                        help="Optional, the amount to shift in x-direction, default is 15")
 
-    parser.add_argument("-y", dest="y_shift", type=int, required=False,
-                        help="Optional, the amount to shift in y-direction")
+    parser.add_argument("-y", dest="y_shift", type=int, required=False, default=-15,
+                        help="Optional, the amount to shift in y-direction, default is -15")
+
+    parser.add_argument("-m", "--mode", dest="mode", type=str, required=False, default="single",
+                        choices=["single", "stream", "legacy"],
+                        help="Optional, single (default) converts each file in one read and one write, stream does "
+                             "the same in bands of rows that fit in the memory budget, legacy runs the separate layer, "
+                             "shift and projection steps")
+
+    parser.add_argument("-w", "--workers", dest="workers", type=int, required=False, default=1,
+                        help="Optional, the number of files converted at the same time, default is 1")
+
+    parser.add_argument("--memory", dest="memory_budget", type=int, required=False, default=512,
+                        help="Optional, the memory budget in MB shared by the workers in the stream mode, "
+                             "default is 512")
+
+    parser.add_argument("-F", "--format", dest="out_format", type=str, required=False,
+                        default=output_format.DEFAULT, choices=output_format.RASTER_FORMATS,
+                        help="Optional, the output format: none (default) for striped uncompressed GeoTiffs, lzw or "
+                             "deflate for tiled compressed GeoTiffs")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
 
     args = parser.parse_args()
 
-    main_work(**vars(args))
+    if args.profile:
+        gp_profiler.enable(args.profile)
 
-    return None
+    del args.profile
+
+    results = main_work(**vars(args))
+
+    return 1 if any(r[3] is not None for r in results) else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Output formats of the rasters written by the clip and conversion tools.  The outputs are mostly NoData and long runs
+of the same class, so a tiled, compressed GeoTiff is several times smaller than a striped, uncompressed one and the
+time spent compressing is won back in writes to the network share and in the catalogs and animations that read them.
+
+    none     Striped and uncompressed, what the tools wrote before
+    lzw      256 x 256 tiles, LZW compressed, fast to write and readable by every GeoTiff reader
+    deflate  256 x 256 tiles, Deflate (LZ77) compressed, smaller than LZW for a bit more CPU
+    cube     One raster_cube per block holding every year, instead of a GeoTiff per year (clip tools only)
+
+Tiles are compressed independently, so the worker processes of the tools compress their outputs in parallel.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+from contextlib import contextmanager
+import arcpy
+
+# Name -> (arcpy.env.compression, arcpy.env.tileSize), the rasters of the cube format are the ones written next to it
+FORMATS = {"none": ("NONE", None),
+           "lzw": ("LZW", "256 256"),
+           "deflate": ("LZ77", "256 256"),
+           "cube": ("NONE", None)}
+
+DEFAULT = "none"
+
+CUBE = "cube"
+
+# The formats of the tools that write single rasters
+RASTER_FORMATS = sorted(f for f in FORMATS if f != CUBE)
+
+
+def env_settings(fmt=DEFAULT):
+    """
+    Return the arcpy environment of an output format, in the form clip_pool.init_worker takes
+    :param fmt: <str> A key of FORMATS
+    :return: <dict>
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown output format %s, expected one of %s" % (fmt, ", ".join(sorted(FORMATS))))
+
+    compression, tile_size = FORMATS[fmt]
+
+    return {"compression": compression, "tileSize": tile_size}
+
+
+@contextmanager
+def using(fmt=DEFAULT):
+    """
+    Write the rasters of the with block in an output format and put the previous environment back after it
+    :param fmt: <str> A key of FORMATS
+    :return:
+    """
+    settings = env_settings(fmt)
+
+    previous = dict((key, getattr(arcpy.env, key)) for key in settings)
+
+    for key, value in settings.items():
+        setattr(arcpy.env, key, value)
+
+    try:
+        yield settings
+
+    finally:
+        for key, value in previous.items():
+            setattr(arcpy.env, key, value)
@@ -0,0 +1,699 @@
+"""
+Run the production flow as one pipeline: NetCDF conversion, clipping, catalog building and populating the PNG field.
+The work is declared as a DAG of small items, one per NetCDF file, one per block and year for the clips, one per
+block for the catalogs and one for the populate step, and every stage runs on its own pool of worker processes with
+its own concurrency limit.  An item starts as soon as the items it depends on are finished, so the catalog of a block
+is built while the clips of the other blocks are still running.  Failed items are retried, items whose outputs are
+current according to the build manifest are not run again, and a summary of where the time went is printed at the
+end.  The NetCDF conversions have a build manifest of their own in netcdf.outdir, a clip of a converted file is
+current when its conversion and its own output are.
+
+Config file layout (every stage but clip is optional):
+    {
+        "netcdf": {"indir": "D:/.../nc", "outdir": "D:/.../tif", "x_shift": 15, "y_shift": -15, "mode": "single",
+                   "format": "lzw"},
+        "clip": {"indir": "D:/.../tif", "outdir": "D:/.../aoi_clipped_blocks/ChangeMap", "shp": "D:/.../blocks.shp",
+                 "field": "id", "product": "ChangeMap", "years": [1984, 1985], "engine": "numpy", "format": "lzw"},
+        "catalog": {"outdir": "D:/.../aoi_clipped_blocks/Animations", "rc_name": "ChangeMap"},
+        "populate": {"img_dir": "D:/.../png", "feature": "D:/.../trends_used_blocks.shp", "option": "2000"},
+        "concurrency": {"netcdf": 2, "clip": 4, "catalog": 2, "populate": 1},
+        "retries": 1
+    }
+
+NetCDF files with a year in their name feed the clips of that year as soon as they are converted, clip.indir can then
+be left out.  When clip.indir is netcdf.outdir, the clips of its rasters wait for the NetCDF files without a year
+(tiles).
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import argparse
+import collections
+import datetime as dt
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import arcpy
+import clip_engine
+import clip_pool
+import geometry_store
+import gp_profiler
+import netcdf_shifter
+import output_format
+import puget_populate_field
+import puget_raster_catalogs
+import raster_index
+from build_manifest import BuildManifest
+from mask_cache import feature_hashes
+from scratch import Scratch, process_running
+
+try:
+    import queue
+
+except ImportError:
+    import Queue as queue
+
+try:
+    from multiprocessing import SimpleQueue
+
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+
+STAGES = ("netcdf", "clip", "catalog", "populate")
+
+Item = collections.namedtuple("Item", ["key", "stage", "func", "args", "deps"])
+
+# Seconds between the checks for items lost to a dead worker or an error outside run_item
+POLL = 5
+
+# Set in every stage worker by init_stage, the queue a worker puts (key, pid) on when it starts an item.  A
+# SimpleQueue writes before put returns, so the pid is known even when the worker dies right after.
+_started = None
+
+
+def get_time():
+    """
+    Return the current time
+    :return:
+    """
+    return dt.datetime.now()
+
+
+def init_stage(started, initializer=None, initargs=()):
+    """
+    Set up a stage worker
+    :param started: <SimpleQueue> See run_item
+    :param initializer: <function> Optional, the initializer of the stage, e.g. clip_pool.init_worker
+    :param initargs: <tuple> Its arguments
+    :return:
+    """
+    global _started
+
+    _started = started
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    return None
+
+
+def run_item(key, func, args):
+    """
+    Run one item in a stage worker
+    :param key: <tuple> The key of the item, put on the started queue with the pid of this worker
+    :param func: <function> A module level function
+    :param args: <tuple>
+    :return: <tuple> (seconds, error message or None)
+    """
+    if _started is not None:
+        _started.put((key, os.getpid()))
+
+    t1 = time.time()
+
+    try:
+        func(*args)
+
+    except Exception:
+        return time.time() - t1, traceback.format_exc()
+
+    return time.time() - t1, None
+
+
+def netcdf_item(nc, outdir, x_shift, y_shift, mode, memory_budget, out_format):
+    """
+    Convert one NetCDF file, see netcdf_shifter.process_file
+    """
+    netcdf_shifter.process_file(nc, outdir, x_shift, y_shift, mode, memory_budget, out_format)
+
+    return None
+
+
+def clip_item(task):
+    """
+    Clip one raster to one block in a worker set up by clip_pool.init_worker
+    :param task: <clip_pool.ClipTask>
+    :return:
+    """
+    result_name, seconds, error, groups = clip_pool.run_task(task)
+
+    if error is not None:
+        raise RuntimeError(error)
+
+    return None
+
+
+def catalog_item(block_dir, subdir, rc_name, gdb_name, catalog_type):
+    """
+    Build the raster catalog of one block from scratch, see puget_raster_catalogs.block_catalog
+    """
+    catalog = os.path.join(subdir, gdb_name if gdb_name.endswith(".gdb") else gdb_name + ".gdb", rc_name)
+
+    if arcpy.Exists(catalog):
+        arcpy.Delete_management(catalog)
+
+    # Pool workers can't start pools of their own, the pyramids are built in this process
+    puget_raster_catalogs.block_catalog(block_dir, subdir, rc_name, gdb_name, 1, catalog_type)
+
+    return None
+
+
+def populate_item(img_dir, feature, field, option):
+    """
+    See puget_populate_field.main_work
+    """
+    puget_populate_field.main_work(img_dir, feature, field, option)
+
+    return None
+
+
+class Pipeline(object):
+    """
+    A DAG of items run on one pool of worker processes per stage
+    """
+
+    def __init__(self, concurrency, retries=0, initializers=None):
+        """
+        :param concurrency: <dict> Stage -> the number of items of that stage run at the same time
+        :param retries: <int> How often a failed item is run again before it counts as failed
+        :param initializers: <dict> Stage -> (initializer, initargs) of that stage's worker processes
+        """
+        self.concurrency = concurrency
+
+        self.retries = retries
+
+        self.initializers = initializers or dict()
+
+        self.items = collections.OrderedDict()
+
+        self.dependents = collections.defaultdict(list)
+
+        # Items that are current from an earlier run, they count as finished without running
+        self.current = set()
+
+        # Called in this process when an item finished: key -> function(item)
+        self.on_done = dict()
+
+        # Items that only run when one of their dependencies ran, or their output is missing: key -> function()
+        self.needed = dict()
+
+    def add(self, key, stage, func, args=(), deps=(), current=False, on_done=None, needed=None):
+        """
+        Declare an item
+        :param key: <tuple> A unique key, e.g. ("clip", block, year)
+        :param stage: <str> One of STAGES
+        :param func: <function> A module level function run in a worker of the stage
+        :param args: <tuple> Its arguments
+        :param deps: <list> Keys of the items that have to finish first
+        :param current: <bool> The outputs of the item are current, don't run it
+        :param on_done: <function> Optional, called with the item in this process after it finished
+        :param needed: <function> Optional, when none of the dependencies ran, the item is only run if this returns
+        True
+        :return:
+        """
+        self.items[key] = Item(key, stage, func, tuple(args), list(deps))
+
+        for dep in deps:
+            self.dependents[dep].append(key)
+
+        if current:
+            self.current.add(key)
+
+        if on_done is not None:
+            self.on_done[key] = on_done
+
+        if needed is not None:
+            self.needed[key] = needed
+
+        return None
+
+    def run(self):
+        """
+        Run the items in dependency order
+        :return: <dict> Stage -> stats, see report
+        """
+        missing = [(k, d) for k, item in self.items.items() for d in item.deps if d not in self.items]
+
+        if missing:
+            raise ValueError("Unknown dependencies: %s" % missing)
+
+        stats = collections.OrderedDict((s, collections.Counter()) for s in STAGES if
+                                        any(i.stage == s for i in self.items.values()))
+
+        spans = dict()
+
+        waiting = dict((k, len(item.deps)) for k, item in self.items.items())
+
+        ran = set()
+
+        attempts = collections.Counter()
+
+        ready = collections.defaultdict(collections.deque)
+
+        finished = queue.Queue()
+
+        announced = SimpleQueue()
+
+        # Key -> AsyncResult and key -> worker pid of the items that are running
+        results = dict()
+
+        workers = dict()
+
+        # Stages that lost an item to a dead worker, their pool still waits for it and can't be closed
+        abandoned = set()
+
+        running = collections.Counter()
+
+        started = dict()
+
+        pools = dict()
+
+        def finish(key, did_run):
+            # Mark an item as finished and release its dependents
+            if did_run:
+                ran.add(key)
+
+            for dependent in self.dependents[key]:
+                waiting[dependent] -= 1
+
+                if waiting[dependent] == 0:
+                    release(dependent)
+
+        def lost():
+            # Items that will never call back: an error outside run_item (e.g. pickling) or a worker that died
+            while not announced.empty():
+                key, pid = announced.get()
+
+                if key in results:
+                    workers[key] = pid
+
+            for key, result in list(results.items()):
+                if result.ready() and not result.successful():
+                    try:
+                        result.get(0)
+
+                    except Exception:
+                        finished.put((key, (time.time() - started[key], traceback.format_exc())))
+
+                elif not result.ready() and key in workers and not process_running(workers[key]):
+                    abandoned.add(self.items[key].stage)
+
+                    finished.put((key, (time.time() - started[key],
+                                        "The worker process %s of the item exited\n" % workers[key])))
+
+        def release(key):
+            # All dependencies of an item are finished
+            item = self.items[key]
+
+            if key in self.current:
+                stats[item.stage]["current"] += 1
+
+                finish(key, False)
+
+            elif key in self.needed and not any(d in ran for d in item.deps) and not self.needed[key]():
+                stats[item.stage]["current"] += 1
+
+                finish(key, False)
+
+            else:
+                ready[item.stage].append(key)
+
+        try:
+            for stage in stats:
+                initializer, initargs = self.initializers.get(stage, (None, ()))
+
+                pools[stage] = multiprocessing.Pool(self.concurrency.get(stage, 1), init_stage,
+                                                    (announced, initializer, initargs))
+
+            for key, item in self.items.items():
+                if not item.deps:
+                    release(key)
+
+            while True:
+                for stage, keys in ready.items():
+                    while keys and running[stage] < self.concurrency.get(stage, 1):
+                        key = keys.popleft()
+
+                        item = self.items[key]
+
+                        running[stage] += 1
+
+                        attempts[key] += 1
+
+                        started[key] = time.time()
+
+                        span = spans.setdefault(stage, [started[key], started[key]])
+
+                        span[0] = min(span[0], started[key])
+
+                        results[key] = pools[stage].apply_async(
+                            run_item, (key, item.func, item.args),
+                            callback=lambda result, key=key: finished.put((key, result)))
+
+                if not sum(running.values()):
+                    break
+
+                # A timeout keeps the wait interruptible with ctrl+c on python 2
+                try:
+                    key, (seconds, error) = finished.get(True, POLL)
+
+                except queue.Empty:
+                    key = None
+
+                if key is None:
+                    lost()
+
+                    continue
+
+                if key not in results:
+                    # Already counted as lost
+                    continue
+
+                del results[key]
+
+                workers.pop(key, None)
+
+                item = self.items[key]
+
+                running[item.stage] -= 1
+
+                spans[item.stage][1] = max(spans[item.stage][1], time.time())
+
+                stats[item.stage]["seconds"] += seconds
+
+                if error is None:
+                    stats[item.stage]["done"] += 1
+
+                    print("%s done in %.1f s" % (" ".join(str(k) for k in key), seconds))
+
+                    if key in self.on_done:
+                        self.on_done[key](item)
+
+                    finish(key, True)
+
+                elif attempts[key] <= self.retries:
+                    stats[item.stage]["retried"] += 1
+
+                    sys.stderr.write("%s failed, retrying:\n%s\n" % (" ".join(str(k) for k in key), error))
+
+                    ready[item.stage].append(key)
+
+                else:
+                    stats[item.stage]["failed"] += 1
+
+                    sys.stderr.write("%s FAILED:\n%s\n" % (" ".join(str(k) for k in key), error))
+
+        except BaseException:
+            for pool in pools.values():
+                pool.terminate()
+
+            raise
+
+        else:
+            for stage, pool in pools.items():
+                if stage in abandoned:
+                    pool.terminate()
+
+                else:
+                    pool.close()
+
+        finally:
+            for pool in pools.values():
+                pool.join()
+
+
+        # Items downstream of a failure never became ready
+        for key, item in self.items.items():
+            if waiting[key] > 0:
+                stats[item.stage]["blocked"] += 1
+
+        for stage in stats:
+            stats[stage]["wall"] = spans[stage][1] - spans[stage][0] if stage in spans else 0.0
+
+        return stats
+
+
+def report(stats, wall):
+    """
+    Print where the time was spent
+    :param stats: <dict> See Pipeline.run
+    :param wall: <float> The wall time of the whole run in seconds
+    :return:
+    """
+    print("%-10s %6s %8s %7s %7s %8s %10s %10s" % ("Stage", "Done", "Current", "Failed", "Blocked", "Retries",
+                                                 "Work s", "Wall s"))
+
+    for stage, s in stats.items():
+        print("%-10s %6d %8d %7d %7d %8d %10.1f %10.1f" % (stage, s["done"], s["current"], s["failed"], s["blocked"],
+                                                        s["retried"], s["seconds"], s["wall"]))
+
+    print("Pipeline wall time %.1f s" % wall)
+
+    return None
+
+
+def build_pipeline(config, scratch_root):
+    """
+    Declare the items of every configured stage
+    :param config: <dict> See the module docstring
+    :param scratch_root: <str> The directory for the scratch workspaces of the clip workers
+    :return: <tuple> (Pipeline, list of the BuildManifests of the stages)
+    """
+    concurrency = dict((s, 1) for s in STAGES)
+
+    concurrency.update(config.get("concurrency", dict()))
+
+    nc_cfg = config.get("netcdf")
+
+    clip_cfg = config["clip"]
+
+    cat_cfg = config.get("catalog")
+
+    pop_cfg = config.get("populate")
+
+    split_shape = clip_cfg["shp"]
+
+    split_field = clip_cfg.get("field", "id")
+
+    engine = clip_cfg.get("engine", "numpy")
+
+    out_prod = clip_cfg["product"]
+
+    clip_dir = clip_cfg["outdir"]
+
+    out_format = clip_cfg.get("format", output_format.DEFAULT)
+
+    for stage_cfg in (nc_cfg, clip_cfg):
+        if (stage_cfg or dict()).get("format", output_format.DEFAULT) not in output_format.RASTER_FORMATS:
+            raise ValueError("The pipeline writes a raster per block and year, format must be one of %s" %
+                             ", ".join(output_format.RASTER_FORMATS))
+
+    # The clip workers map the features from one store instead of reading the shapefile
+    store = geometry_store.write(split_shape, split_field,
+                                 os.path.join(scratch_root, "features" + geometry_store.EXTENSION))
+
+    pipeline = Pipeline(concurrency, config.get("retries", 0),
+                        {"clip": (clip_pool.init_worker, (split_shape, split_field, engine, scratch_root,
+                                                          output_format.env_settings(out_format),
+                                                          clip_cfg.get("mask_dir"), None, store.path))})
+
+    # Year -> (input raster, keys of the items that have to finish before it is clipped)
+    inputs = dict()
+
+    barrier = list()
+
+    manifests = list()
+
+    manifest = BuildManifest(os.path.join(clip_dir, "build_manifest_%s.json" % out_prod),
+                             {"tool": "multi_feature_clip_raster", "product": out_prod, "nodata": clip_engine.NODATA,
+                              "format": out_format})
+
+    if clip_cfg.get("indir"):
+        arcpy.env.workspace = clip_cfg["indir"]
+
+        index = raster_index.RasterIndex([os.path.join(clip_cfg["indir"], r) for r in arcpy.ListRasters() or list()])
+
+        # Only the rasters written by the NetCDF stage wait for it
+        from_netcdf = nc_cfg is not None and (os.path.normcase(os.path.abspath(clip_cfg["indir"])) ==
+                                              os.path.normcase(os.path.abspath(nc_cfg["outdir"])))
+
+        inputs = dict((year, (index.get(year), barrier if from_netcdf else list())) for year in index.years())
+
+    if nc_cfg is not None:
+        tif_dir = nc_cfg["outdir"]
+
+        if not os.path.exists(tif_dir):
+            os.makedirs(tif_dir)
+
+        budget = nc_cfg.get("memory_budget", 512) * 1024 * 1024 // concurrency["netcdf"]
+
+        nc_manifest = BuildManifest(os.path.join(tif_dir, "build_manifest_netcdf.json"),
+                                    {"tool": "netcdf_shifter", "x_shift": nc_cfg.get("x_shift", 15),
+                                     "y_shift": nc_cfg.get("y_shift", -15),
+                                     "format": nc_cfg.get("format", output_format.DEFAULT)})
+
+        manifests.append(nc_manifest)
+
+        def converted(item):
+            nc, out_tif = item.args[0], netcdf_shifter.output_name(item.args[0], item.args[1])
+
+            nc_manifest.record(out_tif, [nc])
+
+            # The clips are checked against the fingerprint of the converted file, not of the one it replaced
+            manifest.forget(out_tif)
+
+        for nc in netcdf_shifter.get_files(nc_cfg["indir"]):
+            key = ("netcdf", os.path.basename(nc).split(".")[0])
+
+            out_tif = netcdf_shifter.output_name(nc, tif_dir)
+
+            pipeline.add(key, "netcdf", netcdf_item, (nc, tif_dir, nc_cfg.get("x_shift", 15),
+                                                      nc_cfg.get("y_shift", -15), nc_cfg.get("mode", "single"),
+                                                      budget, nc_cfg.get("format", output_format.DEFAULT)),
+                         current=nc_manifest.is_current(out_tif, [nc]), on_done=converted)
+
+            tokens = raster_index.year_tokens(nc)
+
+            if len(set(tokens)) == 1:
+                # The output of an annual file feeds the clips of its year as soon as it is converted
+                inputs[tokens[0]] = (out_tif, [key])
+
+            else:
+                # Tiles without a year, the clips of the rasters in clip.indir wait for all of them
+                barrier.append(key)
+
+    years = [int(y) for y in clip_cfg.get("years") or sorted(inputs)]
+
+    hashes = feature_hashes(store)
+
+    areas = store.areas()
+
+    manifests.append(manifest)
+
+    def record(item):
+        task = item.args[0]
+
+        manifest.record(task.result_name, [task.in_rast], {"feature": hashes[task.fid]})
+
+    block_keys = collections.defaultdict(list)
+
+    for fid in sorted(areas, key=lambda f: -areas[f]):
+        subdir = os.path.join(clip_dir, "block_%s" % fid)
+
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+
+        for year in years:
+            if year not in inputs:
+                print("Could not find matching raster for year %s" % year)
+
+                continue
+
+            in_rast, deps = inputs[year]
+
+            result_name = os.path.join(subdir, "%s_block_%s_%s.tif" % (out_prod, fid, year))
+
+            key = ("clip", fid, year)
+
+            # A clip of a converted NetCDF file is run again when the file is converted again
+            current = (all(d in pipeline.current for d in deps) and
+                       manifest.is_current(result_name, [in_rast], {"feature": hashes[fid]}))
+
+            pipeline.add(key, "clip", clip_item, (clip_pool.ClipTask(fid, in_rast, result_name, areas[fid]),),
+                         deps, current, record)
+
+            block_keys[fid].append(key)
+
+    if cat_cfg is not None:
+        gdb_name = cat_cfg.get("gdb_name", "Animations.gdb")
+
+        rc_name = cat_cfg["rc_name"]
+
+        for fid, keys in block_keys.items():
+            subdir = os.path.join(cat_cfg["outdir"], "block_%s" % fid)
+
+            catalog = os.path.join(subdir, gdb_name if gdb_name.endswith(".gdb") else gdb_name + ".gdb", rc_name)
+
+            pipeline.add(("catalog", fid), "catalog", catalog_item,
+                         (os.path.join(clip_dir, "block_%s" % fid), subdir, rc_name, gdb_name,
+                          cat_cfg.get("catalog_type", "MANAGED")), keys,
+                         needed=lambda catalog=catalog: not arcpy.Exists(catalog))
+
+    if pop_cfg is not None:
+        # The PNGs are made from the catalogs, or from the clips when no catalogs are built
+        deps = [k for k in pipeline.items if k[0] == "catalog"] or [k for k in pipeline.items if k[0] == "clip"]
+
+        pipeline.add(("populate",), "populate", populate_item,
+                     (pop_cfg["img_dir"], pop_cfg.get("feature", "trends_used_blocks"), pop_cfg.get("field", "cnfmat"),
+                      pop_cfg.get("option", "")), deps)
+
+    return pipeline, manifests
+
+
+def main_work(config, retries=None):
+    """
+    Run the pipeline of a config file
+    :param config: <str> The full path to the JSON config file
+    :param retries: <int> Overrides the retries of the config file
+    :return: <dict> Stage -> stats, see Pipeline.run
+    """
+    with open(config) as f:
+        doc = json.load(f)
+
+    if retries is not None:
+        doc["retries"] = retries
+
+    t1 = time.time()
+
+    with Scratch() as scratch:
+        pipeline, manifests = build_pipeline(doc, scratch.directory("clip"))
+
+        try:
+            stats = pipeline.run()
+
+        finally:
+            for manifest in manifests:
+                manifest.save()
+
+    report(stats, time.time() - t1)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("-c", dest="config", type=str, required=True,
+                        help="The full path to the JSON config file")
+
+    parser.add_argument("-r", "--retries", dest="retries", type=int, required=False,
+                        help="Optional, how often a failed item is run again, overrides the config file")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls of this process and write PATH.txt and "
+                             "PATH.trace.json at exit")
+
+    args = parser.parse_args()
+
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
+    stats = main_work(**vars(args))
+
+    return 1 if any(s["failed"] or s["blocked"] for s in stats.values()) else 0
+
+
+if __name__ == "__main__":
+    t1 = get_time()
+
+    code = main()
+
+    t2 = get_time()
+
+    print("Processing Time: %s" % str(t2 - t1))
+
+    sys.exit(code)
@@ -6,15 +6,17 @@ Populate an attribute field of a shapefile with the path and filenames of PNGs
 """
 
 import os
+import re
 import arcpy
 import glob
 import argparse
 import datetime
+import gp_profiler
 
-# A list of blocks following the file naming pattern
-BLOCKS = ["block_{}".format(j) for j in range(1, 36)]
+# The block number in a PNG name (trends_blk12_cnfmat_2000.png) and in the BlockID field ('Trends Block 12')
+PNG_BLOCK = re.compile(r"blk([0-9]+)_")
 
-BLCKS = ["blk{}_".format(i) for i in range(1, 36)]
+FEATURE_BLOCK = re.compile(r"([0-9]+)\s*$")
 
 
 def get_time():
@@ -64,45 +66,45 @@ def check_field(feature, field, length=100):
     return None
 
 
-def make_layer(indir, feature):
+def block_images(file_list):
     """
-    Create a layer from the raw shapefile so that it's features can be selected outside of ArcMap
-    :param indir:
-    :param feature:
-    :return:
+    Return the PNG of every block, keyed on the block number found in the file name
+    :param file_list: <list> The PNG paths
+    :return: <dict> Block number -> PNG path
     """
-    feature_layer = "{}{}temp_feature".format(indir, os.sep)
+    images = dict()
 
-    arcpy.MakeFeatureLayer_management(feature, feature_layer)
+    problems = list()
 
-    print("Feature layer was created")
+    for f in file_list:
+        match = PNG_BLOCK.search(os.path.basename(f))
 
-    return feature_layer
+        if match is None:
+            continue
 
+        block = int(match.group(1))
 
-def get_block(block, file_list):
-    """
-    Return the appropriate file based on the current block
-    :param block:
-    :param file_list:
-    :return:
-    """
-    # block = block + "_2000_count"
+        if block in images:
+            problems.append("Block %s matches both %s and %s" % (block, images[block], f))
 
-    for f in file_list:
+            continue
+
+        images[block] = f
 
-        if block in os.path.basename(f):
+    if problems:
+        raise ValueError("Could not match the PNGs to blocks:\n" + "\n".join(problems))
 
-            return f
+    return images
 
 
-def main_work(img_dir, feature="trends_used_blocks", field="cnfmat", option=""):
+def main_work(img_dir, feature="trends_used_blocks", field="cnfmat", option="", key_field="BlockID"):
     """
 
     :param option:
     :param img_dir:
     :param feature:
     :param field:
+    :param key_field: <str> The field holding the block name, e.g. 'Trends Block 12'
     :return:
     """
     # Get a list of the PNG files from the img_dir
@@ -110,40 +112,48 @@ def main_work(img_dir, feature="trends_used_blocks", field="cnfmat", option=""):
 
     assert(len(image_list) > 0)
 
+    images = block_images(image_list)
+
+    if not images:
+        raise ValueError("None of the {} PNGs in {} has a block number in its name (e.g. trends_blk12_cnfmat_2000.png)"
+                         .format(len(image_list), img_dir))
+
     # Check if the field exists in the attribute table, if not then add it as a text field with appropriate length
-    check_field(feature, field, len(image_list[0]))
+    check_field(feature, field, max(len(f) for f in images.values()))
+
+    written = set()
+
+    missing = list()
+
+    # One pass over the attribute table, each row looks up its PNG by block number
+    with arcpy.da.UpdateCursor(feature, [key_field, field]) as cursor:
 
-    # Create a layer, necessary for selecting individual features outside of ArcMap
-    layer = make_layer(img_dir, feature)
+        for row in cursor:
+            match = FEATURE_BLOCK.search(row[0] or "")
 
-    # Parse through the blocks
-    # TODO Write function to find specific block number, and block naming pattern
-    for idx, (block, blck) in enumerate(zip(BLOCKS, BLCKS)):
+            item = images.get(int(match.group(1))) if match else None
 
-        # Select the current feature based on the current block
-        arcpy.SelectLayerByAttribute_management(layer,
+            if item is None:
+                missing.append(row[0])
 
-                                                "NEW_SELECTION",
+                continue
 
-                                                # Make sure this is the correct BlockID pattern
-                                                "BlockID = 'Trends Block {}'".format(idx + 1))
+            # 'item' is a string containing the path and filename of a PNG
+            row[1] = item
 
-        # Get the image associated with the current block
-        item = get_block(blck, image_list)
+            cursor.updateRow(row)
 
-        assert(item is not None)
+            written.add(int(match.group(1)))
 
-        # Access the attribute table field, the row is the selected feature from 'layer'
-        with arcpy.da.UpdateCursor(layer, field) as cursor:
+    print("{} of {} features populated".format(len(written), len(written) + len(missing)))
 
-            for row in cursor:
-                # Add 'item', in this case a string containing the path and filename of a PNG, to the specified field
-                # for the selected row of the attribute table
-                # each 'row' is a list object
+    if missing:
+        print("No PNG found for {}".format(", ".join(str(m) for m in missing)))
 
-                row[0] = item
+    unused = sorted(set(images) - written)
 
-                cursor.updateRow(row)
+    if unused:
+        print("No feature found for the PNGs of blocks {}".format(", ".join(str(b) for b in unused)))
 
     return None
 
@@ -154,17 +164,28 @@ def main():
     parser.add_argument("-img", dest="img_dir", type=str, required=True,
                         help="The full path to the folder containing the .PNG files")
 
-    parser.add_argument("-shp", dest="feature", type=str, required=False,
+    parser.add_argument("-shp", dest="feature", type=str, required=False, default="trends_used_blocks",
                         help="The full path and filename of the shapefile that will store the .PNG file paths")
 
-    parser.add_argument("-f", dest="field", type=str, required=False,
+    parser.add_argument("-f", dest="field", type=str, required=False, default="cnfmat",
                         help="The name of the attribute table field to populate")
 
-    parser.add_argument("-opt", dest="option", type=str, required=False,
+    parser.add_argument("-opt", dest="option", type=str, required=False, default="",
                         help="Not Required: A distinguishing string to help find the correct PNGs")
 
+    parser.add_argument("-key", dest="key_field", type=str, required=False, default="BlockID",
+                        help="Not Required: The field holding the block names, default is BlockID")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main_work(**vars(args))
 
     return None
@@ -7,8 +7,11 @@ A command line version of the script that is used by ArcTool 'Animation Raster C
 import arcpy
 import os
 import datetime as dt
-import re
+from catalog_fields import write_year_field
 import argparse
+import gp_profiler
+import pyramids
+import virtual_catalog
 
 
 def get_time():
@@ -19,114 +22,118 @@ def get_time():
     return dt.datetime.now()
 
 
-def main_work(indir, rc_name, gdb_name="Animations.gdb", outdir = None):
+def block_catalog(current_look, subdir, rc_name, gdb_name="Animations.gdb", workers=1, catalog_type="MANAGED"):
     """
-    Generate a raster catalog in a file geodatabase from all rasters in the given input directory
-    :param indir:
-    :param outdir:
-    :param gdb_name:
-    :param rc_name:
-    :return:
+    Generate the raster catalog of one block
+    :param current_look: <str> The block directory holding the rasters
+    :param subdir: <str> The directory that will contain the geodatabase
+    :param rc_name: <str>
+    :param gdb_name: <str>
+    :param workers: <int> The number of worker processes that build pyramids
+    :param catalog_type: <str> See main_work
+    :return: <str> The full path to the raster catalog
     """
-    skip_exist = "SKIP_EXISTING"
-
     skip_first = "NONE"
 
     year_field = "Year"
 
-    blocks = ["block_%s_" % i for i in range(1, 36)]
-
-    for block in blocks:
-
-
-        # Set the current workspace
-        # formerly arcpy.GetParameterAsText(0)
-        current_look = indir + os.sep + block[:-1]
-        arcpy.env.workspace = current_look
-
-        # Set the output directory that will contain the geodatabase
-        # formerly arcpy.GetParameterAsText(1)
-        if outdir is None:
-
-            subdir = indir
-
-        else:
-
-            subdir = outdir + os.sep + block[:-1]
+    # Set the current workspace
+    # formerly arcpy.GetParameterAsText(0)
+    arcpy.env.workspace = current_look
 
-            if not os.path.exists(subdir):
+    if not os.path.exists(subdir):
 
-                os.makedirs(subdir)
+        try:
+            os.makedirs(subdir)
 
-        # Name of FileGDB
-        # formerly arcpy.GetParameterAsText(2)
-        if not os.path.splitext(gdb_name)[1] == ".gdb":
-        # if not gdb_name[-4:] == ".gdb":
-            # Make sure we have the correct file extension for the geodatabase
+        except OSError:
+            # Another batch_raster_catalogs worker made it first
+            if not os.path.isdir(subdir):
+                raise
 
-            gdb_name = gdb_name + ".gdb"
+    # Name of FileGDB
+    # formerly arcpy.GetParameterAsText(2)
+    if not os.path.splitext(gdb_name)[1] == ".gdb":
+    # if not gdb_name[-4:] == ".gdb":
+        # Make sure we have the correct file extension for the geodatabase
 
-        file_gdb = subdir + os.sep + gdb_name
-        print("File GDB name is: %s" % file_gdb)
+        gdb_name = gdb_name + ".gdb"
 
+    file_gdb = subdir + os.sep + gdb_name
+    print("File GDB name is: %s" % file_gdb)
 
-        # Name of Raster Catalaog
-        # formerly arcpy.GetParameterAsText(3)
-        print("Raster Catalog name is %s" % rc_name)
 
-        # Get the list of rasters in the working environment
-        rasters = arcpy.ListRasters()
+    # Name of Raster Catalaog
+    # formerly arcpy.GetParameterAsText(3)
+    print("Raster Catalog name is %s" % rc_name)
 
-        arcpy.AddMessage("Rasters: %s" % rasters)
+    # Get the list of rasters in the working environment
+    rasters = arcpy.ListRasters()
 
-        for raster in rasters:
+    arcpy.AddMessage("Rasters: %s" % rasters)
 
-            arcpy.BuildPyramids_management(raster, "", skip_first, "", "", "", skip_exist)
+    pyramids.build_pyramids([os.path.join(current_look, r) for r in rasters], workers, skip_first)
 
-            desc = arcpy.Describe(raster)
+    sr = arcpy.Describe(rasters[-1]).spatialReference
 
-            sr = desc.spatialReference
+    if not arcpy.Exists(file_gdb):
+        arcpy.CreateFileGDB_management(subdir, gdb_name)
 
-        if not arcpy.Exists(file_gdb):
-            arcpy.CreateFileGDB_management(subdir, gdb_name)
+        arcpy.AddMessage("FileGDB Created")
 
-            arcpy.AddMessage("FileGDB Created")
+    # Create file geodatabase Raster Catalog
+    arcpy.CreateRasterCatalog_management(file_gdb, rc_name, sr, sr, "", "", "", "", catalog_type, "")
 
-        # Create file geodatabase managed Raster Catalog
-        arcpy.CreateRasterCatalog_management(file_gdb, rc_name, sr, sr, "", "", "", "", "MANAGED", "")
+    arcpy.AddMessage("Raster Catalog Created")
 
-        arcpy.AddMessage("Raster Catalog Created")
+    arcpy.WorkspaceToRasterCatalog_management(current_look, file_gdb + os.sep + rc_name, "", "")
 
-        arcpy.WorkspaceToRasterCatalog_management(current_look, file_gdb + os.sep + rc_name, "", "")
+    arcpy.AddMessage("Rasters Loaded")
 
-        arcpy.AddMessage("Rasters Loaded")
+    # Populate the "Year" field with July 1st of the year in each raster name, the second year when a name
+    # holds two
+    write_year_field(file_gdb + os.sep + rc_name, year_field, position=1)
 
-        arcpy.AddField_management(file_gdb + os.sep + rc_name, year_field, "DATE", "", "", "", "", "")
+    arcpy.AddMessage("Year Field Populated")
 
-        arcpy.AddMessage("Year Field Added")
+    if catalog_type == "UNMANAGED":
+        virtual_catalog.write_virtual_catalog(os.path.join(subdir, rc_name + ".json"),
+                                              [os.path.join(current_look, r) for r in rasters], rc_name)
 
-        date_field = "Year"
+        arcpy.AddMessage("Virtual Catalog Written")
 
-        cur = arcpy.UpdateCursor(file_gdb + os.sep + rc_name, "")
+    return file_gdb + os.sep + rc_name
 
-        # Parse through the rows of the raster catalog and populate the "Year" field with the appropriate date
-        for row in cur:
 
-            name = row.getValue("Name")
+def main_work(indir, rc_name, gdb_name="Animations.gdb", outdir = None, workers=1, catalog_type="MANAGED"):
+    """
+    Generate a raster catalog in a file geodatabase from all rasters in the given input directory
+    :param indir:
+    :param outdir:
+    :param gdb_name:
+    :param rc_name:
+    :param workers: <int> The number of worker processes that build pyramids
+    :param catalog_type: <str> MANAGED copies the pixels into the geodatabase, UNMANAGED references the rasters in
+    place and writes a virtual_catalog document next to the geodatabase
+    :return:
+    """
+    blocks = ["block_%s_" % i for i in range(1, 36)]
 
-            years = re.findall(r"\d\d\d\d", name)
+    for block in blocks:
 
-            if len(years) == 1:
+        current_look = indir + os.sep + block[:-1]
 
-                year = years[0]
+        # Set the output directory that will contain the geodatabase
+        # formerly arcpy.GetParameterAsText(1)
+        if outdir is None:
 
-            else:
+            subdir = indir
 
-                year = years[1]
+        else:
 
-            row.setValue(date_field, r"7/1/%s" % year)
+            subdir = outdir + os.sep + block[:-1]
 
-            cur.updateRow(row)
+        block_catalog(current_look, subdir, rc_name, gdb_name, workers, catalog_type)
 
     return None
 
@@ -147,8 +154,25 @@ def main():
     parser.add_argument("-rc", dest="rc_name", type=str, required=True,
                         help="The name of the output raster catalog")
 
+    parser.add_argument("-w", "--workers", dest="workers", type=int, required=False, default=1,
+                        help="Optional, the number of worker processes that build pyramids, default is 1")
+
+    parser.add_argument("-t", "--catalog-type", dest="catalog_type", type=str, required=False, default="MANAGED",
+                        choices=["MANAGED", "UNMANAGED"],
+                        help="Optional, MANAGED copies the pixels into the geodatabase, UNMANAGED references the "
+                             "rasters in place and also writes <rc_name>.json next to the geodatabase.  Default is "
+                             "MANAGED")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main_work(**vars(args))
 
 
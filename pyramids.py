@@ -0,0 +1,271 @@
+"""
+Build raster pyramids for many rasters at once on a pool of worker processes.  Each raster gets all of its levels from
+one BuildPyramids call, categorical products are resampled with NEAREST and continuous products with BILINEAR, and a
+stamp file in every raster directory records the size and modification time of the source each pyramid was built
+from, so rasters whose pyramids are still valid are skipped on the next run and rasters that changed are rebuilt.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import argparse
+import collections
+import datetime as dt
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import arcpy
+import gp_profiler
+
+# Products holding measurements rather than classes, everything else is treated as categorical.  BuildPyramids has no
+# mode resampling, NEAREST is its only technique that keeps class values intact.
+CONTINUOUS_PRODUCTS = ("ChangeMagMap", "CoverConfPrim", "CoverConfSec", "SegLength")
+
+STAMP_NAME = "pyramids.json"
+
+
+def get_time():
+    """
+    Return the current time
+    :return:
+    """
+    return dt.datetime.now()
+
+
+def resampling(raster):
+    """
+    Return the pyramid resampling technique for a raster
+    :param raster: <str> The raster name or path
+    :return: <str> NEAREST or BILINEAR
+    """
+    name = os.path.basename(raster)
+
+    if any(product in name for product in CONTINUOUS_PRODUCTS):
+        return "BILINEAR"
+
+    return "NEAREST"
+
+
+def source_stamp(raster):
+    """
+    Return the size and modification time of a raster file
+    :param raster: <str> The full path to the raster
+    :return: <list> [size, mtime], or None when the raster is not a plain file (e.g. a geodatabase raster)
+    """
+    try:
+        st = os.stat(raster)
+
+    except OSError:
+        return None
+
+    return [st.st_size, int(st.st_mtime)]
+
+
+def read_stamps(directory):
+    """
+    Read the stamp file of a directory
+    :param directory: <str>
+    :return: <dict> Raster name -> {"source": [size, mtime], "resampling": technique}
+    """
+    path = os.path.join(directory, STAMP_NAME)
+
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_stamps(directory, stamps):
+    """
+    Replace the stamp file of a directory
+    :param directory: <str>
+    :param stamps: <dict> See read_stamps
+    :return:
+    """
+    path = os.path.join(directory, STAMP_NAME)
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    os.rename(path + ".tmp", path)
+
+    return None
+
+
+def is_current(raster, stamps):
+    """
+    Check whether a raster's pyramids were built from the raster as it is now
+    :param raster: <str> The full path to the raster
+    :param stamps: <dict> The stamps of the raster's directory
+    :return: <bool>
+    """
+    source = source_stamp(raster)
+
+    if source is None:
+        return False
+
+    entry = stamps.get(os.path.basename(raster))
+
+    if entry is not None:
+        return entry["source"] == source and entry["resampling"] == resampling(raster)
+
+    # Pyramids built before the stamp file existed are trusted when they are newer than the raster
+    ovr = raster + ".ovr"
+
+    return os.path.exists(ovr) and os.path.getmtime(ovr) >= os.path.getmtime(raster)
+
+
+def build_one(args):
+    """
+    Build all pyramid levels of one raster, replacing any existing pyramids
+    :param args: <tuple> (raster, skip_first, compression)
+    :return: <tuple> (raster, seconds, error message or None)
+    """
+    raster, skip_first, compression = args
+
+    t1 = time.time()
+
+    try:
+        arcpy.BuildPyramids_management(raster, -1, skip_first, resampling(raster), compression, "", "OVERWRITE")
+
+    except Exception:
+        return raster, time.time() - t1, traceback.format_exc()
+
+    return raster, time.time() - t1, None
+
+
+def build_pyramids(rasters, workers=1, skip_first="NONE", compression="DEFAULT", force=False):
+    """
+    Build pyramids for every raster whose pyramids are missing or older than the raster
+    :param rasters: <list> Full paths to the rasters
+    :param workers: <int> The number of worker processes, 1 builds in this process
+    :param skip_first: <str> NONE or SKIP_FIRST
+    :param compression: <str> The pyramid compression type
+    :param force: <bool> Rebuild every raster's pyramids
+    :return: <list> The rasters whose pyramids were built
+    """
+    by_dir = collections.OrderedDict()
+
+    for raster in rasters:
+        by_dir.setdefault(os.path.dirname(os.path.abspath(raster)), list()).append(raster)
+
+    stamps = dict((d, read_stamps(d)) for d in by_dir)
+
+    todo = [r for d in by_dir for r in by_dir[d] if force or not is_current(r, stamps[d])]
+
+    print("Pyramids: %s of %s rasters need building" % (len(todo), len(rasters)))
+
+    if not todo:
+        return list()
+
+    jobs = [(r, skip_first, compression) for r in todo]
+
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+
+        try:
+            results = list(pool.imap_unordered(build_one, jobs, 1))
+
+        finally:
+            pool.close()
+
+            pool.join()
+
+    else:
+        results = [build_one(job) for job in jobs]
+
+    built = list()
+
+    errors = list()
+
+    for raster, seconds, error in results:
+        if error is not None:
+            errors.append((raster, error))
+
+            continue
+
+        directory = os.path.dirname(os.path.abspath(raster))
+
+        source = source_stamp(raster)
+
+        if source is not None:
+            stamps[directory][os.path.basename(raster)] = {"source": source, "resampling": resampling(raster)}
+
+        built.append(raster)
+
+    for directory in by_dir:
+        if any(os.path.dirname(os.path.abspath(r)) == directory for r in built):
+            write_stamps(directory, stamps[directory])
+
+    if errors:
+        raise RuntimeError("Building pyramids failed for %s rasters, first failure %s:\n%s" % (len(errors),
+                                                                                              errors[0][0],
+                                                                                              errors[0][1]))
+
+    return built
+
+
+def main_work(indir, workers=1, force=False):
+    """
+    Build pyramids for every raster in a directory tree
+    :param indir: <str> The root directory
+    :param workers: <int> The number of worker processes
+    :param force: <bool> Rebuild every raster's pyramids
+    :return:
+    """
+    rasters = list()
+
+    for root, dirs, files in os.walk(indir):
+        dirs.sort()
+
+        arcpy.env.workspace = root
+
+        rasters.extend(os.path.join(root, r) for r in sorted(arcpy.ListRasters() or list()))
+
+    built = build_pyramids(rasters, workers, force=force)
+
+    print("Built pyramids for %s rasters" % len(built))
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("-i", dest="indir", type=str, required=True,
+                        help="The full path to the root directory, rasters in all subdirectories are included")
+
+    parser.add_argument("-w", "--workers", dest="workers", type=int, required=False, default=1,
+                        help="Optional, the number of worker processes, default is 1")
+
+    parser.add_argument("--force", dest="force", action="store_true",
+                        help="Optional, rebuild pyramids even when they are current")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
+    args = parser.parse_args()
+
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
+    main_work(**vars(args))
+
+    return None
+
+
+if __name__ == "__main__":
+    t1 = get_time()
+
+    main()
+
+    t2 = get_time()
+
+    print("Processing Time: %s" % str(t2 - t1))
@@ -0,0 +1,321 @@
+"""
+A chunked time-series cube of the annual rasters of one block and product, written by the clip tools with
+--format cube instead of one GeoTiff per year.  A cube is two files:
+
+    <prod>_block_<id>.cube       The pixels
+    <prod>_block_<id>.cube.json  The header: years, shape, dtype, tile size, nodata and georeference
+
+The pixels are stored tile-major: the block is cut into tiles of TILE rows and columns (the last row and column of
+tiles are padded) and every tile holds all the years of its pixels, so the file is an array of shape
+(tile rows, tile columns, years, tile height, tile width).  A year slice reads one contiguous run of tile height x tile
+width pixels from every tile and the history of a pixel reads its values from a single tile, both through a memory map
+without loading the cube.
+
+    python raster_cube.py -c D:\\...\\block_1\\ChangeMap_block_1.cube --history 1520 2650
+    python raster_cube.py -c D:\\...\\block_1\\ChangeMap_block_1.cube --export 1995 D:\\...\\ChangeMap_block_1_1995.tif
+
+Reading a cube only needs numpy, --export requires the ArcGIS python interpreter.
+
+"""
+import argparse
+import contextlib
+import json
+import numpy as np
+from build_manifest import atomic_output
+
+EXTENSION = ".cube"
+
+HEADER_EXTENSION = ".json"
+
+# Rows and columns of a tile, a year of a uint8 tile is one 4 KB page
+TILE = (64, 64)
+
+VERSION = 1
+
+
+def header_path(path):
+    """
+    :param path: <str> The full path to the cube
+    :return: <str> The full path to its header
+    """
+    return path + HEADER_EXTENSION
+
+
+def read_header(path):
+    """
+    :param path: <str> The full path to the cube
+    :return: <dict>
+    """
+    with open(header_path(path)) as f:
+        return json.load(f)
+
+
+def tile_grid(nrows, ncols, tile):
+    """
+    Return the number of tile rows and tile columns that cover a block
+    :param nrows: <int>
+    :param ncols: <int>
+    :param tile: <tuple> (tile height, tile width)
+    :return: <tuple> (tile rows, tile columns)
+    """
+    return -(-nrows // tile[0]), -(-ncols // tile[1])
+
+
+class CubeWriter(object):
+    """
+    Fills a new cube one year at a time, see create
+    """
+
+    def __init__(self, path, years, nrows, ncols, dtype, xmin, ymax, cell_width, cell_height, nodata=None, sr="",
+                 tile=TILE):
+        """
+        :param path: <str> The full path to the cube
+        :param years: <list> The years of the cube, in ascending order
+        :param nrows: <int>
+        :param ncols: <int>
+        :param dtype: <numpy.dtype>
+        :param xmin: <float> The left edge
+        :param ymax: <float> The top edge
+        :param cell_width: <float>
+        :param cell_height: <float>
+        :param nodata: <int> or None
+        :param sr: <str> The spatial reference string
+        :param tile: <tuple> (tile height, tile width)
+        """
+        self.path = path
+
+        self.years = [int(y) for y in years]
+
+        self.header = {"format": "raster_cube", "version": VERSION, "years": self.years, "nrows": int(nrows),
+                       "ncols": int(ncols), "dtype": np.dtype(dtype).str, "tile": list(tile),
+                       "nodata": None if nodata is None else float(nodata), "xmin": float(xmin), "ymax": float(ymax),
+                       "cell_width": float(cell_width), "cell_height": float(cell_height), "sr": sr}
+
+        tiles_y, tiles_x = tile_grid(nrows, ncols, tile)
+
+        self._data = np.memmap(path, dtype=dtype, mode="w+",
+                               shape=(tiles_y, tiles_x, len(self.years), tile[0], tile[1]))
+
+        self._written = set()
+
+    def write(self, year, data):
+        """
+        Write the pixels of one year
+        :param year: <int>
+        :param data: <numpy.ndarray> Array of shape (nrows, ncols)
+        :return:
+        """
+        tiles_y, tiles_x, count, th, tw = self._data.shape
+
+        fill = self.header["nodata"] if self.header["nodata"] is not None else 0
+
+        padded = np.full((tiles_y * th, tiles_x * tw), fill, dtype=self._data.dtype)
+
+        padded[:data.shape[0], :data.shape[1]] = data
+
+        self._data[:, :, self.years.index(int(year))] = padded.reshape(tiles_y, th, tiles_x, tw).swapaxes(1, 2)
+
+        self._written.add(int(year))
+
+        return None
+
+    def close(self):
+        """
+        Flush the pixels and write the header
+        :return:
+        """
+        if self._data is None:
+            return None
+
+        missing = [y for y in self.years if y not in self._written]
+
+        if missing:
+            raise ValueError("Years %s were not written to %s" % (missing, self.path))
+
+        self._data.flush()
+
+        self._data = None
+
+        with open(header_path(self.path), "w") as f:
+            json.dump(self.header, f)
+
+        return None
+
+
+@contextlib.contextmanager
+def create(path, years, nrows, ncols, dtype, xmin, ymax, cell_width, cell_height, nodata=None, sr="", tile=TILE):
+    """
+    Write a cube under a temporary name and move it into place once every year is written, see
+    build_manifest.atomic_output.  The arguments are those of CubeWriter.
+        with raster_cube.create(path, years, ...) as cube:
+            for year in years:
+                cube.write(year, data)
+    :return: <CubeWriter>
+    """
+    with atomic_output(path) as tmp_name:
+        cube = CubeWriter(tmp_name, years, nrows, ncols, dtype, xmin, ymax, cell_width, cell_height, nodata, sr,
+                          tile)
+
+        try:
+            yield cube
+
+            cube.close()
+
+        finally:
+            # Release the memory map before a failed cube is removed
+            cube._data = None
+
+
+class RasterCube(object):
+    """
+    Read access to a cube through a memory map
+    """
+
+    def __init__(self, path):
+        """
+        :param path: <str> The full path to the cube
+        """
+        self.path = path
+
+        self.header = read_header(path)
+
+        if self.header.get("format") != "raster_cube":
+            raise ValueError("%s is not a raster cube" % path)
+
+        self.years = self.header["years"]
+
+        self.nrows, self.ncols = self.header["nrows"], self.header["ncols"]
+
+        self.nodata = self.header["nodata"]
+
+        tiles_y, tiles_x = tile_grid(self.nrows, self.ncols, self.header["tile"])
+
+        self._data = np.memmap(path, dtype=np.dtype(self.header["dtype"]), mode="r",
+                               shape=(tiles_y, tiles_x, len(self.years)) + tuple(self.header["tile"]))
+
+    def year(self, year):
+        """
+        Return the pixels of one year
+        :param year: <int>
+        :return: <numpy.ndarray> Array of shape (nrows, ncols)
+        """
+        if int(year) not in self.years:
+            raise KeyError("No year %s in %s" % (year, self.path))
+
+        tiles_y, tiles_x, count, th, tw = self._data.shape
+
+        band = self._data[:, :, self.years.index(int(year))].swapaxes(1, 2).reshape(tiles_y * th, tiles_x * tw)
+
+        return np.array(band[:self.nrows, :self.ncols])
+
+    def history(self, row, col):
+        """
+        Return the values of one pixel in every year
+        :param row: <int>
+        :param col: <int>
+        :return: <numpy.ndarray> Array of the length of years
+        """
+        if not (0 <= row < self.nrows and 0 <= col < self.ncols):
+            raise IndexError("Pixel (%s, %s) is outside of %s" % (row, col, self.path))
+
+        th, tw = self.header["tile"]
+
+        return np.array(self._data[row // th, col // tw, :, row % th, col % tw])
+
+    def cell(self, x, y):
+        """
+        Return the row and column of the pixel holding a map coordinate
+        :param x: <float>
+        :param y: <float>
+        :return: <tuple> (row, col)
+        """
+        h = self.header
+
+        return int((h["ymax"] - y) // h["cell_height"]), int((x - h["xmin"]) // h["cell_width"])
+
+    def close(self):
+        self._data = None
+
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+        return False
+
+
+def export_year(cube, year, out_raster):
+    """
+    Write one year of a cube as a raster
+    :param cube: <RasterCube>
+    :param year: <int>
+    :param out_raster: <str> The full path to the output raster
+    :return:
+    """
+    import arcpy
+
+    h = cube.header
+
+    lower_left = arcpy.Point(h["xmin"], h["ymax"] - cube.nrows * h["cell_height"])
+
+    out = arcpy.NumPyArrayToRaster(cube.year(year), lower_left, h["cell_width"], h["cell_height"], cube.nodata)
+
+    out.save(out_raster)
+
+    if h["sr"]:
+        sr = arcpy.SpatialReference()
+
+        sr.loadFromString(h["sr"])
+
+        arcpy.DefineProjection_management(out_raster, sr)
+
+    return None
+
+
+def main_work(cube, history=None, export=None):
+    """
+    Print the history of a pixel or export a year of a cube
+    :param cube: <str> The full path to the cube
+    :param history: <list> [x, y] map coordinates of the pixel
+    :param export: <list> [year, out_raster]
+    :return:
+    """
+    with RasterCube(cube) as c:
+        print("%s: %s years (%s-%s), %s x %s pixels" % (cube, len(c.years), c.years[0], c.years[-1], c.nrows,
+                                                         c.ncols))
+
+        if history is not None:
+            row, col = c.cell(float(history[0]), float(history[1]))
+
+            for year, value in zip(c.years, c.history(row, col)):
+                print("%s %s" % (year, value))
+
+        if export is not None:
+            export_year(c, int(export[0]), export[1])
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("-c", dest="cube", type=str, required=True, help="The full path to the cube")
+
+    parser.add_argument("--history", dest="history", type=float, nargs=2, required=False, metavar=("X", "Y"),
+                        help="Optional, print the value of the pixel at X Y in every year")
+
+    parser.add_argument("--export", dest="export", type=str, nargs=2, required=False, metavar=("YEAR", "OUT"),
+                        help="Optional, write the pixels of YEAR to the raster OUT")
+
+    args = parser.parse_args()
+
+    main_work(**vars(args))
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
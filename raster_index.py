@@ -0,0 +1,128 @@
+"""
+Index annual rasters by the year in their file name.  The year is parsed once per raster with an explicit pattern,
+rasters that would match more than one year are reported up front instead of being resolved by list order, and
+lookups by year are a dictionary access.
+"""
+
+import os
+import re
+
+# Four digits from 1900 to 2099 that are not part of a longer number or a block id (block_1999)
+YEAR_PATTERN = re.compile(r"(?<![0-9])(?<!block_)((?:19|20)[0-9]{2})(?![0-9])")
+
+
+def year_tokens(name):
+    """
+    Return every year token in a raster name, in the order they appear
+    :param name: <str> The raster name or path, the directory and extension are ignored
+    :return: <list> of <int>
+    """
+    return [int(y) for y in YEAR_PATTERN.findall(os.path.splitext(os.path.basename(name))[0])]
+
+
+def parse_year(name, position=None):
+    """
+    Return the year of a raster from its name
+    :param name: <str> The raster name or path
+    :param position: <int> Which token to use when the name holds more than one year, by default a name with more
+    than one distinct year is an error
+    :return: <int>
+    """
+    tokens = year_tokens(name)
+
+    if not tokens:
+        raise ValueError("No year found in raster name %s" % name)
+
+    if len(set(tokens)) == 1:
+        return tokens[0]
+
+    if position is None:
+        raise ValueError("Ambiguous year in raster name %s: %s" % (name, tokens))
+
+    return tokens[position]
+
+
+def parse_years(names, position=None):
+    """
+    Return the year of every raster name, checking all of the names before any year is used
+    :param names: <list> Raster names or paths
+    :param position: <int> See parse_year
+    :return: <list> of <int>, in the order of names
+    """
+    years = list()
+
+    problems = list()
+
+    for name in names:
+        try:
+            years.append(parse_year(name, position))
+
+        except (ValueError, IndexError) as e:
+            problems.append(str(e) if isinstance(e, ValueError) else "No year at position %s in raster name %s" %
+                            (position, name))
+
+    if problems:
+        raise ValueError("Could not parse the year of %s rasters:\n%s" % (len(problems), "\n".join(problems)))
+
+    return years
+
+
+class RasterIndex(object):
+    """
+    Year -> raster lookup for the rasters of a workspace
+    """
+
+    def __init__(self, rasters, position=None):
+        """
+        :param rasters: <list> Raster names, e.g. from arcpy.ListRasters()
+        :param position: <int> See parse_year
+        """
+        self._by_year = dict()
+
+        # Rasters with no year in their name, e.g. a reference layer kept in the same workspace
+        self.unmatched = list()
+
+        problems = list()
+
+        for raster in rasters:
+            try:
+                year = parse_year(raster, position)
+
+            except ValueError as e:
+                if year_tokens(raster):
+                    problems.append(str(e))
+
+                else:
+                    self.unmatched.append(raster)
+
+                continue
+
+            if year in self._by_year:
+                problems.append("Duplicate year %s: %s and %s" % (year, self._by_year[year], raster))
+
+                continue
+
+            self._by_year[year] = raster
+
+        if problems:
+            raise ValueError("Could not index the rasters by year:\n" + "\n".join(problems))
+
+    def __len__(self):
+        return len(self._by_year)
+
+    def __contains__(self, year):
+        return int(year) in self._by_year
+
+    def get(self, year):
+        """
+        Return the raster for a year
+        :param year: <int> or <str>
+        :return: <str> The raster name, None if there is no raster for the year
+        """
+        return self._by_year.get(int(year))
+
+    def years(self):
+        """
+        :return: <list> The indexed years in ascending order
+        """
+        return sorted(self._by_year)
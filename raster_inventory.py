@@ -0,0 +1,380 @@
+"""
+A persistent, queryable index of the rasters produced by the clip tools (<prod>_block_<id>_<year>.tif).  A scan of a
+directory tree records the product, block, year, extent, spatial reference, pixel type and basic statistics of every
+raster in a SQLite file with an R-tree on the extents.  Later scans only describe rasters that are new or whose size or
+modification time changed, and drop rasters that are gone, so keeping the index current is cheap.  Queries by
+product, block, year range and bounding box need neither arcpy nor a directory listing.
+
+    python raster_inventory.py scan -db inventory.sqlite -i D:\\...\\aoi_clipped_blocks
+    python raster_inventory.py query -db inventory.sqlite -p ChangeMap --years 1995 2005 --bbox XMIN YMIN XMAX YMAX
+
+Scanning requires the ArcGIS python interpreter, querying does not.
+
+"""
+import argparse
+import collections
+import datetime as dt
+import os
+import re
+import sqlite3
+import numpy as np
+from raster_index import year_tokens
+
+RASTER_EXTENSIONS = (".tif", ".tiff", ".img")
+
+# <prod>_block_<id>_<year>, some older rasters are <name>_block_<id> with the years inside <name>
+NAME_PATTERN = re.compile(r"^(?P<product>.+?)_block_(?P<block>[0-9]+)(?:_(?P<year>(?:19|20)[0-9]{2}))?$")
+
+FIELDS = ["path", "product", "block", "year", "xmin", "ymin", "xmax", "ymax", "srid", "sr_name", "pixel_type",
+          "width", "height", "nodata", "min", "max", "mean", "size", "mtime"]
+
+Record = collections.namedtuple("Record", FIELDS)
+
+
+def get_time():
+    """
+    Return the current time
+    :return:
+    """
+    return dt.datetime.now()
+
+
+def parse_name(path):
+    """
+    Return the product, block and year of a clipped raster from its file name
+    :param path: <str> The raster path
+    :return: <tuple> (product, block, year), block and year are None when the name doesn't hold them
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    match = NAME_PATTERN.match(stem)
+
+    if match is None:
+        tokens = year_tokens(stem)
+
+        return stem, None, tokens[-1] if tokens else None
+
+    year = match.group("year")
+
+    product = match.group("product")
+
+    if year is None:
+        # The last year of a range in the name, the years are not part of the product
+        tokens = year_tokens(product)
+
+        year = tokens[-1] if tokens else None
+
+        product = "_".join(t for t in product.split("_") if t not in [str(y) for y in tokens]) or product
+
+    return product, int(match.group("block")), None if year is None else int(year)
+
+
+def describe(path, stats=True):
+    """
+    Describe one raster for the index
+    :param path: <str> The full path to the raster
+    :param stats: <bool> Read the pixels for min, max and mean, excluding nodata
+    :return: <Record>
+    """
+    # Imported here so that queries don't pay for the arcpy import
+    import arcpy
+
+    desc = arcpy.Describe(path)
+
+    e = desc.extent
+
+    nodata = desc.noDataValue
+
+    low = high = mean = None
+
+    if stats:
+        data = arcpy.RasterToNumPyArray(path)
+
+        valid = data[data != nodata] if nodata is not None else data.ravel()
+
+        if valid.size:
+            low, high, mean = float(valid.min()), float(valid.max()), float(valid.mean(dtype=np.float64))
+
+    product, block, year = parse_name(path)
+
+    st = os.stat(path)
+
+    return Record(os.path.abspath(path), product, block, year, e.XMin, e.YMin, e.XMax, e.YMax,
+                  desc.spatialReference.factoryCode, desc.spatialReference.name, desc.pixelType, desc.width,
+                  desc.height, nodata, low, high, mean, st.st_size, st.st_mtime)
+
+
+class RasterInventory(object):
+    """
+    The SQLite raster index, use as a context manager or call close()
+    """
+
+    def __init__(self, path):
+        """
+        :param path: <str> The full path to the SQLite file, created when missing
+        """
+        self.path = path
+
+        self.db = sqlite3.connect(path)
+
+        self.db.execute("CREATE TABLE IF NOT EXISTS rasters (id INTEGER PRIMARY KEY, %s)" %
+                        ", ".join(f + (" TEXT UNIQUE" if f == "path" else "") for f in FIELDS))
+
+        self.db.execute("CREATE INDEX IF NOT EXISTS rasters_product_year ON rasters (product, year)")
+
+        self.db.execute("CREATE INDEX IF NOT EXISTS rasters_block ON rasters (block)")
+
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS raster_extents "
+                            "USING rtree(id, xmin, xmax, ymin, ymax)")
+
+            self.rtree = True
+
+        except sqlite3.OperationalError:
+            # SQLite built without the R*Tree module, bbox queries fall back to the extent columns
+            self.db.execute("CREATE INDEX IF NOT EXISTS rasters_extent ON rasters (xmin, xmax)")
+
+            self.rtree = False
+
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+        return False
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM rasters").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+        return None
+
+    def upsert(self, record):
+        """
+        Insert or replace the entry of one raster
+        :param record: <Record>
+        :return:
+        """
+        self.remove(record.path)
+
+        sql = "INSERT INTO rasters (%s) VALUES (%s)" % (", ".join(FIELDS), ", ".join("?" * len(FIELDS)))
+
+        cur = self.db.execute(sql, record)
+
+        if self.rtree:
+            self.db.execute("INSERT INTO raster_extents VALUES (?, ?, ?, ?, ?)",
+                            (cur.lastrowid, record.xmin, record.xmax, record.ymin, record.ymax))
+
+        return None
+
+    def remove(self, path):
+        """
+        Drop the entry of one raster, if there is one
+        :param path: <str> The full path to the raster
+        :return:
+        """
+        row = self.db.execute("SELECT id FROM rasters WHERE path = ?", (path,)).fetchone()
+
+        if row is None:
+            return None
+
+        self.db.execute("DELETE FROM rasters WHERE id = ?", row)
+
+        if self.rtree:
+            self.db.execute("DELETE FROM raster_extents WHERE id = ?", row)
+
+        return None
+
+    def scan(self, root, stats=True, commit_every=500):
+        """
+        Bring the index up to date with the rasters under a directory
+        :param root: <str> The directory to scan, subdirectories included
+        :param stats: <bool> See describe
+        :param commit_every: <int> Commit after this many described rasters, so an interrupted scan keeps its work
+        :return: <tuple> (added or updated, removed, unchanged) counts
+        """
+        prefix = os.path.join(os.path.abspath(root), "")
+
+        known = dict((path, (size, mtime)) for path, size, mtime in
+                     self.db.execute("SELECT path, size, mtime FROM rasters") if path.startswith(prefix))
+
+        changed = 0
+
+        unchanged = 0
+
+        for dirpath, dirs, files in os.walk(prefix):
+            dirs.sort()
+
+            for name in sorted(files):
+                # atomic_output writes under <name>_partial until the raster is complete
+                if not name.lower().endswith(RASTER_EXTENSIONS) or os.path.splitext(name)[0].endswith("_partial"):
+                    continue
+
+                path = os.path.join(dirpath, name)
+
+                st = os.stat(path)
+
+                if known.pop(path, None) == (st.st_size, st.st_mtime):
+                    unchanged += 1
+
+                    continue
+
+                self.upsert(describe(path, stats))
+
+                changed += 1
+
+                if changed % commit_every == 0:
+                    self.db.commit()
+
+        for path in known:
+            self.remove(path)
+
+        self.db.commit()
+
+        return changed, len(known), unchanged
+
+    def query(self, product=None, block=None, years=None, bbox=None):
+        """
+        Return the rasters matching every given condition
+        :param product: <str> The product name, e.g. ChangeMap
+        :param block: <int> The block id
+        :param years: <tuple> (first, last) inclusive
+        :param bbox: <tuple> (xmin, ymin, xmax, ymax), rasters whose extent intersects it
+        :return: <list> of <Record>, ordered by product, block and year
+        """
+        tables = "rasters r"
+
+        where = list()
+
+        params = list()
+
+        if product is not None:
+            where.append("r.product = ?")
+
+            params.append(product)
+
+        if block is not None:
+            where.append("r.block = ?")
+
+            params.append(int(block))
+
+        if years is not None:
+            where.append("r.year BETWEEN ? AND ?")
+
+            params.extend([int(years[0]), int(years[1])])
+
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = bbox
+
+            t = "e" if self.rtree else "r"
+
+            if self.rtree:
+                tables += " JOIN raster_extents e ON e.id = r.id"
+
+            where.append("%s.xmin <= ? AND %s.xmax >= ? AND %s.ymin <= ? AND %s.ymax >= ?" % (t, t, t, t))
+
+            params.extend([xmax, xmin, ymax, ymin])
+
+        sql = "SELECT %s FROM %s" % (", ".join("r." + f for f in FIELDS), tables)
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+
+        sql += " ORDER BY r.product, r.block, r.year"
+
+        return [Record(*row) for row in self.db.execute(sql, params)]
+
+
+def main_scan(db, indir, no_stats=False):
+    """
+    :param db: <str> The full path to the SQLite file
+    :param indir: <str> The directory to scan
+    :param no_stats: <bool> Skip the pixel statistics
+    :return:
+    """
+    with RasterInventory(db) as inventory:
+        changed, removed, unchanged = inventory.scan(indir, not no_stats)
+
+        print("Indexed %s rasters: %s added or updated, %s removed, %s unchanged" % (len(inventory), changed, removed,
+                                                                                    unchanged))
+
+    return None
+
+
+def main_query(db, product=None, block=None, years=None, bbox=None):
+    """
+    Print the path of every matching raster
+    :param db: <str> The full path to the SQLite file
+    :param product: <str>
+    :param block: <int>
+    :param years: <list> [first, last]
+    :param bbox: <list> [xmin, ymin, xmax, ymax]
+    :return:
+    """
+    with RasterInventory(db) as inventory:
+        for record in inventory.query(product, block, years, bbox):
+            print(record.path)
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    scan = subparsers.add_parser("scan", help="Add new and changed rasters to the index, drop removed ones")
+
+    scan.add_argument("-db", dest="db", type=str, required=True, help="The full path to the SQLite index file")
+
+    scan.add_argument("-i", dest="indir", type=str, required=True,
+                      help="The full path to the directory to scan, subdirectories are included")
+
+    scan.add_argument("--no-stats", dest="no_stats", action="store_true",
+                      help="Optional, don't read the pixels for min, max and mean")
+
+    query = subparsers.add_parser("query", help="Print the paths of the matching rasters")
+
+    query.add_argument("-db", dest="db", type=str, required=True, help="The full path to the SQLite index file")
+
+    query.add_argument("-p", dest="product", type=str, required=False, help="Optional, the product name")
+
+    query.add_argument("-b", dest="block", type=int, required=False, help="Optional, the block id")
+
+    query.add_argument("--years", dest="years", type=int, nargs=2, required=False, metavar=("FIRST", "LAST"),
+                       help="Optional, the inclusive year range")
+
+    query.add_argument("--bbox", dest="bbox", type=float, nargs=4, required=False,
+                       metavar=("XMIN", "YMIN", "XMAX", "YMAX"), help="Optional, rasters intersecting this box")
+
+    args = parser.parse_args()
+
+    command = args.command
+
+    del args.command
+
+    if command == "scan":
+        main_scan(**vars(args))
+
+    elif command == "query":
+        main_query(**vars(args))
+
+    else:
+        parser.print_help()
+
+    return None
+
+
+if __name__ == "__main__":
+    t1 = get_time()
+
+    main()
+
+    t2 = get_time()
+
+    print("Processing Time: %s" % str(t2 - t1))
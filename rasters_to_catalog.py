@@ -8,11 +8,14 @@ import arcpy
 import os
 import sys
 import datetime as dt
-import re
+from catalog_fields import write_year_field
 import argparse
 import pprint
+import gp_profiler
+import pyramids
+import virtual_catalog
 
-print sys.executable
+print(sys.executable)
 
 
 def get_time():
@@ -35,7 +38,7 @@ def describe_raster(in_raster):
 
 
 def main_work(indir, gdb_name, rc_name, outdir=None,
-              skip_exist="SKIP_EXISTING", skip_first="NONE", year_field="Year"):
+              skip_exist="SKIP_EXISTING", skip_first="NONE", year_field="Year", workers=1, catalog_type="MANAGED"):
     """
     Generate a raster catalog in a file geodatabase from all rasters in the given input directory
     :param year_field:
@@ -45,6 +48,9 @@ def main_work(indir, gdb_name, rc_name, outdir=None,
     :param outdir:
     :param gdb_name:
     :param rc_name:
+    :param workers: <int> The number of worker processes that build pyramids
+    :param catalog_type: <str> MANAGED copies the pixels into the geodatabase, UNMANAGED references the rasters in
+    place and writes a virtual_catalog document next to the geodatabase
     :return:
     """
 
@@ -81,8 +87,9 @@ def main_work(indir, gdb_name, rc_name, outdir=None,
     print("Rasters:")
     pprint.pprint(rasters)
 
-    for raster in rasters:
-        arcpy.BuildPyramids_management(raster, "", skip_first, "", "", "", skip_exist)
+    # Pyramids that are current are kept unless skip_exist asks for a rebuild
+    pyramids.build_pyramids([os.path.join(indir, r) for r in rasters], workers, skip_first,
+                            force=skip_exist != "SKIP_EXISTING")
 
     if not arcpy.Exists(file_gdb):
         arcpy.CreateFileGDB_management(outdir, gdb_name)
@@ -92,40 +99,30 @@ def main_work(indir, gdb_name, rc_name, outdir=None,
     # Arbitrarily use the spatial reference from the first raster in the list
     sr = describe_raster(rasters[0])
 
-    # Create file geodatabase managed Raster Catalog
-    arcpy.CreateRasterCatalog_management(file_gdb, rc_name, sr, sr, "", "", "", "", "MANAGED", "")
+    # Create file geodatabase Raster Catalog
+    arcpy.CreateRasterCatalog_management(file_gdb, rc_name, sr, sr, "", "", "", "", catalog_type, "")
 
     arcpy.AddMessage("Raster Catalog Created")
 
-    arcpy.RasterToGeodatabase_conversion(rasters, os.path.join(file_gdb, rc_name), "")
+    if catalog_type == "UNMANAGED":
+        # References the rasters where they are instead of loading their pixels
+        arcpy.WorkspaceToRasterCatalog_management(indir, os.path.join(file_gdb, rc_name), "", "")
 
-    arcpy.AddMessage("Rasters Loaded")
-
-    # Add the rasters to the raster catalog stored in the geodatabase
-    arcpy.AddField_management(os.path.join(file_gdb, rc_name), year_field, "DATE", "", "", "", "", "")
-
-    arcpy.AddMessage("Year Field Added")
-
-    cur = arcpy.UpdateCursor(os.path.join(file_gdb, rc_name), "")
-
-    # Parse through the rows of the raster catalog and populate the "Year" field with the appropriate date
-    for row in cur:
-
-        name = row.getValue("Name")
-
-        years = re.findall(r"\d\d\d\d", name)
-
-        if len(years) == 1:
+    else:
+        arcpy.RasterToGeodatabase_conversion(rasters, os.path.join(file_gdb, rc_name), "")
 
-            year = years[0]
+    arcpy.AddMessage("Rasters Loaded")
 
-        else:
+    # Populate the "Year" field with July 1st of the year in each raster name, the second year when a name holds two
+    write_year_field(os.path.join(file_gdb, rc_name), year_field, position=1)
 
-            year = years[1]
+    arcpy.AddMessage("Year Field Populated")
 
-        row.setValue(year_field, r"7/1/%s" % year)
+    if catalog_type == "UNMANAGED":
+        virtual_catalog.write_virtual_catalog(os.path.join(outdir, rc_name + ".json"),
+                                              [os.path.join(indir, r) for r in rasters], rc_name)
 
-        cur.updateRow(row)
+        arcpy.AddMessage("Virtual Catalog Written")
 
     return None
 
@@ -148,8 +145,25 @@ def main():
     parser.add_argument("-rc", dest="rc_name", type=str, required=True,
                         help="The name of the output raster catalog")
 
+    parser.add_argument("-w", "--workers", dest="workers", type=int, required=False, default=1,
+                        help="Optional, the number of worker processes that build pyramids, default is 1")
+
+    parser.add_argument("-t", "--catalog-type", dest="catalog_type", type=str, required=False, default="MANAGED",
+                        choices=["MANAGED", "UNMANAGED"],
+                        help="Optional, MANAGED copies the pixels into the geodatabase, UNMANAGED references the "
+                             "rasters in place and also writes <rc_name>.json next to the geodatabase.  Default is "
+                             "MANAGED")
+
+    parser.add_argument("--profile", dest="profile", type=str, required=False, metavar="PATH",
+                        help="Optional, profile the arcpy calls and write PATH.txt and PATH.trace.json at exit")
+
     args = parser.parse_args()
 
+    if args.profile:
+        gp_profiler.enable(args.profile)
+
+    del args.profile
+
     main_work(**vars(args))
 
 
@@ -0,0 +1,226 @@
+"""
+Scratch storage for the intermediate rasters of the tools, so short-lived data stays off the network share the
+products are written to.  Intermediates go to the arcpy in_memory workspace up to a size cap and spill to a scratch
+directory on local disk (or a tmpfs / RAM disk) beyond it.  Everything a Scratch made is deleted when it is closed,
+at the latest when the process exits, and scratch directories left behind by killed runs are purged by the next run:
+a scratch directory is named after the process that made it and is only removed once that process is gone.
+
+Configured with environment variables:
+    ARCPY_TOOLS_SCRATCH     The directory that holds the scratch directories, default is the system temp directory
+    ARCPY_TOOLS_SCRATCH_MB  Megabytes of intermediates kept in the in_memory workspace per process, default is 0
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import atexit
+import errno
+import os
+import re
+import shutil
+import tempfile
+import time
+import arcpy
+
+ROOT_VARIABLE = "ARCPY_TOOLS_SCRATCH"
+
+MEMORY_VARIABLE = "ARCPY_TOOLS_SCRATCH_MB"
+
+PREFIX = "arcpy_tools_"
+
+MEMORY_WORKSPACE = "in_memory"
+
+# The pid of the process that made a scratch directory, see Scratch
+OWNER = re.compile(r"^%s([0-9]+)_" % PREFIX)
+
+
+def scratch_root():
+    """
+    :return: <str> The configured scratch root directory
+    """
+    return os.environ.get(ROOT_VARIABLE) or tempfile.gettempdir()
+
+
+def process_running(pid):
+    """
+    Check whether a process is still running
+    :param pid: <int>
+    :return: <bool>
+    """
+    if os.name == "nt":
+        import ctypes
+
+        # os.kill would terminate the process on Windows, ask for its exit code instead
+        kernel32 = ctypes.windll.kernel32
+
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+
+        if not handle:
+            return False
+
+        code = ctypes.c_ulong()
+
+        try:
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        os.kill(pid, 0)
+
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+def purge_stale(root, max_age=24):
+    """
+    Remove the scratch directories of runs that are gone, e.g. runs that were killed.  A directory is kept for as
+    long as the process named in it runs, however long that is.
+    :param root: <str> The scratch root directory
+    :param max_age: <float> Hours since the last change before a directory without an owner pid in its name is removed
+    :return: <int> The number of directories removed
+    """
+    removed = 0
+
+    if not os.path.isdir(root):
+        return removed
+
+    cutoff = time.time() - max_age * 3600
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+
+        if not name.startswith(PREFIX) or not os.path.isdir(path):
+            continue
+
+        owner = OWNER.match(name)
+
+        if owner is not None:
+            stale = int(owner.group(1)) != os.getpid() and not process_running(int(owner.group(1)))
+
+        else:
+            stale = os.path.getmtime(path) < cutoff
+
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+            removed += 1
+
+    return removed
+
+
+class Scratch(object):
+    """
+    The intermediates of one run, use as a context manager or call close()
+    """
+
+    def __init__(self, memory_mb=None, root=None, max_age=24):
+        """
+        :param memory_mb: <float> Megabytes kept in the in_memory workspace, default from ARCPY_TOOLS_SCRATCH_MB
+        :param root: <str> The scratch root directory, default from ARCPY_TOOLS_SCRATCH
+        :param max_age: <float> See purge_stale
+        """
+        if memory_mb is None:
+            memory_mb = float(os.environ.get(MEMORY_VARIABLE) or 0)
+
+        self.memory_limit = int(memory_mb * 1024 * 1024)
+
+        self.memory_used = 0
+
+        root = root or scratch_root()
+
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+        purge_stale(root, max_age)
+
+        self.path = tempfile.mkdtemp(prefix="%s%d_" % (PREFIX, os.getpid()), dir=root)
+
+        # Path -> bytes held in memory, 0 for files
+        self._items = dict()
+
+        self._count = 0
+
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+        return False
+
+    def raster(self, name, nbytes=None):
+        """
+        Return the path for a new intermediate raster, in memory while it fits under the cap, on disk otherwise
+        :param name: <str> A file name, e.g. tile_3.tif, made unique within this Scratch
+        :param nbytes: <int> The expected size in bytes, rasters of unknown size go to disk
+        :return: <str>
+        """
+        self._count += 1
+
+        stem, ext = os.path.splitext(name)
+
+        if nbytes is not None and self.memory_used + nbytes <= self.memory_limit:
+            path = "%s%s%s_%d" % (MEMORY_WORKSPACE, os.sep, stem, self._count)
+
+            self.memory_used += nbytes
+
+            self._items[path] = nbytes
+
+            return path
+
+        path = os.path.join(self.path, "%s_%d%s" % (stem, self._count, ext))
+
+        self._items[path] = 0
+
+        return path
+
+    def directory(self, name):
+        """
+        Return a new directory on disk for intermediates, e.g. the scratch workspace of a worker process
+        :param name: <str>
+        :return: <str>
+        """
+        self._count += 1
+
+        path = os.path.join(self.path, "%s_%d" % (name, self._count))
+
+        os.makedirs(path)
+
+        return path
+
+    def release(self, path):
+        """
+        Delete an intermediate raster before the Scratch is closed
+        :param path: <str> A path returned by raster
+        :return:
+        """
+        nbytes = self._items.pop(path, 0)
+
+        self.memory_used -= nbytes
+
+        if arcpy.Exists(path):
+            arcpy.Delete_management(path)
+
+        return None
+
+    def close(self):
+        """
+        Delete every intermediate
+        :return:
+        """
+        for path in list(self._items):
+            try:
+                self.release(path)
+
+            except Exception:
+                # A raster still locked by arcpy is left to the directory removal and purge_stale
+                pass
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+        return None
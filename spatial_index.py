@@ -0,0 +1,132 @@
+"""
+A packed, read-only spatial index over bounding boxes using the Sort-Tile-Recursive (STR) R-tree bulk loading
+algorithm.  The tree is built once from the complete list of items and is then only queried, which is the access
+pattern of the overlap counting and clipping tools.
+
+Written in plain python so that it works with the ArcGIS python 2.7 interpreter without any extra packages.
+"""
+
+import math
+
+
+def extent_to_bbox(extent):
+    """
+    Convert an arcpy Extent object to a bounding box tuple
+    :param extent: <arcpy.Extent>
+    :return: <tuple> (xmin, ymin, xmax, ymax)
+    """
+    return extent.XMin, extent.YMin, extent.XMax, extent.YMax
+
+
+def bbox_intersects(a, b):
+    """
+    Check whether two bounding boxes intersect, touching edges count as an intersection
+    :param a: <tuple> (xmin, ymin, xmax, ymax)
+    :param b: <tuple> (xmin, ymin, xmax, ymax)
+    :return: <bool>
+    """
+    return not (a[2] < b[0] or b[2] < a[0] or a[3] < b[1] or b[3] < a[1])
+
+
+def bbox_union(boxes):
+    """
+    Return the bounding box that contains all of the given bounding boxes
+    :param boxes: <iterable> Bounding box tuples
+    :return: <tuple> (xmin, ymin, xmax, ymax)
+    """
+    boxes = list(boxes)
+
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class STRTree(object):
+    """
+    Static R-tree bulk loaded with the Sort-Tile-Recursive algorithm.  Every node is stored as a tuple of
+    (bbox, children, is_leaf) where the children of a leaf node are the original (bbox, value) items.
+    """
+
+    def __init__(self, items, node_capacity=16):
+        """
+        :param items: <iterable> (bbox, value) pairs, bbox is a (xmin, ymin, xmax, ymax) tuple
+        :param node_capacity: <int> The maximum number of children per node
+        """
+        if node_capacity < 2:
+            raise ValueError("node_capacity must be at least 2")
+
+        self.node_capacity = node_capacity
+
+        self._items = [(tuple(bbox), value) for bbox, value in items]
+
+        self._root = None
+
+        if self._items:
+            self._root = self._build()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _pack(self, entries, is_leaf):
+        """
+        Group one level of entries into parent nodes
+        :param entries: <list> (bbox, ...) tuples
+        :param is_leaf: <bool> Whether the new nodes hold the original items
+        :return: <list> The parent nodes
+        """
+        cap = self.node_capacity
+
+        n_nodes = int(math.ceil(len(entries) / float(cap)))
+
+        n_slices = int(math.ceil(math.sqrt(n_nodes)))
+
+        slice_size = n_slices * cap
+
+        # Sort by the x-center to cut vertical slices, then by the y-center within each slice
+        entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+
+        nodes = list()
+
+        for i in range(0, len(entries), slice_size):
+            vertical = sorted(entries[i:i + slice_size], key=lambda e: e[0][1] + e[0][3])
+
+            for j in range(0, len(vertical), cap):
+                children = vertical[j:j + cap]
+
+                nodes.append((bbox_union(c[0] for c in children), children, is_leaf))
+
+        return nodes
+
+    def _build(self):
+        nodes = self._pack(self._items, True)
+
+        while len(nodes) > 1:
+            nodes = self._pack(nodes, False)
+
+        return nodes[0]
+
+    def query(self, bbox):
+        """
+        Return the values of all items whose bounding box intersects the given bounding box
+        :param bbox: <tuple> (xmin, ymin, xmax, ymax)
+        :return: <list>
+        """
+        results = list()
+
+        if self._root is None:
+            return results
+
+        stack = [self._root]
+
+        while stack:
+            node_bbox, children, is_leaf = stack.pop()
+
+            if not bbox_intersects(node_bbox, bbox):
+                continue
+
+            if is_leaf:
+                results.extend(value for item_bbox, value in children if bbox_intersects(item_bbox, bbox))
+
+            else:
+                stack.extend(children)
+
+        return results
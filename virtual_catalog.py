@@ -0,0 +1,136 @@
+"""
+A reference-only description of a raster catalog.  Next to an UNMANAGED raster catalog, which points at the rasters
+in place instead of copying their pixels into the file geodatabase, the catalog builders write a small JSON document
+with the footprint, year, nodata value, grid, overview state and file path of every raster, so that tools outside
+ArcMap can find the rasters of a catalog without opening the geodatabase.
+
+Layout:
+    {
+        "name": "ChangeMap",
+        "spatial_reference": "<WKT of the first raster>",
+        "rasters": [
+            {"name": "ChangeMap_block_1_1984", "path": "../ChangeMap/block_1/ChangeMap_block_1_1984.tif",
+             "year": 1984, "footprint": [xmin, ymin, xmax, ymax], "width": 500, "height": 500,
+             "cell_size": [30.0, 30.0], "pixel_type": "U8", "nodata": 255, "srid": 0,
+             "overviews": {"built": true, "resampling": "NEAREST"}},
+            ...
+        ]
+    }
+
+Paths are relative to the JSON file when they can be, so that a tree of rasters and catalogs can be moved as a whole.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import json
+import os
+import arcpy
+import pyramids
+from raster_index import parse_years
+
+
+def describe_raster(raster):
+    """
+    Return the catalog entry of one raster, without the year
+    :param raster: <str> The full path to the raster
+    :return: <dict>
+    """
+    desc = arcpy.Describe(raster)
+
+    e = desc.extent
+
+    return {"name": os.path.splitext(os.path.basename(raster))[0],
+            "path": os.path.abspath(raster),
+            "footprint": [e.XMin, e.YMin, e.XMax, e.YMax],
+            "width": desc.width,
+            "height": desc.height,
+            "cell_size": [desc.meanCellWidth, desc.meanCellHeight],
+            "pixel_type": desc.pixelType,
+            "nodata": desc.noDataValue,
+            "srid": desc.spatialReference.factoryCode,
+            "overviews": {"built": os.path.exists(raster + ".ovr"), "resampling": pyramids.resampling(raster)}}
+
+
+def relative_path(path, start):
+    """
+    Return path relative to start, or the absolute path when there is no relative one (another drive)
+    :param path: <str>
+    :param start: <str>
+    :return: <str>
+    """
+    try:
+        return os.path.relpath(path, start)
+
+    except ValueError:
+        return os.path.abspath(path)
+
+
+def write_virtual_catalog(out_json, rasters, name, position=1):
+    """
+    Describe the rasters and write the catalog document, replacing an existing one
+    :param out_json: <str> The full path to the output JSON file
+    :param rasters: <list> Full paths to the rasters
+    :param name: <str> The catalog name
+    :param position: <int> Which year to use when a raster name holds more than one, see raster_index.parse_year
+    :return: <dict> The catalog document
+    """
+    # Raises for every raster name without a usable year before anything is written
+    years = parse_years(rasters, position)
+
+    out_dir = os.path.dirname(os.path.abspath(out_json))
+
+    entries = list()
+
+    for raster, year in zip(rasters, years):
+        entry = describe_raster(raster)
+
+        entry["path"] = relative_path(entry["path"], out_dir)
+
+        entry["year"] = year
+
+        entries.append(entry)
+
+    doc = {"name": name,
+           "spatial_reference": arcpy.Describe(rasters[0]).spatialReference.exportToString() if rasters else None,
+           "rasters": entries}
+
+    with open(out_json + ".tmp", "w") as f:
+        json.dump(doc, f, indent=1, sort_keys=True)
+
+    if os.path.exists(out_json):
+        os.remove(out_json)
+
+    os.rename(out_json + ".tmp", out_json)
+
+    return doc
+
+
+def read_virtual_catalog(in_json):
+    """
+    Read a catalog document, with the raster paths made absolute
+    :param in_json: <str> The full path to the JSON file
+    :return: <dict> See the module docstring
+    """
+    with open(in_json) as f:
+        doc = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(in_json))
+
+    for entry in doc["rasters"]:
+        entry["path"] = os.path.normpath(os.path.join(base, entry["path"]))
+
+    return doc
+
+
+def rasters_by_year(doc):
+    """
+    Group the rasters of a catalog document by year
+    :param doc: <dict> See read_virtual_catalog
+    :return: <dict> Year -> list of raster entries
+    """
+    by_year = dict()
+
+    for entry in doc["rasters"]:
+        by_year.setdefault(entry["year"], list()).append(entry)
+
+    return by_year
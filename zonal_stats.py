@@ -0,0 +1,177 @@
+"""
+Per-feature, per-year zonal statistics of the clip outputs, computed by the numpy clip engine from the pixels it
+already holds instead of a second job that reads every output again.  All of the statistics of a run go to one table,
+one row per block, year and value:
+
+    block, year, value, count, min, max, mean
+
+For categorical products (CoverPrim, ChangeMap, ...) there is a row for every value in the block, so the rows of a
+block and year are its class histogram.  Continuous products (ChangeMagMap, SegLength, ...) are summarized as two
+rows, value 0 for the pixels that are 0 and value 1 for the others with their min, max and mean.  For every product the
+change-pixel count of a block and year is the sum of count over the rows with a value other than 0.  Pixels outside of
+the feature and nodata pixels are not counted.
+
+The table is a CSV file when its name ends with .csv, otherwise it is written with arcpy.da.NumPyArrayToTable, e.g. to
+a file geodatabase table or a .dbf file.
+
+****Requires the ArcGIS python interpreter****
+
+"""
+import csv
+import numbers
+import os
+import numpy as np
+import arcpy
+from pyramids import CONTINUOUS_PRODUCTS
+
+FIELDS = ["block", "year", "value", "count", "min", "max", "mean"]
+
+# Integer pixels below this are counted with np.bincount, others with np.unique
+BINCOUNT_LIMIT = 1 << 16
+
+
+def is_continuous(product):
+    """
+    :param product: <str> The product name, e.g. ChangeMagMap
+    :return: <bool> True when the product is summarized instead of histogrammed
+    """
+    return any(p in product for p in CONTINUOUS_PRODUCTS)
+
+
+def summarize(data, continuous=False, nodata=None):
+    """
+    Return the statistics of the pixels of one clip
+    :param data: <numpy.ndarray> The clipped pixels
+    :param continuous: <bool> See is_continuous
+    :param nodata: <int> The value of the pixels that are not counted
+    :return: <list> (value, count, min, max, mean) tuples
+    """
+    values = data[data != nodata] if nodata is not None else data.ravel()
+
+    if continuous:
+        groups = list()
+
+        zero = values == 0
+
+        for value, group in ((0, values[zero]), (1, values[~zero])):
+            if group.size:
+                groups.append((value, int(group.size), float(group.min()), float(group.max()),
+                               float(group.mean(dtype=np.float64))))
+
+        return groups
+
+    if values.dtype.kind in "ui" and values.size and 0 <= values.min() and values.max() < BINCOUNT_LIMIT:
+        counts = np.bincount(values.astype(np.int64))
+
+        classes = np.flatnonzero(counts)
+
+        counts = counts[classes]
+
+    else:
+        classes, counts = np.unique(values, return_counts=True)
+
+    return [(v, int(c), float(v), float(v), float(v)) for v, c in zip(classes.tolist(), counts.tolist())]
+
+
+class ZonalStats(object):
+    """
+    Collects the statistics of a run and writes them as one table
+    """
+
+    def __init__(self, product, nodata=None):
+        """
+        :param product: <str> The product name, see is_continuous
+        :param nodata: <int> The nodata value of the clip outputs
+        """
+        self.product = product
+
+        self.continuous = is_continuous(product)
+
+        self.nodata = nodata
+
+        self.rows = list()
+
+    def add(self, block, year, groups):
+        """
+        :param block: The block id
+        :param year: <int>
+        :param groups: <list> See summarize
+        :return:
+        """
+        self.rows.extend((block, int(year)) + tuple(g) for g in groups)
+
+        return None
+
+    def add_data(self, block, year, data):
+        """
+        :param block: The block id
+        :param year: <int>
+        :param data: <numpy.ndarray> The clipped pixels
+        :return:
+        """
+        return self.add(block, year, summarize(data, self.continuous, self.nodata))
+
+    def add_raster(self, block, year, raster):
+        """
+        Read the statistics of an output that was not made in this run from the output itself
+        :param block: The block id
+        :param year: <int>
+        :param raster: <str> The full path to the clip output
+        :return:
+        """
+        return self.add_data(block, year, arcpy.RasterToNumPyArray(raster, nodata_to_value=self.nodata))
+
+    def table(self):
+        """
+        :return: <numpy.ndarray> The rows as a structured array sorted by block, year and value
+        """
+        rows = sorted(self.rows)
+
+        if all(isinstance(r[0], numbers.Integral) for r in rows):
+            block = np.int32
+
+        else:
+            block = "U%d" % max([len(str(r[0])) for r in rows] + [1])
+
+            rows = [(str(r[0]),) + r[1:] for r in rows]
+
+        value = np.float64 if any(isinstance(r[2], float) for r in rows) else np.int32
+
+        dtype = [("block", block), ("year", np.int32), ("value", value), ("count", np.int32), ("min", np.float64),
+                 ("max", np.float64), ("mean", np.float64)]
+
+        return np.array(rows, dtype=dtype)
+
+    def write(self, out_table):
+        """
+        Write the table, replacing an existing one
+        :param out_table: <str> A .csv file or an arcpy table path
+        :return: <int> The number of rows written
+        """
+        table = self.table()
+
+        if out_table.lower().endswith(".csv"):
+            mode = "wb" if str is bytes else "w"
+
+            kwargs = dict() if str is bytes else {"newline": ""}
+
+            with open(out_table, mode, **kwargs) as f:
+                writer = csv.writer(f)
+
+                writer.writerow(FIELDS)
+
+                writer.writerows(table.tolist())
+
+            return len(table)
+
+        if arcpy.Exists(out_table):
+            arcpy.Delete_management(out_table)
+
+        directory = os.path.dirname(out_table)
+
+        if directory and not os.path.exists(directory) and not directory.lower().endswith(".gdb"):
+            os.makedirs(directory)
+
+        arcpy.da.NumPyArrayToTable(table, out_table)
+
+        return len(table)